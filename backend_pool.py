@@ -0,0 +1,150 @@
+import time
+import random
+import logging
+import threading
+import requests
+import ollama_client
+
+# Ollama 服务器池：多个地址按权重分担请求，定期探测 /api/tags 获取健康状态和模型列表，
+# 每个请求发往拥有该模型、且在途请求数（按权重折算）最少的服务器
+
+BACKEND_CONFIG = {
+    "PROBE_INTERVAL": 30,
+    "PROBE_TIMEOUT": 10
+}
+
+
+class Backend:
+    def __init__(self, url, weight=1.0):
+        self.url = url.rstrip("/")
+        self.weight = max(float(weight), 0.01)
+        self.healthy = True
+        self.models = {}
+        self.outstanding = 0
+        self.completed = 0
+        self.failures = 0
+        self.last_probe = 0
+
+    def describe(self):
+        state = "正常" if self.healthy else "不可用"
+        return f"{self.url} [权重 {self.weight:g}] {state}, 在途 {self.outstanding}, 完成 {self.completed}, 失败 {self.failures}, 模型 {len(self.models)} 个"
+
+
+_backends = []
+_lock = threading.Lock()
+_probe_thread = None
+
+
+# 解析服务器列表文本：每行一个地址，地址后可加空格和权重
+def parse_backends(text):
+    backends = []
+    for line in (text or "").splitlines():
+        parts = line.split()
+        if not parts:
+            continue
+        weight = parts[1] if len(parts) > 1 else 1
+        backends.append((parts[0], weight))
+    return backends
+
+
+def configure(backends):
+    global _backends
+    with _lock:
+        existing = {backend.url: backend for backend in _backends}
+        new_backends = []
+        for url, weight in backends:
+            backend = existing.get(url.rstrip("/")) or Backend(url, weight)
+            backend.weight = max(float(weight), 0.01)
+            new_backends.append(backend)
+        _backends = new_backends
+    _start_probe_thread()
+
+
+def get_backends():
+    with _lock:
+        return list(_backends)
+
+
+# 探测单个服务器，返回其模型列表
+def probe(backend):
+    try:
+        response = ollama_client.get(f"{backend.url}/tags", timeout=BACKEND_CONFIG["PROBE_TIMEOUT"])
+        response.raise_for_status()
+        models = response.json().get("models", [])
+        with _lock:
+            backend.models = {model["name"]: model for model in models}
+            if not backend.healthy:
+                logging.info(f"Ollama 服务器恢复: {backend.url}")
+            backend.healthy = True
+        return models
+    except requests.RequestException as e:
+        logging.error(f"Error fetching models from {backend.url}: {e}")
+        with _lock:
+            backend.healthy = False
+        return []
+    finally:
+        backend.last_probe = time.time()
+
+
+# 探测所有服务器，返回合并后的模型列表（同名模型只保留一个）
+def refresh_models():
+    merged = {}
+    for backend in get_backends():
+        for model in probe(backend):
+            merged.setdefault(model["name"], model)
+    return list(merged.values())
+
+
+def _probe_loop():
+    while True:
+        time.sleep(BACKEND_CONFIG["PROBE_INTERVAL"])
+        for backend in get_backends():
+            probe(backend)
+
+
+def _start_probe_thread():
+    global _probe_thread
+    if _probe_thread is None:
+        _probe_thread = threading.Thread(target=_probe_loop, name="backend-probe", daemon=True)
+        _probe_thread.start()
+
+
+# 为请求选择服务器：优先选择健康且拥有该模型的服务器，再按 在途请求数/权重 取最小
+def acquire(model):
+    with _lock:
+        if not _backends:
+            raise requests.ConnectionError("没有可用的 Ollama 服务器。")
+        healthy = [backend for backend in _backends if backend.healthy] or _backends
+        candidates = [backend for backend in healthy if model in backend.models] or healthy
+        lowest = min((backend.outstanding + 1) / backend.weight for backend in candidates)
+        backend = random.choice([backend for backend in candidates if (backend.outstanding + 1) / backend.weight == lowest])
+        backend.outstanding += 1
+        return backend
+
+
+# 被取消的请求（cancelled）不计入完成或失败次数
+def release(backend, error=None, cancelled=False):
+    with _lock:
+        backend.outstanding -= 1
+        if cancelled:
+            return
+        if error is None:
+            backend.completed += 1
+        else:
+            backend.failures += 1
+            if isinstance(error, requests.ConnectionError) and backend.healthy:
+                # 连接失败的服务器在下次探测成功之前不再分配请求
+                backend.healthy = False
+                logging.warning(f"Ollama 服务器连接失败，暂停分配请求: {backend.url}")
+
+
+# 由故障恢复流程设置服务器状态：恢复期间不再分配新请求
+def set_healthy(url, healthy):
+    with _lock:
+        for backend in _backends:
+            if backend.url == url:
+                backend.healthy = healthy
+
+
+def format_status():
+    return "\n".join(backend.describe() for backend in get_backends())
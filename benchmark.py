@@ -0,0 +1,448 @@
+import os
+import sys
+import json
+import time
+import random
+import shutil
+import logging
+import argparse
+import platform
+import threading
+import subprocess
+import psutil
+import requests
+from datetime import datetime
+from PIL import Image
+import backend_pool
+import concurrency_controller
+import result_cache
+import image_preprocess
+import streaming
+import model_residency
+import job_journal
+import dataset_index
+import text_transform
+import ollama_client
+import inference_engine
+import tagging_core
+
+# 基准测试：启动本地模拟 Ollama 服务器（mock_ollama.py，独立进程，不与被测代码争用 GIL），
+# 在生成的数据集上运行各批量模式和文字工具，统计每秒文件数、单项耗时 p50/p99、峰值内存和收发字节数，
+# 结果追加到 benchmark_results.jsonl，可按版本比较是否变慢
+#
+#   python benchmark.py run --files 1000 --scenarios tag,refine,transform --latency 0.05 --concurrency 8
+#   python benchmark.py run --files 100000 --scenarios transform,search --label 新扫描器
+#   python benchmark.py compare                       # 每个场景的最新结果与上一个版本比较
+#   python benchmark.py compare --baseline a1b2c3d    # 与指定版本（或 --label）比较
+
+BENCHMARK_CONFIG = {
+    "DATA_DIR": "benchmark_data",
+    "WORK_DIR": "benchmark_work",
+    "RESULTS_FILE": "benchmark_results.jsonl",
+    # 生成数据集时每个子目录的文件数
+    "FILES_PER_DIR": 1000,
+    "IMAGE_SIDE": 256,
+    # 峰值内存的采样间隔（秒）
+    "RSS_INTERVAL": 0.05,
+    # 比较时变差超过该比例视为性能回退
+    "REGRESSION_THRESHOLD": 0.1,
+    "TAG_PROMPT": "Describe this picture in detail",
+    "REFINE_PROMPT": "Rewrite as comma separated tags: {}",
+    "TRANSFORM_RULES": "替换: girl => 1girl\n替换: outdoors => outside\n正则: \\s+, => ,\n去重\n修剪",
+    "SEARCH_QUERIES": [("girl", "包含文字"), ("blue sky", "完整词语"), ("smile AND hat", "布尔表达式"), ("^solo", "正则表达式")]
+}
+
+# 比较时的指标和方向：True 表示越大越好
+COMPARE_METRICS = {
+    "files_per_sec": True,
+    "latency_p50": False,
+    "latency_p99": False,
+    "peak_rss_mb": False,
+    "bytes_sent": False
+}
+
+TAGS = ("girl", "outdoors", "smile", "long hair", "blue sky", "dress", "sitting", "flowers", "looking at viewer",
+        "solo", "tree", "day", "cloud", "standing", "hat", "brown eyes", "grass", "upper body", "white shirt", "sunlight")
+
+
+def _dataset_path(index, extension):
+    return os.path.join(f"d{index // BENCHMARK_CONFIG['FILES_PER_DIR']:04d}", f"f{index:07d}{extension}")
+
+
+# 生成数据集：images 为图片（同一张图片的硬链接，不支持时复制），captions 为 txt 标签文件；
+# 生成完成后写入标记文件，之后直接复用
+def prepare_dataset(kind, files):
+    name = f"{kind}-{files}-{BENCHMARK_CONFIG['IMAGE_SIDE']}px" if kind == "images" else f"{kind}-{files}"
+    folder = os.path.join(BENCHMARK_CONFIG["DATA_DIR"], name)
+    marker = os.path.join(folder, ".complete")
+    if os.path.exists(marker):
+        return folder
+    logging.warning(f"生成数据集 {folder}（{files} 个文件）")
+    shutil.rmtree(folder, ignore_errors=True)
+    os.makedirs(folder)
+    source = None
+    if kind == "images":
+        side = BENCHMARK_CONFIG["IMAGE_SIDE"]
+        source = os.path.join(folder, "source.jpg.orig")
+        Image.effect_noise((side, side), 64).convert("RGB").save(source, "JPEG", quality=90)
+    for index in range(files):
+        path = os.path.join(folder, _dataset_path(index, ".jpg" if kind == "images" else ".txt"))
+        if index % BENCHMARK_CONFIG["FILES_PER_DIR"] == 0:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+        if source is None:
+            with open(path, "w") as file:
+                file.write("")
+            continue
+        try:
+            os.link(source, path)
+        except OSError:
+            shutil.copyfile(source, path)
+    with open(marker, "w") as file:
+        file.write(str(files))
+    return folder
+
+
+# 每次运行前恢复数据集的初始状态：images 删除上次生成的 txt，captions 重写为固定的随机标签
+def reset_dataset(kind, folder, seed=0):
+    rng = random.Random(seed)
+    for root, _, names in os.walk(folder):
+        for name in names:
+            if not name.endswith(".txt"):
+                continue
+            path = os.path.join(root, name)
+            if kind == "images":
+                os.unlink(path)
+            else:
+                with open(path, "w") as file:
+                    file.write(", ".join(rng.choice(TAGS) for _ in range(rng.randint(10, 40))))
+
+
+def _percentile(values, quantile):
+    if not values:
+        return None
+    values = sorted(values)
+    return values[min(int(quantile * len(values)), len(values) - 1)]
+
+
+# 后台采样当前进程的常驻内存，记录峰值
+class RssSampler:
+    def __init__(self):
+        self.process = psutil.Process()
+        self.start_rss = self.process.memory_info().rss
+        self.peak_rss = self.start_rss
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name="rss-sampler", daemon=True)
+
+    def _run(self):
+        while not self._stop.wait(BENCHMARK_CONFIG["RSS_INTERVAL"]):
+            self.peak_rss = max(self.peak_rss, self.process.memory_info().rss)
+
+    def start(self):
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._stop.set()
+        self._thread.join()
+        self.peak_rss = max(self.peak_rss, self.process.memory_info().rss)
+
+
+def _run_tag(folder, args, progress):
+    return tagging_core.process_folder_images(args.vision_models[0], BENCHMARK_CONFIG["TAG_PROMPT"], folder, "覆盖", "GPU", args.concurrency,
+                                              progress=progress, scope="基准测试")
+
+
+def _run_tag_refine(folder, args, progress):
+    return tagging_core.process_folder_images(args.vision_models[0], BENCHMARK_CONFIG["TAG_PROMPT"], folder, "覆盖", "GPU", args.concurrency,
+                                              refine_model=args.text_models[0], prompt2=BENCHMARK_CONFIG["REFINE_PROMPT"],
+                                              progress=progress, scope="基准测试")
+
+
+def _run_multi(folder, args, progress):
+    extra_model = args.vision_models[1] if len(args.vision_models) > 1 else args.vision_models[0]
+    return tagging_core.process_folder_multiple(args.vision_models[0], BENCHMARK_CONFIG["TAG_PROMPT"], folder, "覆盖",
+                                                extra_model, True, None, False, None, False,
+                                                args.text_models[0], True, False, "GPU", BENCHMARK_CONFIG["REFINE_PROMPT"], args.concurrency,
+                                                window_size=args.window_size, progress=progress, scope="基准测试")
+
+
+def _run_refine(folder, args, progress):
+    return tagging_core.process_refine(folder, args.text_models[0], BENCHMARK_CONFIG["REFINE_PROMPT"], "GPU", args.concurrency,
+                                       progress=progress, scope="基准测试")
+
+
+def _run_transform(folder, args, progress):
+    report = text_transform.transform_folder(folder, text_transform.parse_rules(BENCHMARK_CONFIG["TRANSFORM_RULES"]))
+    return report.format()
+
+
+# 重新建立索引（不复用上次的索引文件）后依次执行各种搜索，每次搜索的耗时作为单项耗时
+def _run_search(folder, args, progress):
+    db_path = os.path.join(BENCHMARK_CONFIG["WORK_DIR"], f"search-{time.time_ns()}.sqlite3")
+    index = dataset_index.DatasetIndex(folder, db_path)
+    started = time.perf_counter()
+    index.refresh()
+    lines = [f"建立索引 {time.perf_counter() - started:.2f}秒"]
+    for _ in range(args.search_repeat):
+        for text, mode in BENCHMARK_CONFIG["SEARCH_QUERIES"]:
+            started = time.perf_counter()
+            matches = index.search_captions(text, mode=mode)
+            elapsed = time.perf_counter() - started
+            progress({"item": f"{mode}: {text}", "result": f"{len(matches)} 个结果", "elapsed": elapsed})
+    lines.append(f"搜索 {args.search_repeat * len(BENCHMARK_CONFIG['SEARCH_QUERIES'])} 次")
+    return "\n".join(lines)
+
+
+# 场景名称: (数据集类型, 运行函数, 是否发送推理请求)
+SCENARIOS = {
+    "tag": ("images", _run_tag, True),
+    "tag_refine": ("images", _run_tag_refine, True),
+    "multi": ("images", _run_multi, True),
+    "refine": ("captions", _run_refine, True),
+    "transform": ("captions", _run_transform, False),
+    "search": ("captions", _run_search, False)
+}
+
+
+def get_version():
+    try:
+        version = subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True, check=True,
+                                 cwd=os.path.dirname(os.path.abspath(__file__))).stdout.strip()
+        dirty = subprocess.run(["git", "diff", "--quiet", "HEAD"], cwd=os.path.dirname(os.path.abspath(__file__))).returncode != 0
+        return version + ("-dirty" if dirty else "")
+    except (OSError, subprocess.CalledProcessError):
+        return "unknown"
+
+
+def start_mock_server(args):
+    command = [sys.executable, os.path.join(os.path.dirname(os.path.abspath(__file__)), "mock_ollama.py"), "--port", "0",
+               "--latency", str(args.latency), "--distribution", args.distribution, "--jitter", str(args.jitter),
+               "--slots", str(args.slots), "--load-delay", str(args.load_delay), "--max-loaded", str(args.max_loaded),
+               "--timeout-rate", str(args.timeout_rate), "--hang-seconds", str(args.hang_seconds),
+               "--drop-rate", str(args.drop_rate), "--error-rate", str(args.error_rate),
+               "--response-words", str(args.response_words), "--seed", str(args.seed)]
+    process = subprocess.Popen(command, stdout=subprocess.PIPE, text=True)
+    url = process.stdout.readline().strip()
+    if not url:
+        process.kill()
+        raise RuntimeError("模拟服务器启动失败")
+    return process, url
+
+
+def get_mock_stats(url):
+    try:
+        response = requests.get(url.rsplit("/api", 1)[0] + "/mock/stats", timeout=5)
+        response.raise_for_status()
+        return response.json()
+    except (requests.RequestException, ValueError):
+        return None
+
+
+def run_scenario(name, args, backend_url):
+    kind, function, uses_backend = SCENARIOS[name]
+    folder = prepare_dataset(kind, args.files)
+    reset_dataset(kind, folder, args.seed)
+    latencies = []
+    summary = {}
+
+    def progress(update):
+        if "summary" in update:
+            summary.update(update["summary"])
+        else:
+            latencies.append(update["elapsed"])
+
+    before = get_mock_stats(backend_url) if uses_backend else None
+    sampler = RssSampler().start()
+    started = time.perf_counter()
+    output = function(folder, args, progress)
+    elapsed = time.perf_counter() - started
+    sampler.stop()
+    after = get_mock_stats(backend_url) if uses_backend else None
+
+    def mock_delta(key):
+        if before is None or after is None:
+            return None
+        return after.get(key, 0) - before.get(key, 0)
+
+    requests_sent = mock_delta("requests")
+    return {
+        "time": datetime.now().isoformat(timespec="seconds"),
+        "version": args.version,
+        "label": args.label,
+        "scenario": name,
+        "files": args.files,
+        "elapsed": round(elapsed, 3),
+        "files_per_sec": round(args.files / elapsed, 2) if elapsed else None,
+        "requests": requests_sent,
+        "requests_per_sec": round(requests_sent / elapsed, 2) if requests_sent and elapsed else None,
+        "latency_p50": _percentile(latencies, 0.5),
+        "latency_p99": _percentile(latencies, 0.99),
+        "failed": summary.get("failed", 0),
+        "peak_rss_mb": round(sampler.peak_rss / 1024 ** 2, 1),
+        "rss_growth_mb": round((sampler.peak_rss - sampler.start_rss) / 1024 ** 2, 1),
+        "bytes_sent": mock_delta("bytes_received"),
+        "bytes_received": mock_delta("bytes_sent"),
+        "model_loads": mock_delta("loads"),
+        "models": summary.get("models"),
+        "output": output.splitlines()[0] if output else "",
+        "config": {key: getattr(args, key) for key in ("concurrency", "adaptive", "preprocess", "result_cache", "stream", "warmup", "vram_gb", "latency", "distribution", "jitter",
+                                                        "slots", "load_delay", "max_loaded", "timeout_rate", "drop_rate", "error_rate", "response_words", "seed")},
+        "python": platform.python_version(),
+        "platform": platform.platform()
+    }
+
+
+def format_result(result):
+    parts = [f"{result['scenario']:<11} {result['files']} 个文件 {result['elapsed']:.2f}秒", f"{result['files_per_sec']} 文件/秒"]
+    if result["latency_p50"] is not None:
+        parts.append(f"p50 {result['latency_p50']:.3f}秒 p99 {result['latency_p99']:.3f}秒")
+    parts.append(f"峰值内存 {result['peak_rss_mb']}MB")
+    if result["bytes_sent"] is not None:
+        parts.append(f"发送 {result['bytes_sent'] / 1024 ** 2:.1f}MB")
+    if result["failed"]:
+        parts.append(f"失败 {result['failed']}")
+    return ", ".join(parts)
+
+
+def append_result(result):
+    with open(BENCHMARK_CONFIG["RESULTS_FILE"], "a", encoding="utf-8") as file:
+        file.write(json.dumps(result, ensure_ascii=False) + "\n")
+
+
+# 所有运行都使用独立的任务记录、索引和提示词历史，不影响正常使用的数据
+def isolate_state(args, backend_url):
+    work_dir = BENCHMARK_CONFIG["WORK_DIR"]
+    shutil.rmtree(work_dir, ignore_errors=True)
+    os.makedirs(work_dir)
+    job_journal.JOURNAL_CONFIG["JOBS_DIR"] = os.path.join(work_dir, "jobs")
+    dataset_index.INDEX_CONFIG["INDEX_DIR"] = os.path.join(work_dir, "index")
+    tagging_core.CONFIG["HISTORY_PROMPTS_FILE"] = os.path.join(work_dir, "history_prompts.csv")
+    backend_pool.configure([(backend_url, 1)])
+    concurrency_controller.set_enabled(args.adaptive)
+    result_cache.set_enabled(args.result_cache)
+    streaming.configure(args.stream, 0, 0)
+    model_residency.configure(args.warmup, args.vram_gb)
+    image_preprocess.configure(args.preprocess, image_preprocess.PREPROCESS_CONFIG["MAX_SIDE"],
+                               image_preprocess.PREPROCESS_CONFIG["FORMAT"], image_preprocess.PREPROCESS_CONFIG["QUALITY"])
+
+
+def command_run(args):
+    scenarios = [name.strip() for name in args.scenarios.split(",") if name.strip()]
+    unknown = [name for name in scenarios if name not in SCENARIOS]
+    if unknown:
+        print(f"未知的场景: {', '.join(unknown)}，可选: {', '.join(SCENARIOS)}", file=sys.stderr)
+        return 2
+    args.version = get_version()
+    mock_process = None
+    backend_url = args.backend
+    if not backend_url and any(SCENARIOS[name][2] for name in scenarios):
+        mock_process, backend_url = start_mock_server(args)
+    try:
+        isolate_state(args, backend_url or "http://127.0.0.1:1/api")
+        for name in scenarios:
+            for _ in range(args.repeat):
+                result = run_scenario(name, args, backend_url)
+                append_result(result)
+                print(format_result(result), flush=True)
+    finally:
+        inference_engine.run_sync(ollama_client.close_async_session())
+        if mock_process is not None:
+            mock_process.terminate()
+            mock_process.wait()
+    return 0
+
+
+def load_results():
+    if not os.path.exists(BENCHMARK_CONFIG["RESULTS_FILE"]):
+        return []
+    with open(BENCHMARK_CONFIG["RESULTS_FILE"], "r", encoding="utf-8") as file:
+        return [json.loads(line) for line in file if line.strip()]
+
+
+# 每个 (场景, 文件数) 取最新一次运行，与基准版本（默认为之前最近的另一个版本）的最后一次运行比较；
+# 有指标变差超过阈值时返回 1
+def command_compare(args):
+    results = load_results()
+    groups = {}
+    for result in results:
+        groups.setdefault((result["scenario"], result["files"]), []).append(result)
+    regressions = 0
+    for (scenario, files), runs in sorted(groups.items()):
+        current = runs[-1]
+        if args.baseline:
+            candidates = [run for run in runs[:-1] if args.baseline in (run["version"], run["label"])]
+        else:
+            candidates = [run for run in runs[:-1] if (run["version"], run["label"]) != (current["version"], current["label"])]
+        if not candidates:
+            continue
+        baseline = candidates[-1]
+        print(f"{scenario} {files} 个文件: {baseline['version']}{' ' + baseline['label'] if baseline['label'] else ''} -> "
+              f"{current['version']}{' ' + current['label'] if current['label'] else ''}")
+        if baseline.get("config") != current.get("config"):
+            print("  注意: 两次运行的配置不同")
+        for metric, higher_is_better in COMPARE_METRICS.items():
+            old, new = baseline.get(metric), current.get(metric)
+            if not old or new is None:
+                continue
+            change = (new - old) / old
+            worse = -change if higher_is_better else change
+            flag = ""
+            if worse > args.threshold:
+                flag = "  ← 变慢" if metric != "peak_rss_mb" else "  ← 内存增加"
+                regressions += 1
+            print(f"  {metric:<14} {old:>12} -> {new:<12} {change:+.1%}{flag}")
+    return 1 if regressions else 0
+
+
+def build_parser():
+    parser = argparse.ArgumentParser(description="批量打标基准测试")
+    parser.add_argument("--log-level", default="WARNING")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    run_parser = subparsers.add_parser("run", help="运行基准测试并保存结果")
+    run_parser.add_argument("--scenarios", default="tag,refine,transform", help=f"逗号分隔，可选 {', '.join(SCENARIOS)}")
+    run_parser.add_argument("--files", type=int, default=1000, help="数据集文件数")
+    run_parser.add_argument("--repeat", type=int, default=1, help="每个场景运行的次数")
+    run_parser.add_argument("--label", default="", help="结果标签，比较时可以代替版本号")
+    run_parser.add_argument("--backend", help="使用已有的 Ollama 或模拟服务器（例如 http://127.0.0.1:11434/api），不启动内置模拟服务器")
+    run_parser.add_argument("--concurrency", type=int, default=8)
+    run_parser.add_argument("--adaptive", action=argparse.BooleanOptionalAction, default=True, help="自适应并发")
+    run_parser.add_argument("--preprocess", action="store_true", help="上传前压缩图片")
+    run_parser.add_argument("--result-cache", action="store_true", help="启用结果缓存（数据集图片内容相同，启用后几乎全部命中）")
+    run_parser.add_argument("--stream", action="store_true", help="流式生成")
+    run_parser.add_argument("--warmup", action=argparse.BooleanOptionalAction, default=True, help="任务开始前预加载并常驻模型")
+    run_parser.add_argument("--vram-gb", type=float, default=0, help="常驻模型的显存预算（GB）")
+    run_parser.add_argument("--window-size", type=int, default=200, help="multi 场景的分组窗口大小")
+    run_parser.add_argument("--search-repeat", type=int, default=20, help="search 场景每种查询的次数")
+    run_parser.add_argument("--vision-models", type=lambda text: text.split(","), default=["llava:7b", "minicpm-v:8b"])
+    run_parser.add_argument("--text-models", type=lambda text: text.split(","), default=["qwen2:7b"])
+    mock = run_parser.add_argument_group("模拟服务器")
+    mock.add_argument("--latency", type=float, default=0.05)
+    mock.add_argument("--distribution", choices=["fixed", "uniform", "normal", "lognormal"], default="lognormal")
+    mock.add_argument("--jitter", type=float, default=0.3)
+    mock.add_argument("--slots", type=int, default=4)
+    mock.add_argument("--load-delay", type=float, default=0.0)
+    mock.add_argument("--max-loaded", type=int, default=1)
+    mock.add_argument("--timeout-rate", type=float, default=0.0)
+    mock.add_argument("--hang-seconds", type=float, default=150)
+    mock.add_argument("--drop-rate", type=float, default=0.0)
+    mock.add_argument("--error-rate", type=float, default=0.0)
+    mock.add_argument("--response-words", type=int, default=40)
+    mock.add_argument("--seed", type=int, default=0)
+
+    compare_parser = subparsers.add_parser("compare", help="与之前的版本比较")
+    compare_parser.add_argument("--baseline", help="基准版本号或标签，默认为之前最近的另一个版本")
+    compare_parser.add_argument("--threshold", type=float, default=BENCHMARK_CONFIG["REGRESSION_THRESHOLD"])
+    return parser
+
+
+def main(argv=None):
+    args = build_parser().parse_args(argv)
+    logging.basicConfig(level=args.log_level.upper(), format='%(asctime)s - %(levelname)s - %(message)s', stream=sys.stderr)
+    if args.command == "compare":
+        return command_compare(args)
+    return command_run(args)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,67 @@
+import logging
+import threading
+
+# 任务级取消：每个界面入口（标签页）同一时间有一个正在运行的任务和它的取消令牌，
+# 停止按钮只取消本标签页的任务，不再像全局 stop_flag 那样影响其他标签页
+
+_tokens = {}
+_lock = threading.Lock()
+
+
+class CancelToken:
+    def __init__(self, scope):
+        self.scope = scope
+        self._event = threading.Event()
+        self._callbacks = []
+        self._lock = threading.Lock()
+
+    @property
+    def cancelled(self):
+        return self._event.is_set()
+
+    def cancel(self):
+        with self._lock:
+            if self._event.is_set():
+                return
+            self._event.set()
+            callbacks = list(self._callbacks)
+        for callback in callbacks:
+            callback()
+
+    # 注册取消时执行的回调（例如取消后台事件循环中的任务），已取消时立即执行
+    def add_callback(self, callback):
+        with self._lock:
+            if not self._event.is_set():
+                self._callbacks.append(callback)
+                return
+        callback()
+
+    def remove_callback(self, callback):
+        with self._lock:
+            if callback in self._callbacks:
+                self._callbacks.remove(callback)
+
+
+# 为某个入口开始一个新任务，返回其取消令牌
+def start(scope):
+    token = CancelToken(scope)
+    with _lock:
+        _tokens[scope] = token
+    return token
+
+
+# 任务结束后移除令牌（入口已经开始了新任务时保留新令牌）
+def finish(token):
+    with _lock:
+        if _tokens.get(token.scope) is token:
+            del _tokens[token.scope]
+
+
+def cancel(scope):
+    with _lock:
+        token = _tokens.get(scope)
+    if token is None:
+        return False
+    logging.info(f"停止任务: {scope}")
+    token.cancel()
+    return True
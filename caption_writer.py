@@ -0,0 +1,155 @@
+import os
+import time
+import queue
+import asyncio
+import logging
+import tempfile
+import threading
+import concurrent.futures
+
+# 标签文件写入：所有模式的 txt 写入都交给一个后台线程，推理协程只提交写入请求，不等待磁盘。
+# 后台线程每次取出一批请求，同一文件的多个请求按提交顺序合并后只写一次；
+# 写入先写同目录的临时文件再替换原文件，程序崩溃时不会留下写了一半的 txt
+
+CAPTION_WRITER_CONFIG = {
+    # 每批最多处理的写入请求数
+    "BATCH_SIZE": 64,
+    # 替换前把临时文件刷到磁盘，断电时也不会得到空文件
+    "FSYNC": True
+}
+
+_queue = queue.Queue()
+_thread = None
+_lock = threading.Lock()
+_stats = {"requests": 0, "writes": 0, "batches": 0, "errors": 0, "seconds": 0.0}
+
+
+# 按处理方式把新结果合并到已有内容，existing 为 None 表示文件不存在；
+# 处理方式为“修改”时 text 是函数，以已有内容为参数返回新内容
+def merge_caption(existing, text, action="覆盖"):
+    if action == "修改":
+        return text(existing)
+    if existing is None:
+        return text
+    if action == "忽略":
+        return existing
+    if action == "加入前面":
+        return text + ", " + existing
+    if action == "加入后面":
+        return existing + ", " + text
+    return text
+
+
+# 先写入同目录的临时文件再替换，中途出错不会留下写了一半的文件
+def write_atomic(path, content):
+    fd, temp_path = tempfile.mkstemp(dir=os.path.dirname(path) or ".", prefix=".", suffix=".tmp")
+    try:
+        with os.fdopen(fd, "w") as file:
+            file.write(content)
+            if CAPTION_WRITER_CONFIG["FSYNC"]:
+                file.flush()
+                os.fsync(file.fileno())
+        # mkstemp 创建的文件只有当前用户可读写，沿用原文件的权限
+        if os.path.exists(path):
+            os.chmod(temp_path, os.stat(path).st_mode)
+        os.replace(temp_path, path)
+    except BaseException:
+        os.unlink(temp_path)
+        raise
+
+
+def _read_existing(path):
+    try:
+        with open(path, "r") as file:
+            return file.read()
+    except FileNotFoundError:
+        return None
+
+
+def _ensure_thread():
+    global _thread
+    with _lock:
+        if _thread is None or not _thread.is_alive():
+            _thread = threading.Thread(target=_run, name="caption-writer", daemon=True)
+            _thread.start()
+
+
+def _run():
+    while True:
+        batch = [_queue.get()]
+        while len(batch) < CAPTION_WRITER_CONFIG["BATCH_SIZE"]:
+            try:
+                batch.append(_queue.get_nowait())
+            except queue.Empty:
+                break
+        try:
+            _write_batch(batch)
+        finally:
+            for _ in batch:
+                _queue.task_done()
+
+
+def _write_batch(batch):
+    start_time = time.time()
+    requests_by_path = {}
+    for request in batch:
+        # 提交写入的协程已被取消（任务停止）时不再写入；开始处理后就不能再取消，写入结果一定会返回
+        if not request[-1].set_running_or_notify_cancel():
+            continue
+        requests_by_path.setdefault(request[0], []).append(request)
+    writes = errors = 0
+    for path, requests in requests_by_path.items():
+        try:
+            existing = _read_existing(path)
+            content = existing
+            results = []
+            for _, text, action, _ in requests:
+                content = merge_caption(content, text, action)
+                results.append(content)
+            if content != existing:
+                write_atomic(path, content)
+                writes += 1
+        except Exception as e:
+            logging.error(f"写入标签文件失败 {path}: {e}")
+            errors += 1
+            for *_, future in requests:
+                future.set_exception(e)
+            continue
+        for (*_, future), result in zip(requests, results):
+            future.set_result(result)
+    with _lock:
+        _stats["requests"] += len(batch)
+        _stats["writes"] += writes
+        _stats["batches"] += 1
+        _stats["errors"] += errors
+        _stats["seconds"] += time.time() - start_time
+
+
+# 提交写入请求，返回 concurrent.futures.Future，写入完成后结果为文件的最终内容
+def write(path, text, action="覆盖"):
+    future = concurrent.futures.Future()
+    _ensure_thread()
+    _queue.put((path, text, action, future))
+    return future
+
+
+# 提交基于已有内容的修改：function(已有内容) 在写入线程中执行并返回新内容，
+# 与其他对同一文件的写入按提交顺序进行，不会覆盖掉批量任务刚写入的结果
+def update(path, function):
+    return write(path, function, "修改")
+
+
+# 在协程中提交写入并等待完成，等待期间事件循环继续处理其他请求
+async def write_async(path, text, action="覆盖"):
+    return await asyncio.wrap_future(write(path, text, action))
+
+
+# 等待已提交的写入全部完成，任务结束时调用
+def flush():
+    _queue.join()
+
+
+def format_stats():
+    with _lock:
+        stats = dict(_stats)
+    return f"标签写入: 请求 {stats['requests']} 个, 写入 {stats['writes']} 次, {stats['batches']} 批, 失败 {stats['errors']} 个, 磁盘用时 {stats['seconds']:.2f}秒"
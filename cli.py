@@ -0,0 +1,247 @@
+import sys
+import json
+import time
+import signal
+import logging
+import argparse
+import backend_pool
+import concurrency_controller
+import result_cache
+import streaming
+import image_preprocess
+import job_journal
+import cancellation
+import job_scheduler
+import ollama_client
+import inference_engine
+import tagging_core
+import metrics
+import model_residency
+
+# 命令行批量打标：不加载 Gradio，可在无界面的服务器或定时任务中运行。
+# 每处理完一项向标准输出写一行 JSON（或文本），日志写到标准错误；
+# Ctrl+C 第一次停止任务（已完成的文件已保存，可用 resume 继续），第二次直接退出
+#
+# 示例：
+#   python cli.py tag D:/dataset --model llava:7b --prompt "Describe this picture"
+#   python cli.py tag D:/dataset --model llava:7b --prompt-file prompt.txt --refine-model qwen2:7b --refine-prompt "整理为标签: {}"
+#   python cli.py multi D:/dataset --model llava:7b --extra-model minicpm-v --prompt "..." --refine-model qwen2:7b --refine-prompt "..."
+#   python cli.py refine D:/dataset --refine-model qwen2:7b --refine-prompt "..."
+#   python cli.py resume 20240801-120000-abcd
+
+SCOPE = "命令行"
+DEFAULT_CONCURRENCY = 4
+
+ACTIONS = {
+    "忽略": "忽略", "skip": "忽略",
+    "覆盖": "覆盖", "overwrite": "覆盖",
+    "加入前面": "加入前面", "prepend": "加入前面",
+    "加入后面": "加入后面", "append": "加入后面"
+}
+
+
+def read_prompt(text, path):
+    if path:
+        with open(path, "r", encoding="utf-8") as file:
+            return file.read().strip()
+    return text
+
+
+def build_parser():
+    parser = argparse.ArgumentParser(description="Ollama 图片批量打标（命令行）")
+    parser.add_argument("--output", choices=["jsonl", "text"], default="jsonl", help="进度输出格式")
+    parser.add_argument("--log-level", default="INFO", help="标准错误的日志级别")
+    parser.add_argument("--backend", action="append", default=[], help="Ollama 服务器地址，可加空格和权重，可重复，例如 \"http://host:11434/api 2\"")
+    parser.add_argument("--metrics-port", type=int, default=0, help="在该端口提供 Prometheus 指标（/metrics），0 为不启动")
+
+    common = argparse.ArgumentParser(add_help=False)
+    common.add_argument("--concurrency", type=int, default=None, help=f"并发数量（自适应并发时为上限），默认 {DEFAULT_CONCURRENCY}，恢复任务时默认沿用原任务的设置")
+    common.add_argument("--hardware", choices=["GPU", "CPU"], default="GPU")
+    common.add_argument("--priority", choices=[name for name in job_scheduler.PRIORITIES if name != "交互"], default=job_scheduler.get_default_priority_name(), help="任务优先级")
+    common.add_argument("--backend-slots", type=int, default=job_scheduler.SCHEDULER_CONFIG["BACKEND_SLOTS"], help="每台服务器同时请求数，所有任务共享（0 为不限）")
+    common.add_argument("--no-adaptive", action="store_true", help="关闭自适应并发，始终使用 --concurrency")
+    common.add_argument("--result-cache", action=argparse.BooleanOptionalAction, default=result_cache.is_enabled(), help="使用结果缓存")
+    common.add_argument("--stream", action="store_true", help="流式生成")
+    common.add_argument("--max-tokens", type=int, default=0, help="流式生成时最多输出 tokens（0 为不限）")
+    common.add_argument("--max-seconds", type=float, default=0, help="流式生成时单次最长秒数（0 为不限）")
+    common.add_argument("--no-warmup", action="store_true", help="不预加载模型，任务期间也不设置 keep_alive")
+    common.add_argument("--vram-gb", type=float, default=model_residency.RESIDENCY_CONFIG["VRAM_GB"], help="每台服务器的显存预算（GB），0 为同时只常驻一个模型")
+    common.add_argument("--preprocess", action="store_true", help="上传前压缩图片")
+    common.add_argument("--max-side", type=int, default=image_preprocess.PREPROCESS_CONFIG["MAX_SIDE"])
+    common.add_argument("--format", choices=["JPEG", "WEBP"], default=image_preprocess.PREPROCESS_CONFIG["FORMAT"])
+    common.add_argument("--quality", type=int, default=image_preprocess.PREPROCESS_CONFIG["QUALITY"])
+
+    tagging = argparse.ArgumentParser(add_help=False)
+    tagging.add_argument("--model", required=True, help="打标模型")
+    tagging.add_argument("--prompt", help="打标提示词")
+    tagging.add_argument("--prompt-file", help="从文件读取打标提示词")
+    tagging.add_argument("--use-image", action="store_true", help="精炼模型同时识别图片")
+
+    refine = argparse.ArgumentParser(add_help=False)
+    refine.add_argument("--refine-model", help="精炼模型")
+    refine.add_argument("--refine-prompt", help="精炼提示词，{} 处填入打标结果")
+    refine.add_argument("--refine-prompt-file", help="从文件读取精炼提示词")
+
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    tag_parser = subparsers.add_parser("tag", parents=[common, tagging, refine], help="多图处理：打标，指定精炼模型时同时精炼（多图处理PLUS）")
+    tag_parser.add_argument("folder")
+    tag_parser.add_argument("--action", choices=list(ACTIONS), default="忽略", help="已有同名txt时的处理方式")
+
+    multi_parser = subparsers.add_parser("multi", parents=[common, tagging, refine], help="AI-Multi-Tag：多个模型打标后合并精炼")
+    multi_parser.add_argument("folder")
+    multi_parser.add_argument("--extra-model", action="append", default=[], help="其他打标模型，最多 3 个")
+    multi_parser.add_argument("--action", choices=list(ACTIONS), default="忽略")
+    multi_parser.add_argument("--window-size", type=int, default=200, help="分组窗口大小")
+
+    refine_parser = subparsers.add_parser("refine", parents=[common, refine], help="精炼标签：用精炼模型重写已有的 txt")
+    refine_parser.add_argument("folder")
+
+    multimodal_parser = subparsers.add_parser("multimodal", parents=[common, tagging, refine], help="多模态标签润色")
+    multimodal_parser.add_argument("folder")
+    multimodal_parser.add_argument("--action", choices=list(ACTIONS), default="覆盖")
+
+    resume_parser = subparsers.add_parser("resume", parents=[common], help="恢复未完成的任务")
+    resume_parser.add_argument("job_id")
+
+    subparsers.add_parser("jobs", help="列出未完成的任务")
+    subparsers.add_parser("models", help="列出所有服务器上的模型")
+    return parser
+
+
+def apply_options(args):
+    concurrency_controller.set_enabled(not args.no_adaptive)
+    result_cache.set_enabled(args.result_cache)
+    streaming.configure(args.stream, args.max_tokens, args.max_seconds)
+    model_residency.configure(not args.no_warmup, args.vram_gb)
+    job_scheduler.set_default_priority(args.priority)
+    job_scheduler.configure(job_scheduler.SCHEDULER_CONFIG["MAX_RUNNING_JOBS"], args.backend_slots)
+    image_preprocess.configure(args.preprocess, args.max_side, args.format, args.quality)
+
+
+# 根据子命令返回要执行的处理函数和参数
+def build_job(args):
+    if args.command == "resume":
+        header = job_journal.load_job(args.job_id)
+        params = dict(header["params"], resume_job_id=args.job_id)
+        # 只有明确指定 --concurrency 时才覆盖任务记录中的并发数量
+        if args.concurrency is not None:
+            params["concurrency"] = args.concurrency
+        return tagging_core.JOB_FUNCTIONS[header["mode"]], params
+
+    concurrency = DEFAULT_CONCURRENCY if args.concurrency is None else args.concurrency
+
+    refine_prompt = read_prompt(args.refine_prompt, args.refine_prompt_file)
+    if args.command == "refine":
+        return tagging_core.process_refine, dict(folder_path=args.folder, refine_model=args.refine_model, prompt2=refine_prompt,
+                                                 hardware=args.hardware, concurrency=concurrency)
+
+    prompt = read_prompt(args.prompt, args.prompt_file)
+    action = ACTIONS[args.action]
+    if args.command == "tag":
+        return tagging_core.process_folder_images, dict(model=args.model, prompt=prompt, folder_path=args.folder, action=action, hardware=args.hardware,
+                                                        concurrency=concurrency, refine_model=args.refine_model, prompt2=refine_prompt, use_image=args.use_image)
+    enable_refine = bool(args.refine_model)
+    if args.command == "multimodal":
+        return tagging_core.process_multimodal_refine, dict(model=args.model, prompt1=prompt, folder_path=args.folder, action=action, refine_model=args.refine_model,
+                                                            enable_refine=enable_refine, use_image=args.use_image, hardware=args.hardware,
+                                                            prompt2=refine_prompt or "", concurrency=concurrency)
+    if len(args.extra_model) > 3:
+        raise ValueError("--extra-model 最多 3 个。")
+    extra_models = args.extra_model + [None] * (3 - len(args.extra_model))
+    return tagging_core.process_folder_multiple, dict(model=args.model, prompt1=prompt, folder_path=args.folder, action=action,
+                                                      multi_tag_model_1=extra_models[0], enable_multi_tag_model_1=bool(extra_models[0]),
+                                                      multi_tag_model_2=extra_models[1], enable_multi_tag_model_2=bool(extra_models[1]),
+                                                      multi_tag_model_3=extra_models[2], enable_multi_tag_model_3=bool(extra_models[2]),
+                                                      refine_model=args.refine_model, enable_refine=enable_refine, use_image=args.use_image,
+                                                      hardware=args.hardware, prompt2=refine_prompt or "", concurrency=concurrency,
+                                                      window_size=args.window_size)
+
+
+def emit(args, event):
+    if args.output == "jsonl":
+        print(json.dumps(event, ensure_ascii=False), flush=True)
+    elif event["event"] == "progress":
+        print(f"[{event['processed']}/{event['total']}] {event['result']}", flush=True)
+    elif event["event"] == "done":
+        print(f"完成: 处理 {event['processed']} 项, 失败 {event['failed']} 项, 用时 {event['elapsed']}秒" + ("（已停止）" if event["stopped"] else ""), flush=True)
+    elif event["event"] == "summary":
+        print(f"任务统计: {json.dumps(event, ensure_ascii=False)}", flush=True)
+    elif event["event"] == "error":
+        print(event["message"], file=sys.stderr, flush=True)
+    else:
+        print(" | ".join(str(value) for key, value in event.items() if key != "event"), flush=True)
+
+
+# 第一次 Ctrl+C 停止任务，第二次恢复默认行为直接退出
+def install_interrupt_handler(stopped):
+    def handle_interrupt(signum, frame):
+        stopped.append(True)
+        signal.signal(signal.SIGINT, signal.default_int_handler)
+        cancellation.cancel(SCOPE)
+
+    signal.signal(signal.SIGINT, handle_interrupt)
+
+
+def run_job(args):
+    try:
+        function, params = build_job(args)
+    except (ValueError, KeyError, OSError) as e:
+        emit(args, {"event": "error", "message": str(e)})
+        return 2
+
+    counts = {"processed": 0, "failed": 0}
+
+    def progress(update):
+        if "summary" in update:
+            emit(args, dict(event="summary", **update["summary"]))
+            return
+        counts["processed"] = update["processed"]
+        if "失败" in str(update["result"]):
+            counts["failed"] += 1
+        emit(args, dict(event="progress", **update))
+
+    stopped = []
+    install_interrupt_handler(stopped)
+    start_time = time.time()
+    emit(args, {"event": "start", "function": function.__name__, "folder": params.get("folder_path"), "resume_job_id": params.get("resume_job_id")})
+    try:
+        output = job_scheduler.submit(SCOPE, function, **params, scope=SCOPE, progress=progress).future.result()
+    except Exception as e:
+        # 已完成的文件已保存，任务记录没有结束标记，可用 resume 继续
+        emit(args, {"event": "error", "message": f"任务出错: {e}", "processed": counts["processed"]})
+        return 1
+    if output.status == tagging_core.JOB_INVALID:
+        emit(args, {"event": "error", "message": str(output)})
+        return 2
+    emit(args, {"event": "done", "processed": counts["processed"], "failed": counts["failed"], "elapsed": round(time.time() - start_time, 2), "stopped": bool(stopped)})
+    if stopped:
+        return 130
+    return 1 if counts["failed"] else 0
+
+
+def main(argv=None):
+    args = build_parser().parse_args(argv)
+    logging.basicConfig(level=args.log_level.upper(), format='%(asctime)s - %(levelname)s - %(message)s', stream=sys.stderr)
+    if args.backend:
+        backend_pool.configure(backend_pool.parse_backends("\n".join(args.backend)))
+
+    if args.command == "jobs":
+        for job in job_journal.list_unfinished_jobs():
+            emit(args, {"event": "job", "job_id": job["job_id"], "mode": job["mode"], "folder": job["params"].get("folder_path"), "completed": job["completed"]})
+        return 0
+    if args.command == "models":
+        for model in tagging_core.get_models():
+            emit(args, {"event": "model", "name": model})
+        return 0
+
+    apply_options(args)
+    metrics.start_server(args.metrics_port)
+    try:
+        return run_job(args)
+    finally:
+        inference_engine.run_sync(ollama_client.close_async_session())
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,154 @@
+import time
+import heapq
+import asyncio
+import logging
+import threading
+import itertools
+import requests
+
+# 自适应并发控制（AIMD）：每个 (服务器, 模型) 单独维护在途请求上限，
+# 请求顺利完成时缓慢增加（每完成约 limit 个请求加 1），出现超时、错误或服务器排队严重时减半，
+# 界面上的并发数量作为上限，不会被超过。达到上限时等待的请求按 (优先级, 到达顺序) 获得空出的位置，
+# 单图处理等交互请求不会排在批量任务的请求后面
+
+ADAPTIVE_CONFIG = {
+    "ENABLED": True,
+    "INITIAL_LIMIT": 1,
+    "BACKOFF": 0.5,
+    # 服务器端排队时间超过实际计算时间的该倍数（且超过 QUEUE_MIN_SECONDS）时视为过载
+    "QUEUE_RATIO": 1.0,
+    "QUEUE_MIN_SECONDS": 1.0
+}
+
+
+class AdaptiveLimiter:
+    def __init__(self, name, ceiling):
+        self.name = name
+        self.ceiling = ceiling
+        self.limit = float(min(ADAPTIVE_CONFIG["INITIAL_LIMIT"], ceiling))
+        self.in_flight = 0
+        self.last_decrease = 0
+        self.decreases = 0
+        # (优先级, 到达顺序, future) 的堆
+        self._waiters = []
+        self._sequence = itertools.count()
+
+    # 在上限前排队等待的请求数
+    @property
+    def waiting(self):
+        return sum(1 for _, _, future in list(self._waiters) if not future.done())
+
+    def current_limit(self):
+        if not ADAPTIVE_CONFIG["ENABLED"]:
+            return self.ceiling
+        return max(int(self.limit), 1)
+
+    # 等待在途请求数低于当前上限，返回开始时间和排队时间；priority 数值越小越先获得空出的位置
+    async def acquire(self, priority=0):
+        queued_at = time.time()
+        if self.in_flight < self.current_limit() and not self.waiting:
+            self.in_flight += 1
+        else:
+            future = asyncio.get_running_loop().create_future()
+            heapq.heappush(self._waiters, (priority, next(self._sequence), future))
+            try:
+                await future
+            except asyncio.CancelledError:
+                # 位置已经分给这个请求后才被取消时要还回去
+                if future.done() and not future.cancelled():
+                    self.in_flight -= 1
+                    self._wake()
+                raise
+        started = time.time()
+        return started, started - queued_at
+
+    # 被取消的请求（cancelled）只还回位置，不算作成功或失败，不影响并发上限
+    async def release(self, started, error=None, response=None, cancelled=False):
+        if error is not None:
+            self._on_failure(started, error)
+        elif not cancelled:
+            self._on_success(started, response or {})
+        self.in_flight -= 1
+        self._wake()
+
+    # 上限调大或有请求结束时，按优先级把空出的位置分给等待的请求
+    def _wake(self):
+        while self._waiters and self.in_flight < self.current_limit():
+            _, _, future = heapq.heappop(self._waiters)
+            if future.done():
+                continue
+            self.in_flight += 1
+            future.set_result(None)
+
+    def _on_success(self, started, response):
+        latency = time.time() - started
+        # Ollama 返回的各阶段耗时（纳秒）之和是实际计算时间，其余部分是服务器端排队和传输
+        service = sum(response.get(field, 0) for field in ("load_duration", "prompt_eval_duration", "eval_duration")) / 1e9
+        queued = latency - service
+        if service > 0 and queued > max(service * ADAPTIVE_CONFIG["QUEUE_RATIO"], ADAPTIVE_CONFIG["QUEUE_MIN_SECONDS"]):
+            self._decrease(started, f"服务器排队 {queued:.1f}秒")
+        elif self.limit < self.ceiling:
+            self.limit = min(self.limit + 1 / self.limit, float(self.ceiling))
+
+    def _on_failure(self, started, error):
+        reason = "请求超时" if isinstance(error, requests.Timeout) or "Read timed out" in str(error) else "请求失败"
+        self._decrease(started, reason)
+
+    def _decrease(self, started, reason):
+        # 同一次拥塞会让多个在途请求同时报告，只对减速之后才发出的请求再次减速
+        if started < self.last_decrease:
+            return
+        self.last_decrease = time.time()
+        self.decreases += 1
+        old_limit = self.current_limit()
+        self.limit = max(self.limit * ADAPTIVE_CONFIG["BACKOFF"], 1.0)
+        if self.current_limit() != old_limit:
+            logging.warning(f"{self.name}: {reason}，并发上限 {old_limit} -> {self.current_limit()}")
+
+    def set_ceiling(self, ceiling):
+        self.ceiling = ceiling
+        self.limit = min(self.limit, float(ceiling))
+
+
+_limiters = {}
+_lock = threading.Lock()
+_ceiling = 4
+
+
+def set_enabled(enabled):
+    ADAPTIVE_CONFIG["ENABLED"] = bool(enabled)
+
+
+def is_enabled():
+    return ADAPTIVE_CONFIG["ENABLED"]
+
+
+# 每个任务开始时用界面上的并发数量作为上限
+def set_ceiling(concurrency):
+    global _ceiling
+    _ceiling = max(int(concurrency), 1)
+    with _lock:
+        for limiter in _limiters.values():
+            limiter.set_ceiling(_ceiling)
+
+
+def get_limiter(backend_url, model):
+    with _lock:
+        key = (backend_url, model)
+        if key not in _limiters:
+            _limiters[key] = AdaptiveLimiter(f"{model}@{backend_url}", _ceiling)
+        return _limiters[key]
+
+
+# 返回 {(服务器, 模型): 并发控制器}
+def get_limiters():
+    with _lock:
+        return dict(_limiters)
+
+
+def format_limits():
+    with _lock:
+        limiters = list(_limiters.values())
+    if not limiters:
+        return "无"
+    return ", ".join(f"{limiter.name} {limiter.in_flight}/{limiter.current_limit()}" for limiter in limiters)
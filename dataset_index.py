@@ -0,0 +1,363 @@
+import os
+import re
+import codecs
+import locale
+import asyncio
+import time
+import sqlite3
+import hashlib
+import logging
+import threading
+import dataset_scanner
+
+# 数据集索引：每个数据集文件夹一个 SQLite 数据库，记录图片和 txt 的路径、大小、修改时间、
+# 标签内容以及打标来源（模型、提示词哈希、时间）。刷新时只重新读取大小或修改时间变化的 txt，
+# 搜索、计数等操作直接查询索引，不再逐个打开所有文件。
+# 标签内容另建 FTS5 全文索引（trigram 分词，中英文都可以按子串搜索），由触发器与 files 表保持同步
+
+INDEX_CONFIG = {
+    "INDEX_DIR": "dataset_index",
+    # 距上次刷新不超过该秒数时直接查询索引，不再遍历目录
+    "MAX_AGE": 30,
+    # 刷新时每写入这么多条记录提交一次
+    "REFRESH_BATCH": 1000,
+    # 批量任务写入标签后的记录累积到这么多条或距上次提交超过这么多秒时提交一次，任务结束时提交剩余的记录
+    "RECORD_BATCH": 200,
+    "RECORD_SECONDS": 2.0
+}
+
+# 索引结构版本，结构变化时旧索引会被丢弃并在下次刷新时重建（打标来源记录保留）
+SCHEMA_VERSION = 2
+
+SEARCH_MODES = ["包含文字", "完整词语", "布尔表达式", "正则表达式"]
+
+_indexes = {}
+_indexes_lock = threading.Lock()
+
+
+def _read_caption(path):
+    with open(path, "rb") as file:
+        data = file.read()
+    try:
+        return data.decode("utf-8"), True
+    except UnicodeDecodeError:
+        return data.decode("utf-8", errors="ignore"), False
+
+
+# 标签写入时使用系统默认编码，非 ASCII 内容只有默认编码为 UTF-8 时才是 UTF-8 文件
+def _written_as_utf8(caption):
+    return caption.isascii() or codecs.lookup(locale.getpreferredencoding(False)).name == "utf-8"
+
+
+def _prompt_hash(prompt):
+    return hashlib.sha256((prompt or "").encode("utf-8")).hexdigest()[:16]
+
+
+_UPSERT_FILE = """
+    INSERT INTO files (path, dir, kind, size, mtime_ns, caption, utf8) VALUES (?, ?, ?, ?, ?, ?, ?)
+    ON CONFLICT(path) DO UPDATE SET dir = excluded.dir, kind = excluded.kind, size = excluded.size,
+        mtime_ns = excluded.mtime_ns, caption = excluded.caption, utf8 = excluded.utf8
+"""
+
+
+class DatasetIndex:
+    def __init__(self, folder_path, db_path):
+        self.folder_path = folder_path
+        self.db_path = db_path
+        self._lock = threading.Lock()
+        # 同一时间只进行一次刷新
+        self._refresh_lock = threading.Lock()
+        self.last_refresh = 0
+        # 已写入但尚未提交的标签记录数
+        self._pending = 0
+        self._last_commit = time.time()
+        self._conn = sqlite3.connect(db_path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        if self._conn.execute("PRAGMA user_version").fetchone()[0] < SCHEMA_VERSION:
+            self._conn.execute("DROP TABLE IF EXISTS captions_fts")
+            self._conn.execute("DROP TABLE IF EXISTS files")
+            self._conn.execute("DROP TABLE IF EXISTS dirs")
+            self._conn.execute(f"PRAGMA user_version = {SCHEMA_VERSION}")
+        self._conn.execute("""
+            CREATE TABLE IF NOT EXISTS files (
+                id INTEGER PRIMARY KEY,
+                path TEXT UNIQUE,
+                dir TEXT,
+                kind TEXT,
+                size INTEGER,
+                mtime_ns INTEGER,
+                caption TEXT,
+                utf8 INTEGER
+            )
+        """)
+        self._conn.execute("CREATE INDEX IF NOT EXISTS idx_files_dir ON files(dir)")
+        self._conn.execute("CREATE TABLE IF NOT EXISTS dirs (path TEXT PRIMARY KEY)")
+        self._conn.execute("""
+            CREATE TABLE IF NOT EXISTS provenance (
+                txt_path TEXT PRIMARY KEY,
+                model TEXT,
+                prompt_hash TEXT,
+                tagged_at REAL
+            )
+        """)
+        self._conn.create_function("py_lower", 1, lambda text: text.lower() if text is not None else None, deterministic=True)
+        self.fts_enabled = self._create_fts()
+        self._conn.commit()
+
+    # 创建全文索引和同步触发器；SQLite 不支持 FTS5 或 trigram 时退回逐条比较
+    def _create_fts(self):
+        try:
+            self._conn.execute("CREATE VIRTUAL TABLE IF NOT EXISTS captions_fts USING fts5(caption, content='files', content_rowid='id', tokenize='trigram')")
+        except sqlite3.OperationalError as e:
+            logging.warning(f"SQLite 不支持 FTS5 trigram 全文索引，标签搜索将逐条比较: {e}")
+            return False
+        self._conn.executescript("""
+            CREATE TRIGGER IF NOT EXISTS files_fts_insert AFTER INSERT ON files WHEN new.kind = 'txt' BEGIN
+                INSERT INTO captions_fts (rowid, caption) VALUES (new.id, new.caption);
+            END;
+            CREATE TRIGGER IF NOT EXISTS files_fts_delete AFTER DELETE ON files WHEN old.kind = 'txt' BEGIN
+                INSERT INTO captions_fts (captions_fts, rowid, caption) VALUES ('delete', old.id, old.caption);
+            END;
+            CREATE TRIGGER IF NOT EXISTS files_fts_update AFTER UPDATE ON files WHEN old.kind = 'txt' OR new.kind = 'txt' BEGIN
+                INSERT INTO captions_fts (captions_fts, rowid, caption) SELECT 'delete', old.id, old.caption WHERE old.kind = 'txt';
+                INSERT INTO captions_fts (rowid, caption) SELECT new.id, new.caption WHERE new.kind = 'txt';
+            END;
+        """)
+        return True
+
+    # 增量刷新：逐个目录比较大小和修改时间，只读取新增或变化的 txt，删除已不存在的记录。
+    # 扫描和读取文件时不持有锁，只在查询和写入每个目录的记录时短暂加锁，刷新期间搜索和任务写入标签不会被长时间阻塞
+    def refresh(self):
+        start_time = time.time()
+        added = changed = removed = 0
+        pending = 0
+        visited = set()
+        with self._refresh_lock:
+            conn = self._conn
+            for root, entries in dataset_scanner.iter_directory_entries(self.folder_path):
+                visited.add(root)
+                with self._lock:
+                    known = {path: (size, mtime_ns) for path, size, mtime_ns in conn.execute("SELECT path, size, mtime_ns FROM files WHERE dir = ?", (root,))}
+                rows = []
+                for entry in entries:
+                    lower_name = entry.name.lower()
+                    if lower_name.endswith(dataset_scanner.IMAGE_EXTENSIONS):
+                        kind = "image"
+                    elif lower_name.endswith(".txt"):
+                        kind = "txt"
+                    else:
+                        continue
+                    try:
+                        stat = entry.stat()
+                    except OSError:
+                        continue
+                    previous = known.pop(entry.path, None)
+                    if previous == (stat.st_size, stat.st_mtime_ns):
+                        continue
+                    caption, utf8 = None, None
+                    if kind == "txt":
+                        try:
+                            caption, utf8 = _read_caption(entry.path)
+                        except OSError:
+                            continue
+                    rows.append((entry.path, root, kind, stat.st_size, stat.st_mtime_ns, caption, utf8))
+                    if previous is None:
+                        added += 1
+                    else:
+                        changed += 1
+                if not rows and not known:
+                    continue
+                with self._lock:
+                    if rows:
+                        conn.executemany(_UPSERT_FILE, rows)
+                    if known:
+                        conn.executemany("DELETE FROM files WHERE path = ?", [(path,) for path in known])
+                        removed += len(known)
+                    pending += len(rows) + len(known)
+                    if pending >= INDEX_CONFIG["REFRESH_BATCH"]:
+                        conn.commit()
+                        pending = 0
+            with self._lock:
+                # 整个目录被删除或移走
+                for (dir_path,) in conn.execute("SELECT path FROM dirs").fetchall():
+                    if dir_path not in visited:
+                        removed += conn.execute("DELETE FROM files WHERE dir = ?", (dir_path,)).rowcount
+                conn.execute("DELETE FROM dirs")
+                conn.executemany("INSERT INTO dirs (path) VALUES (?)", [(dir_path,) for dir_path in visited])
+                conn.execute("DELETE FROM provenance WHERE txt_path NOT IN (SELECT path FROM files)")
+                conn.commit()
+            self.last_refresh = time.time()
+        logging.info(f"数据集索引已刷新 {self.folder_path}: 新增 {added}, 变化 {changed}, 删除 {removed}, 用时 {time.time() - start_time:.2f}秒")
+        return added, changed, removed
+
+    def count_files(self):
+        with self._lock:
+            counts = dict(self._conn.execute("SELECT kind, COUNT(*) FROM files GROUP BY kind").fetchall())
+        return counts.get("image", 0), counts.get("txt", 0)
+
+    # 按搜索方式查找 txt 文件：
+    # 包含文字 - 标签中包含该文字（与原来的搜索相同）；完整词语 - 前后不与其他字母数字相连；
+    # 布尔表达式 - FTS5 查询语法，如 watermark AND (logo OR text) NOT signature，不区分大小写；
+    # 正则表达式 - Python 正则
+    def search_captions(self, text, case_sensitive=False, mode="包含文字"):
+        if mode == "正则表达式":
+            try:
+                pattern = re.compile(text, 0 if case_sensitive else re.IGNORECASE)
+            except re.error as e:
+                raise ValueError(f"正则表达式无效: {e}")
+            with self._lock:
+                rows = self._conn.execute("SELECT path, caption FROM files WHERE kind = 'txt' ORDER BY path").fetchall()
+            return [path for path, caption in rows if caption and pattern.search(caption)]
+        if mode == "布尔表达式":
+            if not self.fts_enabled:
+                raise ValueError("当前 SQLite 不支持全文索引，无法使用布尔表达式搜索。")
+            with self._lock:
+                try:
+                    rows = self._conn.execute("SELECT files.path FROM captions_fts JOIN files ON files.id = captions_fts.rowid WHERE captions_fts MATCH ? ORDER BY files.path", (text,)).fetchall()
+                except sqlite3.OperationalError as e:
+                    raise ValueError(f"布尔表达式无效: {e}")
+            return [path for (path,) in rows]
+
+        with self._lock:
+            # trigram 全文索引只能查找至少 3 个字符的文字，较短时逐条比较
+            if self.fts_enabled and len(text) >= 3:
+                rows = self._conn.execute("SELECT files.path, files.caption FROM captions_fts JOIN files ON files.id = captions_fts.rowid WHERE captions_fts MATCH ? ORDER BY files.path",
+                                          ('"' + text.replace('"', '""') + '"',)).fetchall()
+            elif case_sensitive:
+                rows = self._conn.execute("SELECT path, caption FROM files WHERE kind = 'txt' AND instr(caption, ?) > 0 ORDER BY path", (text,)).fetchall()
+            else:
+                rows = self._conn.execute("SELECT path, caption FROM files WHERE kind = 'txt' AND instr(py_lower(caption), ?) > 0 ORDER BY path", (text.lower(),)).fetchall()
+        # 全文索引不区分大小写，按搜索方式再精确比较一次
+        if mode == "完整词语":
+            pattern = re.compile(r"(?<!\w)" + re.escape(text) + r"(?!\w)", 0 if case_sensitive else re.IGNORECASE)
+            return [path for path, caption in rows if caption and pattern.search(caption)]
+        if case_sensitive:
+            return [path for path, caption in rows if caption and text in caption]
+        lower_text = text.lower()
+        return [path for path, caption in rows if caption and lower_text in caption.lower()]
+
+    def non_utf8_files(self):
+        with self._lock:
+            return [path for (path,) in self._conn.execute("SELECT path FROM files WHERE kind = 'txt' AND utf8 = 0 ORDER BY path")]
+
+    def empty_txt_files(self):
+        with self._lock:
+            return [path for (path,) in self._conn.execute("SELECT path FROM files WHERE kind = 'txt' AND size = 0 ORDER BY path")]
+
+    # 批量任务写入 txt 后立即更新该文件的记录和全文索引，并记录由哪个模型、哪个提示词生成。
+    # caption 为标签写入线程返回的文件内容，不再从磁盘读回；记录分批提交，同一连接上的搜索立即可见
+    def record_caption(self, txt_path, model, prompt, caption):
+        stat = os.stat(txt_path)
+        with self._lock:
+            self._conn.execute(_UPSERT_FILE, (txt_path, os.path.dirname(txt_path), "txt", stat.st_size, stat.st_mtime_ns, caption, _written_as_utf8(caption)))
+            self._conn.execute("INSERT OR REPLACE INTO provenance (txt_path, model, prompt_hash, tagged_at) VALUES (?, ?, ?, ?)",
+                               (txt_path, model, _prompt_hash(prompt), time.time()))
+            self._pending += 1
+            if self._pending >= INDEX_CONFIG["RECORD_BATCH"] or time.time() - self._last_commit >= INDEX_CONFIG["RECORD_SECONDS"]:
+                self._commit()
+
+    # 调用时需持有 _lock
+    def _commit(self):
+        self._conn.commit()
+        self._pending = 0
+        self._last_commit = time.time()
+
+    # 提交尚未提交的标签记录
+    def flush(self):
+        with self._lock:
+            if self._pending:
+                self._commit()
+
+    # 文字工具修改 txt 后更新记录和全文索引，打标来源不变；captions 为 [(txt路径, 修改后的内容)]
+    def update_captions(self, captions):
+        rows = []
+        for txt_path, caption in captions:
+            try:
+                stat = os.stat(txt_path)
+            except OSError:
+                continue
+            rows.append((txt_path, os.path.dirname(txt_path), "txt", stat.st_size, stat.st_mtime_ns, caption, _written_as_utf8(caption)))
+        with self._lock:
+            self._conn.executemany(_UPSERT_FILE, rows)
+            self._commit()
+
+    # 文件被删除或移走后移除其记录
+    def forget(self, paths):
+        with self._lock:
+            self._conn.executemany("DELETE FROM files WHERE path = ?", [(path,) for path in paths])
+            self._conn.commit()
+
+    def get_provenance(self, txt_path):
+        with self._lock:
+            row = self._conn.execute("SELECT model, prompt_hash, tagged_at FROM provenance WHERE txt_path = ?", (txt_path,)).fetchone()
+        if row is None:
+            return None
+        return {"model": row[0], "prompt_hash": row[1], "tagged_at": row[2]}
+
+
+# 获取（必要时创建）文件夹对应的索引，数据库按文件夹绝对路径的哈希命名
+def open_index(folder_path):
+    folder_path = os.path.abspath(folder_path)
+    with _indexes_lock:
+        if folder_path not in _indexes:
+            os.makedirs(INDEX_CONFIG["INDEX_DIR"], exist_ok=True)
+            name = hashlib.sha1(os.path.normcase(folder_path).encode("utf-8")).hexdigest()[:16]
+            _indexes[folder_path] = DatasetIndex(folder_path, os.path.join(INDEX_CONFIG["INDEX_DIR"], f"{name}.sqlite3"))
+        return _indexes[folder_path]
+
+
+# 打开索引，距上次刷新超过 MAX_AGE 秒时先增量刷新
+def refreshed_index(folder_path):
+    index = open_index(folder_path)
+    if time.time() - index.last_refresh > INDEX_CONFIG["MAX_AGE"]:
+        index.refresh()
+    return index
+
+
+# 批量任务写入标签后同步索引并记录打标来源，caption 为写入后的文件内容
+def record_caption(folder_path, txt_path, model, prompt, caption):
+    try:
+        open_index(folder_path).record_caption(os.path.abspath(txt_path), model, prompt, caption)
+    except (OSError, sqlite3.Error) as e:
+        logging.warning(f"更新数据集索引失败 {txt_path}: {e}")
+
+
+# 在协程中使用：读取文件信息和写入 SQLite 都在线程中进行，不阻塞推理引擎的事件循环
+async def record_caption_async(folder_path, txt_path, model, prompt, caption):
+    await asyncio.to_thread(record_caption, folder_path, txt_path, model, prompt, caption)
+
+
+# 提交所有已打开索引中尚未提交的标签记录，批量任务结束时调用
+def flush_all():
+    with _indexes_lock:
+        indexes = list(_indexes.values())
+    for index in indexes:
+        try:
+            index.flush()
+        except sqlite3.Error as e:
+            logging.warning(f"提交数据集索引失败 {index.folder_path}: {e}")
+
+
+# 文字工具批量修改 txt 后更新包含这些文件的已打开索引，之后的搜索不必等到下次刷新
+def update_captions(captions):
+    captions = [(os.path.abspath(path), caption) for path, caption in captions]
+    with _indexes_lock:
+        indexes = list(_indexes.values())
+    for index in indexes:
+        prefix = os.path.normcase(os.path.join(index.folder_path, ""))
+        inside = [(path, caption) for path, caption in captions if os.path.normcase(path).startswith(prefix)]
+        if not inside:
+            continue
+        try:
+            index.update_captions(inside)
+        except sqlite3.Error as e:
+            logging.warning(f"更新数据集索引失败 {index.folder_path}: {e}")
+
+
+# 从所有已打开的索引中移除这些文件
+def forget_files(paths):
+    paths = [os.path.abspath(path) for path in paths]
+    with _indexes_lock:
+        indexes = list(_indexes.values())
+    for index in indexes:
+        index.forget(paths)
@@ -0,0 +1,67 @@
+import os
+import logging
+
+# 数据集目录扫描：基于 os.scandir 单次遍历，每个目录只读取一次文件列表，
+# 在内存中匹配图片和同名 txt，不再对每张图片调用 os.path.exists；
+# 所有函数都是生成器，边扫描边产出，批量任务无需等待整个目录树扫描完成
+
+IMAGE_EXTENSIONS = ('.png', '.jpg', '.jpeg', '.bmp', '.gif')
+
+
+# 逐个目录产出 (目录路径, 该目录下的文件 DirEntry 列表)，不进入符号链接目录
+def iter_directory_entries(folder_path):
+    pending = [folder_path]
+    while pending:
+        root = pending.pop()
+        try:
+            with os.scandir(root) as entries:
+                entries = list(entries)
+        except OSError as e:
+            logging.warning(f"无法读取目录 {root}: {e}")
+            continue
+        files = []
+        subdirs = []
+        for entry in entries:
+            try:
+                is_dir = entry.is_dir()
+            except OSError:
+                is_dir = False
+            if not is_dir:
+                files.append(entry)
+            elif not entry.is_symlink():
+                subdirs.append(entry.path)
+        yield root, files
+        # 倒序入栈，子目录按列表顺序处理
+        pending.extend(reversed(subdirs))
+
+
+# 逐个目录产出 (目录路径, 图片文件名列表, txt 文件名列表, 该目录所有文件名的集合)
+def iter_directories(folder_path):
+    for root, entries in iter_directory_entries(folder_path):
+        images = []
+        txt_files = []
+        names = set()
+        for entry in entries:
+            lower_name = entry.name.lower()
+            names.add(os.path.normcase(entry.name))
+            if lower_name.endswith(IMAGE_EXTENSIONS):
+                images.append(entry.name)
+            elif lower_name.endswith('.txt'):
+                txt_files.append(entry.name)
+        yield root, images, txt_files, names
+
+
+# 逐个产出 (图片路径, 同名txt路径)，没有同名txt时为 None
+def iter_images(folder_path):
+    for root, images, _, names in iter_directories(folder_path):
+        for image_name in images:
+            txt_name = f"{os.path.splitext(image_name)[0]}.txt"
+            txt_path = os.path.join(root, txt_name) if os.path.normcase(txt_name) in names else None
+            yield os.path.join(root, image_name), txt_path
+
+
+# 逐个产出所有 txt 文件路径
+def iter_txt_files(folder_path):
+    for root, _, txt_files, _ in iter_directories(folder_path):
+        for txt_name in txt_files:
+            yield os.path.join(root, txt_name)
@@ -0,0 +1,79 @@
+import asyncio
+import threading
+from collections import OrderedDict
+
+# 编码后图片缓存：同一张图片在一次任务中只读取和编码一次，
+# 按 (路径, 修改时间, 大小, 预处理参数) 作为键，超过字节预算时淘汰最久未使用的条目。
+# 缓存属于单个任务，只在同一张图片会被多个模型使用时创建，任务结束时释放
+
+IMAGE_CACHE_CONFIG = {
+    "MAX_BYTES": 256 * 1024 * 1024
+}
+
+
+class EncodedImageCache:
+    def __init__(self, max_bytes):
+        self.max_bytes = max_bytes
+        self.total_bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        self._pending = {}
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            value = self._entries.get(key)
+            if value is not None:
+                self._entries.move_to_end(key)
+            return value
+
+    def put(self, key, value):
+        size = len(value)
+        if size > self.max_bytes:
+            return
+        with self._lock:
+            if key in self._entries:
+                self.total_bytes -= len(self._entries.pop(key))
+            self._entries[key] = value
+            self.total_bytes += size
+            while self.total_bytes > self.max_bytes:
+                _, evicted = self._entries.popitem(last=False)
+                self.total_bytes -= len(evicted)
+
+    # 命中缓存直接返回；同一张图片正在编码时等待同一个结果，避免重复读取
+    async def get_or_load(self, key, loader):
+        value = self.get(key)
+        if value is not None:
+            self.hits += 1
+            return value
+        pending = self._pending.get(key)
+        if pending is not None:
+            self.hits += 1
+            return await asyncio.shield(pending)
+        self.misses += 1
+        task = asyncio.ensure_future(loader())
+        self._pending[key] = task
+        try:
+            value = await task
+        finally:
+            self._pending.pop(key, None)
+        self.put(key, value)
+        return value
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self.total_bytes = 0
+
+    def reset_stats(self):
+        self.hits = 0
+        self.misses = 0
+
+    def format_stats(self):
+        return (f"图片缓存: 命中 {self.hits}, 编码 {self.misses}, "
+                f"占用 {self.total_bytes / 1048576:.1f}/{self.max_bytes / 1048576:.0f}MB, 条目 {len(self._entries)}")
+
+
+def create_cache():
+    return EncodedImageCache(IMAGE_CACHE_CONFIG["MAX_BYTES"])
@@ -0,0 +1,71 @@
+import os
+import logging
+import threading
+import concurrent.futures
+from image_worker import Image
+
+# 图片预处理：上传前缩小尺寸、重新编码并去除元数据，减少每个请求的传输量
+
+PREPROCESS_CONFIG = {
+    "ENABLED": False,
+    "MAX_SIDE": 1024,
+    "FORMAT": "JPEG",
+    "QUALITY": 85
+}
+
+# 进程池大小固定为较小的值：Windows 上以 spawn 启动的每个子进程都要重新导入主模块，
+# 按 CPU 核数创建会让首次预处理很慢、占用大量内存；缩放和编码的吞吐量用几个进程已经足够
+POOL_WORKERS = min(4, os.cpu_count() or 1)
+
+_pool = None
+_pool_lock = threading.Lock()
+
+# 本次任务的字节统计
+_stats_lock = threading.Lock()
+_stats = {"images": 0, "original_bytes": 0, "encoded_bytes": 0}
+
+
+# 更新预处理设置（由界面控件调用）
+def configure(enabled, max_side, image_format, quality):
+    if enabled and Image is None:
+        logging.warning("未安装 Pillow，图片预处理不可用")
+    PREPROCESS_CONFIG["ENABLED"] = bool(enabled)
+    PREPROCESS_CONFIG["MAX_SIDE"] = int(max_side or 1024)
+    PREPROCESS_CONFIG["FORMAT"] = image_format or "JPEG"
+    PREPROCESS_CONFIG["QUALITY"] = int(quality or 85)
+
+
+def is_enabled():
+    return PREPROCESS_CONFIG["ENABLED"] and Image is not None
+
+
+def get_pool():
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            _pool = concurrent.futures.ProcessPoolExecutor(max_workers=POOL_WORKERS)
+    return _pool
+
+
+def record(original_bytes, encoded_bytes):
+    with _stats_lock:
+        _stats["images"] += 1
+        _stats["original_bytes"] += original_bytes
+        _stats["encoded_bytes"] += encoded_bytes
+
+
+def reset_stats():
+    with _stats_lock:
+        for key in _stats:
+            _stats[key] = 0
+
+
+def format_stats():
+    with _stats_lock:
+        stats = dict(_stats)
+    if not stats["images"]:
+        return "图片预处理: 未处理图片"
+    saved = stats["original_bytes"] - stats["encoded_bytes"]
+    rate = saved / stats["original_bytes"] * 100 if stats["original_bytes"] else 0
+    return (f"图片预处理: {stats['images']} 张, 原始 {stats['original_bytes'] / 1048576:.1f}MB, "
+            f"上传 {stats['encoded_bytes'] / 1048576:.1f}MB, 节省 {saved / 1048576:.1f}MB ({rate:.1f}%)")
@@ -0,0 +1,97 @@
+import io
+import os
+import base64
+import struct
+
+try:
+    from PIL import Image, ImageOps
+except ImportError:
+    Image = None
+
+# 图片预处理进程池中执行的函数。Windows 上子进程以 spawn 方式启动，
+# 子进程反序列化任务时只需要导入本模块，因此这里只依赖标准库和 Pillow
+
+PNG_SIGNATURE = b"\x89PNG\r\n\x1a\n"
+# PNG 中只保存元数据的块（文字说明、EXIF、修改时间、色彩配置）
+PNG_METADATA_CHUNKS = {b"tEXt", b"zTXt", b"iTXt", b"eXIf", b"tIME", b"iCCP"}
+# JPEG 中保留的 APP 段：APP0（JFIF）和 APP14（Adobe，决定颜色转换方式），其余 APP 段和注释都是元数据
+JPEG_KEPT_SEGMENTS = {0xE0, 0xEE}
+EXIF_ORIENTATION = 0x0112
+
+
+def _strip_jpeg(data):
+    output = [data[:2]]
+    position = 2
+    while position + 4 <= len(data):
+        if data[position] != 0xFF:
+            return None
+        marker = data[position + 1]
+        if marker == 0xFF:
+            position += 1
+            continue
+        # 图像数据开始，之后不再有元数据段
+        if marker == 0xDA:
+            output.append(data[position:])
+            return b"".join(output)
+        if marker == 0x01 or 0xD0 <= marker <= 0xD7:
+            output.append(data[position:position + 2])
+            position += 2
+            continue
+        length = struct.unpack(">H", data[position + 2:position + 4])[0]
+        segment = data[position:position + 2 + length]
+        if not (0xE0 <= marker <= 0xEF or marker == 0xFE) or marker in JPEG_KEPT_SEGMENTS:
+            output.append(segment)
+        position += 2 + length
+    return None
+
+
+def _strip_png(data):
+    output = [PNG_SIGNATURE]
+    position = len(PNG_SIGNATURE)
+    while position + 12 <= len(data):
+        length = struct.unpack(">I", data[position:position + 4])[0]
+        chunk_type = data[position + 4:position + 8]
+        end = position + 12 + length
+        if chunk_type not in PNG_METADATA_CHUNKS:
+            output.append(data[position:end])
+        position = end
+        if chunk_type == b"IEND":
+            return b"".join(output)
+    return None
+
+
+# 不重新编码、只删除元数据段；格式不支持或文件结构异常时返回 None
+def strip_metadata(data):
+    if data.startswith(b"\xff\xd8"):
+        return _strip_jpeg(data)
+    if data.startswith(PNG_SIGNATURE):
+        return _strip_png(data)
+    return None
+
+
+# 读取、缩放、重新编码，返回 (base64, 原始字节数, 编码后字节数)
+def preprocess_image(image_path, max_side, image_format, quality):
+    original_size = os.path.getsize(image_path)
+    with Image.open(image_path) as img:
+        img.seek(0)
+        rotated = img.getexif().get(EXIF_ORIENTATION, 1) != 1
+        img = ImageOps.exif_transpose(img)
+        resized = max(img.size) > max_side
+        if resized:
+            img.thumbnail((max_side, max_side), Image.LANCZOS)
+        if image_format == "JPEG" and img.mode != "RGB":
+            img = img.convert("RGB")
+        elif image_format == "WEBP" and img.mode not in ("RGB", "RGBA"):
+            img = img.convert("RGBA" if "A" in img.getbands() else "RGB")
+        buffer = io.BytesIO()
+        # 不传 exif/icc_profile，并清空 info（Pillow 保存 JPEG 时会带上其中的注释），重新编码后元数据即被去除
+        img.info.clear()
+        img.save(buffer, format=image_format, quality=quality)
+    data = buffer.getvalue()
+    # 原图已经足够小时发送原文件，但同样去掉元数据；需要按 EXIF 旋转的图片只能发送重新编码的结果
+    if not resized and not rotated and original_size <= len(data):
+        with open(image_path, "rb") as img_file:
+            stripped = strip_metadata(img_file.read())
+        if stripped is not None and len(stripped) <= len(data):
+            data = stripped
+    return base64.b64encode(data).decode('utf-8'), original_size, len(data)
@@ -0,0 +1,179 @@
+import asyncio
+import threading
+import queue
+import itertools
+import logging
+import concurrent.futures
+import job_scheduler
+
+# 基于 asyncio 的推理执行引擎：所有批量任务共用一个后台事件循环，
+# 用信号量限制同时在途的请求数，而不是每个请求占用一个线程
+
+_loop = None
+_loop_lock = threading.Lock()
+_DONE = object()
+
+
+def _run_loop(loop):
+    asyncio.set_event_loop(loop)
+    loop.run_forever()
+
+
+# 获取（必要时启动）后台事件循环
+def get_loop():
+    global _loop
+    with _loop_lock:
+        if _loop is None:
+            _loop = asyncio.new_event_loop()
+            threading.Thread(target=_run_loop, args=(_loop,), name="inference-engine", daemon=True).start()
+            logging.info("推理引擎事件循环已启动")
+    return _loop
+
+
+# 把提交协程的线程所属任务的优先级带入后台事件循环，协程中创建的子任务都会继承
+async def _with_priority(coro, priority):
+    job_scheduler.set_priority(priority)
+    return await coro
+
+
+def _submit(coro):
+    return asyncio.run_coroutine_threadsafe(_with_priority(coro, job_scheduler.get_priority()), get_loop())
+
+
+# 在后台事件循环中执行协程，并阻塞等待结果；token 被取消时中止协程并抛出 CancelledError
+def run_sync(coro, token=None):
+    future = _submit(coro)
+    if token is None:
+        return future.result()
+    token.add_callback(future.cancel)
+    try:
+        return future.result()
+    finally:
+        token.remove_callback(future.cancel)
+
+
+# 列表直接遍历；其他可迭代对象（例如目录扫描生成器）在线程中分批读取，不阻塞事件循环，
+# 扫描到第一批文件就可以开始推理
+async def _iterate_items(items, chunk_size=64):
+    if isinstance(items, (list, tuple)):
+        for item in items:
+            yield item
+        return
+    iterator = iter(items)
+    while True:
+        chunk = await asyncio.to_thread(lambda: list(itertools.islice(iterator, chunk_size)))
+        if not chunk:
+            return
+        for item in chunk:
+            yield item
+
+
+# 有界并发执行：在途任务达到上限时，等待有空位再取下一个任务（背压）
+async def _map_bounded(handler, items, concurrency, emit):
+    semaphore = asyncio.BoundedSemaphore(concurrency)
+    tasks = set()
+
+    async def run_one(item):
+        future = concurrent.futures.Future()
+        try:
+            future.set_result(await handler(item))
+        except Exception as e:
+            future.set_exception(e)
+        finally:
+            semaphore.release()
+        emit(item, future)
+
+    try:
+        async for item in _iterate_items(items):
+            await semaphore.acquire()
+            task = asyncio.ensure_future(run_one(item))
+            tasks.add(task)
+            task.add_done_callback(tasks.discard)
+        if tasks:
+            await asyncio.gather(*tasks)
+    finally:
+        for task in tasks:
+            task.cancel()
+
+
+async def _run_batch(handler, items, concurrency, out_queue):
+    await _map_bounded(handler, items, concurrency, lambda item, future: out_queue.put((item, future)))
+
+
+# 两阶段流水线：第一阶段的结果直接放入有界队列交给第二阶段，两个阶段同时运行。
+# 两个阶段共用 concurrency 个名额，同时进行的处理合计不超过界面上的并发数量
+async def _run_pipeline(first_handler, second_handler, items, concurrency, out_queue):
+    handoff = asyncio.Queue(maxsize=concurrency)
+    budget = asyncio.Semaphore(concurrency)
+
+    async def first_stage(item):
+        # 交给第二阶段之前先还回名额，等待队列空位时不占用名额
+        async with budget:
+            output, handoff_value = await first_handler(item)
+        if handoff_value is not None:
+            # 队列满时等待，第二阶段跟不上时第一阶段自动放慢
+            await handoff.put((item, handoff_value))
+        return output
+
+    async def second_worker():
+        while True:
+            item, value = await handoff.get()
+            future = concurrent.futures.Future()
+            try:
+                async with budget:
+                    future.set_result(await second_handler(item, value))
+            except Exception as e:
+                future.set_exception(e)
+            finally:
+                handoff.task_done()
+            out_queue.put((1, item, future))
+
+    workers = [asyncio.ensure_future(second_worker()) for _ in range(concurrency)]
+    try:
+        await _map_bounded(first_stage, items, concurrency, lambda item, future: out_queue.put((0, item, future)))
+        await handoff.join()
+    finally:
+        for worker in workers:
+            worker.cancel()
+
+
+# 在后台事件循环中运行任务协程，在调用线程中逐个返回结果。
+# token 被取消时直接取消整个任务：尚未开始的条目不再执行，在途请求的连接被关闭，
+# 已完成的结果照常返回后迭代结束
+def _iterate_results(job_coro, out_queue, token=None):
+    job = _submit(job_coro)
+    # 任务无论正常结束、出错还是被取消都会触发，此前产生的结果都已放入队列
+    job.add_done_callback(lambda _: out_queue.put(_DONE))
+    if token is not None:
+        token.add_callback(job.cancel)
+    try:
+        while True:
+            entry = out_queue.get()
+            if entry is _DONE:
+                break
+            yield entry
+        try:
+            job.result()
+        except concurrent.futures.CancelledError:
+            if token is None or not token.cancelled:
+                raise
+    finally:
+        if token is not None:
+            token.remove_callback(job.cancel)
+        if not job.done():
+            job.cancel()
+
+
+# 并发执行 handler(item)（handler 为协程函数），按完成顺序逐个返回 (item, future)
+def run_batch(handler, items, concurrency, token=None):
+    concurrency = max(int(concurrency), 1)
+    out_queue = queue.Queue()
+    return _iterate_results(_run_batch(handler, items, concurrency, out_queue), out_queue, token)
+
+
+# 流水线执行：first_handler(item) 返回 (输出, 交给第二阶段的值)，值为 None 时不进入第二阶段；
+# second_handler(item, 值) 返回第二阶段的输出。两个阶段合计最多同时处理 concurrency 个，按完成顺序逐个返回 (阶段序号, item, future)
+def run_pipeline(first_handler, second_handler, items, concurrency, token=None):
+    concurrency = max(int(concurrency), 1)
+    out_queue = queue.Queue()
+    return _iterate_results(_run_pipeline(first_handler, second_handler, items, concurrency, out_queue), out_queue, token)
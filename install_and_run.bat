@@ -2,8 +2,10 @@
 @echo off    
 echo Installing Python dependencies...    
 pip install requests
+pip install aiohttp
 pip install pandas
 pip install psutil
+pip install Pillow
 pip install gradio
 pip install scikit-learn
 
@@ -0,0 +1,116 @@
+import os
+import json
+import time
+import uuid
+import logging
+import threading
+from datetime import datetime
+
+# 批量任务进度日志：每个任务一个只追加的 jsonl 文件，记录每个文件已完成的阶段，
+# 进程中断后可以按日志精确跳过已完成的工作继续执行
+
+JOURNAL_CONFIG = {
+    "JOBS_DIR": "jobs"
+}
+
+
+class JobJournal:
+    def __init__(self, path, header, completed):
+        self.path = path
+        self.header = header
+        self.job_id = header["job_id"]
+        self.completed = completed
+        self._lock = threading.Lock()
+        self._file = open(path, "a", encoding="utf-8")
+
+    @classmethod
+    def create(cls, mode, params):
+        os.makedirs(JOURNAL_CONFIG["JOBS_DIR"], exist_ok=True)
+        job_id = f"{datetime.now().strftime('%Y%m%d-%H%M%S')}-{uuid.uuid4().hex[:6]}"
+        path = os.path.join(JOURNAL_CONFIG["JOBS_DIR"], f"{job_id}.jsonl")
+        header = {"type": "job", "job_id": job_id, "mode": mode, "params": params, "created": time.time()}
+        with open(path, "w", encoding="utf-8") as file:
+            file.write(json.dumps(header, ensure_ascii=False) + "\n")
+        return cls(path, header, set())
+
+    @classmethod
+    def open(cls, job_id):
+        path = os.path.join(JOURNAL_CONFIG["JOBS_DIR"], f"{job_id}.jsonl")
+        header, completed, _ = _read_journal(path)
+        return cls(path, header, completed)
+
+    def is_done(self, file, stage):
+        return (file, stage) in self.completed
+
+    def count_done(self, stage):
+        return sum(1 for _, done_stage in self.completed if done_stage == stage)
+
+    # 记录一个文件完成了某个阶段，写入后立即刷新，进程崩溃时不会丢失
+    def mark_done(self, file, stage):
+        with self._lock:
+            if (file, stage) in self.completed:
+                return
+            self.completed.add((file, stage))
+            self._file.write(json.dumps({"type": "stage", "file": file, "stage": stage}, ensure_ascii=False) + "\n")
+            self._file.flush()
+
+    # 任务正常结束时写入结束标记；被停止的任务不写，之后仍可恢复
+    def finish(self, stopped=False):
+        with self._lock:
+            if not stopped:
+                self._file.write(json.dumps({"type": "finished", "time": time.time()}) + "\n")
+            self._file.close()
+
+
+def _read_journal(path):
+    header = None
+    completed = set()
+    finished = False
+    with open(path, "r", encoding="utf-8") as file:
+        for line in file:
+            try:
+                entry = json.loads(line)
+            except json.JSONDecodeError:
+                # 进程中断时最后一行可能只写了一半
+                continue
+            if entry["type"] == "job":
+                header = entry
+            elif entry["type"] == "stage":
+                completed.add((entry["file"], entry["stage"]))
+            elif entry["type"] == "finished":
+                finished = True
+    return header, completed, finished
+
+
+# 新建任务日志，或在恢复任务时打开已有日志
+def start_job(mode, params, resume_job_id=None):
+    if resume_job_id:
+        journal = JobJournal.open(resume_job_id)
+        logging.info(f"恢复任务 {resume_job_id}，已完成 {len(journal.completed)} 个阶段")
+        return journal
+    return JobJournal.create(mode, params)
+
+
+# 列出未完成的任务，按创建时间倒序
+def list_unfinished_jobs():
+    jobs_dir = JOURNAL_CONFIG["JOBS_DIR"]
+    if not os.path.isdir(jobs_dir):
+        return []
+    jobs = []
+    for filename in os.listdir(jobs_dir):
+        if not filename.endswith(".jsonl"):
+            continue
+        try:
+            header, completed, finished = _read_journal(os.path.join(jobs_dir, filename))
+        except OSError as e:
+            logging.warning(f"读取任务日志失败 {filename}: {e}")
+            continue
+        if header and not finished:
+            jobs.append({"job_id": header["job_id"], "mode": header["mode"], "params": header["params"],
+                         "created": header["created"], "completed": len(completed)})
+    return sorted(jobs, key=lambda job: job["created"], reverse=True)
+
+
+def load_job(job_id):
+    header, _, _ = _read_journal(os.path.join(JOURNAL_CONFIG["JOBS_DIR"], f"{job_id}.jsonl"))
+    return header
@@ -0,0 +1,113 @@
+import os
+import time
+import queue
+import logging
+import threading
+import inspect
+import collections
+from datetime import datetime
+import job_scheduler
+
+# 批量任务的输出：每个文件的结果逐行写入磁盘上的任务日志，内存中只保留最近的若干行，
+# 占用与数据集大小无关；网页界面通过 stream_job 把任务交给调度器，在任务排队和运行期间不断显示排队位置、进度、速度、预计剩余时间和最近的结果
+
+JOB_OUTPUT_CONFIG = {
+    # 界面和任务返回值中保留的最近行数
+    "RECENT_LINES": 200,
+    # 界面刷新进度的最短间隔（秒）
+    "UPDATE_INTERVAL": 0.5
+}
+
+
+class JobLog:
+    def __init__(self, path):
+        self.path = path
+        self.lines = 0
+        self.recent = collections.deque(maxlen=JOB_OUTPUT_CONFIG["RECENT_LINES"])
+        self._lock = threading.Lock()
+        self._file = None
+        try:
+            self._file = open(path, "a", encoding="utf-8")
+            self._file.write(f"===== {datetime.now().strftime('%Y-%m-%d %H:%M:%S')} =====\n")
+        except OSError as e:
+            logging.warning(f"无法写入任务日志 {path}: {e}")
+
+    def add(self, line):
+        with self._lock:
+            self.lines += 1
+            self.recent.append(line)
+            if self._file is not None:
+                self._file.write(f"{line}\n")
+
+    # 关闭日志文件，返回最近的结果（超出保留行数时注明总行数和日志位置）
+    def finish(self):
+        with self._lock:
+            if self._file is not None:
+                self._file.close()
+                self._file = None
+            recent = list(self.recent)
+        if self.lines > len(recent):
+            recent.insert(0, f"（共 {self.lines} 行，只显示最近 {len(recent)} 行，完整日志: {self.path}）")
+        elif self.lines:
+            recent.append(f"（完整日志: {self.path}）")
+        return "\n".join(recent)
+
+
+# 任务日志与任务记录放在一起，恢复任务时追加到同一个文件
+def open_log(journal):
+    return JobLog(os.path.splitext(journal.path)[0] + ".log")
+
+
+def _format_duration(seconds):
+    hours, remainder = divmod(int(seconds), 3600)
+    minutes, seconds = divmod(remainder, 60)
+    return f"{hours}小时 {minutes}分钟 {seconds}秒"
+
+
+def format_status(state, elapsed):
+    if not state["total"]:
+        return f"正在扫描文件…… 已用时 {_format_duration(elapsed)}"
+    percent = state["processed"] / state["total"] * 100
+    speed = state["processed"] / elapsed if elapsed > 0 else 0
+    return (f"进度 {state['processed']}/{state['total']}（{percent:.1f}%），失败 {state['failed']}，"
+            f"速度 {speed:.2f} 项/秒，已用时 {_format_duration(elapsed)}，预计剩余 {_format_duration(state['remaining'])}")
+
+
+# 任务在调度器中的名称：与停止按钮使用的取消范围相同
+def _job_name(function, kwargs):
+    if kwargs.get("scope"):
+        return kwargs["scope"]
+    parameter = inspect.signature(function).parameters.get("scope")
+    return parameter.default if parameter is not None else function.__name__
+
+
+# 把批量处理函数提交给任务调度器，排队期间产出排队位置，运行期间按 UPDATE_INTERVAL 不断产出进度文本，
+# 最后产出处理函数的返回值；供 Gradio 作为生成器事件使用，界面上每次只传输进度和最近的结果
+def stream_job(function, *args, **kwargs):
+    updates = queue.Queue()
+    recent = collections.deque(maxlen=JOB_OUTPUT_CONFIG["RECENT_LINES"])
+    state = {"processed": 0, "total": 0, "remaining": 0, "failed": 0}
+    job = job_scheduler.submit(_job_name(function, kwargs), function, *args, progress=updates.put, **kwargs)
+    last_yield = 0
+    while not job.future.done() or not updates.empty():
+        try:
+            update = updates.get(timeout=JOB_OUTPUT_CONFIG["UPDATE_INTERVAL"])
+        except queue.Empty:
+            update = None
+        if update is not None and "summary" not in update:
+            state["processed"] = update["processed"]
+            state["total"] = update["total"]
+            state["remaining"] = update["remaining"]
+            state["failed"] += "失败" in str(update["result"])
+            recent.append(str(update["result"]))
+        if time.time() - last_yield >= JOB_OUTPUT_CONFIG["UPDATE_INTERVAL"]:
+            last_yield = time.time()
+            if job.started is None:
+                yield f"排队中（优先级 {job_scheduler.PRIORITY_NAMES[job.priority]}），前面还有 {job.position()} 个任务等待，已等待 {_format_duration(job.wait_seconds())}"
+            else:
+                yield "\n".join([format_status(state, job.run_seconds()), ""] + list(recent))
+    result = job.future.result()
+    if not state["total"]:
+        yield result
+        return
+    yield "\n".join([format_status(dict(state, remaining=0), job.run_seconds()), "", result])
@@ -0,0 +1,252 @@
+import time
+import heapq
+import asyncio
+import logging
+import threading
+import itertools
+import contextvars
+import collections
+import concurrent.futures
+
+# 进程内的任务调度器：所有标签页和命令行提交的批量任务进入同一个队列，按优先级和提交顺序启动，
+# 同时运行的任务数有上限；所有任务的请求共用每台服务器的请求名额，名额空出时先给优先级高的请求。
+# 不经过调度器的调用（例如单图处理）按交互优先级处理，只需等待一个正在进行的请求结束，不会排在批量任务后面
+
+SCHEDULER_CONFIG = {
+    # 同时运行的批量任务数，其余任务排队
+    "MAX_RUNNING_JOBS": 1,
+    # 每台服务器同时进行的请求数，所有任务共享；0 为不限，此时每个任务只受自己的并发数量约束
+    "BACKEND_SLOTS": 0,
+    # 任务列表中保留的已结束任务数
+    "HISTORY": 50
+}
+
+# 数值越小越优先
+PRIORITIES = {"交互": 0, "高": 1, "普通": 2, "低": 3}
+PRIORITY_NAMES = {value: name for name, value in PRIORITIES.items()}
+INTERACTIVE = PRIORITIES["交互"]
+
+# 当前线程或协程所属任务的优先级：调度器在任务线程中设置，推理引擎把它带入后台事件循环中的协程
+_priority = contextvars.ContextVar("job_priority", default=INTERACTIVE)
+
+_queued = []
+_running = []
+_finished = collections.deque(maxlen=SCHEDULER_CONFIG["HISTORY"])
+_lock = threading.Lock()
+_job_ids = itertools.count(1)
+_default_priority = PRIORITIES["普通"]
+
+# 服务器地址 -> BackendSlots，只在后台事件循环中使用
+_backend_slots = {}
+_sequence = itertools.count()
+
+
+def configure(max_running_jobs, backend_slots):
+    SCHEDULER_CONFIG["MAX_RUNNING_JOBS"] = max(int(max_running_jobs or 1), 1)
+    SCHEDULER_CONFIG["BACKEND_SLOTS"] = max(int(backend_slots or 0), 0)
+    _dispatch()
+
+
+def set_default_priority(name):
+    global _default_priority
+    _default_priority = PRIORITIES.get(name, PRIORITIES["普通"])
+
+
+def get_default_priority_name():
+    return PRIORITY_NAMES[_default_priority]
+
+
+def get_priority():
+    return _priority.get()
+
+
+def set_priority(priority):
+    _priority.set(priority)
+
+
+class Job:
+    def __init__(self, name, function, args, kwargs, priority, progress):
+        self.job_id = next(_job_ids)
+        self.name = name
+        self.function = function
+        self.args = args
+        self.kwargs = kwargs
+        self.priority = priority
+        self.progress = progress
+        self.state = "排队中"
+        self.submitted = time.time()
+        self.started = None
+        self.finished = None
+        self.processed = 0
+        self.total = 0
+        self.failed = 0
+        self.future = concurrent.futures.Future()
+
+    def _report(self, update):
+        if "summary" not in update:
+            self.processed = update["processed"]
+            self.total = update["total"]
+            self.failed += "失败" in str(update["result"])
+        if self.progress is not None:
+            self.progress(update)
+
+    def _run(self):
+        set_priority(self.priority)
+        try:
+            self.future.set_result(self.function(*self.args, progress=self._report, **self.kwargs))
+            state = "已完成"
+        except BaseException as e:
+            logging.exception(f"任务 #{self.job_id} {self.name} 出错")
+            self.future.set_exception(e)
+            state = "出错"
+        self.finished = time.time()
+        with _lock:
+            self.state = state
+            _running.remove(self)
+            _finished.appendleft(self)
+        _dispatch()
+
+    def wait_seconds(self):
+        return (self.started or time.time()) - self.submitted
+
+    def run_seconds(self):
+        if self.started is None:
+            return 0
+        return (self.finished or time.time()) - self.started
+
+    def throughput(self):
+        seconds = self.run_seconds()
+        return self.processed / seconds if seconds > 0 else 0
+
+    # 排队中的任务前面还有几个任务
+    def position(self):
+        with _lock:
+            if self not in _queued:
+                return 0
+            return sorted(_queued, key=_queue_key).index(self)
+
+
+def _queue_key(job):
+    return job.priority, job.job_id
+
+
+# 有空位时按优先级启动排队的任务
+def _dispatch():
+    with _lock:
+        started = []
+        while _queued and len(_running) < SCHEDULER_CONFIG["MAX_RUNNING_JOBS"]:
+            job = min(_queued, key=_queue_key)
+            _queued.remove(job)
+            job.state = "运行中"
+            job.started = time.time()
+            _running.append(job)
+            started.append(job)
+    for job in started:
+        logging.info(f"开始任务 #{job.job_id} {job.name}（优先级 {PRIORITY_NAMES[job.priority]}，排队 {job.wait_seconds():.1f}秒）")
+        threading.Thread(target=job._run, name=f"job-{job.job_id}", daemon=True).start()
+
+
+# 提交批量任务：function(*args, progress=..., **kwargs) 在调度器的线程中运行，返回 Job，
+# 通过 job.future 获取处理函数的返回值
+def submit(name, function, *args, priority=None, progress=None, **kwargs):
+    job = Job(name, function, args, kwargs, _default_priority if priority is None else priority, progress)
+    with _lock:
+        _queued.append(job)
+    logging.info(f"提交任务 #{job.job_id} {name}（优先级 {PRIORITY_NAMES[job.priority]}）")
+    _dispatch()
+    return job
+
+
+# 取消该名称下还在排队的任务，返回是否取消了任务；运行中的任务通过 cancellation 停止
+def cancel_queued(name):
+    with _lock:
+        jobs = [job for job in _queued if job.name == name]
+        for job in jobs:
+            _queued.remove(job)
+            job.state = "已取消"
+            job.finished = time.time()
+            _finished.appendleft(job)
+    for job in jobs:
+        logging.info(f"取消排队中的任务 #{job.job_id} {name}")
+        job.future.set_result("任务已取消（排队中，尚未开始）。")
+    return bool(jobs)
+
+
+def list_jobs():
+    with _lock:
+        return list(_running) + sorted(_queued, key=_queue_key) + list(_finished)
+
+
+def _format_seconds(seconds):
+    minutes, seconds = divmod(int(seconds), 60)
+    return f"{minutes}分{seconds:02d}秒"
+
+
+# 任务列表的表格行
+def format_jobs():
+    rows = []
+    for job in list_jobs():
+        progress = f"{job.processed}/{job.total}" if job.total else "-"
+        if job.failed:
+            progress += f"（失败 {job.failed}）"
+        rows.append([job.job_id, job.name, PRIORITY_NAMES[job.priority], job.state, progress, f"{job.throughput():.2f}",
+                     _format_seconds(job.wait_seconds()), _format_seconds(job.run_seconds())])
+    return rows
+
+
+def _slot_limit():
+    return SCHEDULER_CONFIG["BACKEND_SLOTS"] or float("inf")
+
+
+# 每台服务器的请求名额：在途请求达到上限后，等待的请求按 (优先级, 到达顺序) 获得空出的名额
+class BackendSlots:
+    def __init__(self):
+        self.in_use = 0
+        self._waiters = []
+
+    @property
+    def waiting(self):
+        return sum(1 for _, _, future in list(self._waiters) if not future.done())
+
+    async def acquire(self, priority):
+        if self.in_use < _slot_limit() and not self.waiting:
+            self.in_use += 1
+            return
+        future = asyncio.get_running_loop().create_future()
+        heapq.heappush(self._waiters, (priority, next(_sequence), future))
+        try:
+            await future
+        except asyncio.CancelledError:
+            # 名额已经分给这个请求后才被取消时要还回去
+            if future.done() and not future.cancelled():
+                self.release()
+            raise
+
+    def release(self):
+        self.in_use -= 1
+        # 名额上限调大后，下一次有请求结束时一并唤醒
+        while self._waiters and self.in_use < _slot_limit():
+            _, _, future = heapq.heappop(self._waiters)
+            if future.done():
+                continue
+            self.in_use += 1
+            future.set_result(None)
+
+
+def get_backend_slots(backend_url):
+    slots = _backend_slots.get(backend_url)
+    if slots is None:
+        slots = _backend_slots[backend_url] = BackendSlots()
+    return slots
+
+
+def get_all_backend_slots():
+    return dict(_backend_slots)
+
+
+def format_backend_slots():
+    slots = get_all_backend_slots()
+    if not slots:
+        return "暂无请求"
+    limit = SCHEDULER_CONFIG["BACKEND_SLOTS"] or "不限"
+    return "\n".join(f"{backend_url}: 在途 {item.in_use}/{limit}，等待 {item.waiting}" for backend_url, item in slots.items())
@@ -0,0 +1,372 @@
+import json
+import time
+import bisect
+import logging
+import threading
+import collections
+import http.server
+import backend_pool
+import concurrency_controller
+import job_scheduler
+
+# 运行指标：按模型和阶段（打标 tag / 精炼 refine）记录请求耗时、Ollama 返回的各阶段耗时和 token 数、
+# 错误和重试次数，以及各服务器和 (服务器, 模型) 的在途与排队请求数。
+# 通过独立的 HTTP 端口以 Prometheus 文本格式提供（与 Gradio 界面同时运行），
+# 每个批量任务结束时把本次任务的统计写成 JSON 摘要
+
+METRICS_CONFIG = {
+    # 指标端口，设为 0 时不启动
+    "PORT": 9464,
+    "HOST": "127.0.0.1",
+    # 耗时直方图的桶上限（秒）
+    "BUCKETS": (0.1, 0.25, 0.5, 1, 2.5, 5, 10, 20, 30, 60, 120, 300),
+    # 预计剩余时间按最近多少次完成的吞吐量计算
+    "RATE_WINDOW": 50
+}
+
+# Ollama 返回的耗时字段（纳秒）和对应的直方图名称
+DURATION_FIELDS = {
+    "total_duration": "ollama_total_duration_seconds",
+    "load_duration": "ollama_load_duration_seconds",
+    "prompt_eval_duration": "ollama_prompt_eval_duration_seconds",
+    "eval_duration": "ollama_eval_duration_seconds"
+}
+
+_lock = threading.Lock()
+_metrics = {}
+_gauges = []
+_active_jobs = set()
+_server = None
+
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace("\"", "\\\"").replace("\n", "\\n")
+
+
+def _format_labels(names, values, extra=()):
+    pairs = list(zip(names, values)) + list(extra)
+    if not pairs:
+        return ""
+    return "{" + ",".join(f"{name}=\"{_escape(value)}\"" for name, value in pairs) + "}"
+
+
+def _format_number(value):
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Counter:
+    kind = "counter"
+
+    def __init__(self, name, help_text, label_names):
+        self.name = name
+        self.help_text = help_text
+        self.label_names = label_names
+        self.values = {}
+
+    def inc(self, labels, amount=1):
+        with _lock:
+            self.values[labels] = self.values.get(labels, 0) + amount
+
+    def snapshot(self):
+        return dict(self.values)
+
+    def render(self):
+        return [f"{self.name}{_format_labels(self.label_names, labels)} {_format_number(value)}" for labels, value in self.values.items()]
+
+
+class Histogram:
+    kind = "histogram"
+
+    def __init__(self, name, help_text, label_names, buckets=None):
+        self.name = name
+        self.help_text = help_text
+        self.label_names = label_names
+        self.buckets = tuple(buckets or METRICS_CONFIG["BUCKETS"])
+        # 每组标签: [各桶计数（最后一个为 +Inf）, 总和, 次数]
+        self.values = {}
+
+    def observe(self, labels, value):
+        with _lock:
+            state = self.values.get(labels)
+            if state is None:
+                state = self.values[labels] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+            state[0][bisect.bisect_left(self.buckets, value)] += 1
+            state[1] += value
+            state[2] += 1
+
+    def snapshot(self):
+        return {labels: (list(counts), total, count) for labels, (counts, total, count) in self.values.items()}
+
+    def render(self):
+        lines = []
+        for labels, (counts, total, count) in self.values.items():
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets + (float("inf"),), counts):
+                cumulative += bucket_count
+                lines.append(f"{self.name}_bucket{_format_labels(self.label_names, labels, [('le', _format_number(bound))])} {cumulative}")
+            lines.append(f"{self.name}_sum{_format_labels(self.label_names, labels)} {_format_number(total)}")
+            lines.append(f"{self.name}_count{_format_labels(self.label_names, labels)} {count}")
+        return lines
+
+
+def counter(name, help_text, label_names=()):
+    return _metrics.setdefault(name, Counter(name, help_text, label_names))
+
+
+def histogram(name, help_text, label_names=(), buckets=None):
+    return _metrics.setdefault(name, Histogram(name, help_text, label_names, buckets))
+
+
+# 注册一个在读取时才计算的仪表，read 返回 [(标签值元组, 数值)]
+def gauge(name, help_text, label_names, read):
+    _gauges.append((name, help_text, label_names, read))
+
+
+REQUESTS = counter("ollama_requests_total", "发往 Ollama 的 /api/generate 请求数", ("model", "stage", "status"))
+RETRIES = counter("ollama_retries_total", "服务器超时或连接失败后的重试次数", ("model", "stage"))
+CACHE_HITS = counter("ollama_result_cache_hits_total", "命中结果缓存、未发送请求的次数", ("model", "stage"))
+PROMPT_TOKENS = counter("ollama_prompt_tokens_total", "提示词 token 数（prompt_eval_count）", ("model", "stage"))
+EVAL_TOKENS = counter("ollama_eval_tokens_total", "生成 token 数（eval_count）", ("model", "stage"))
+ITEMS = counter("tagging_items_total", "批量任务处理完成的项目数", ("mode", "status"))
+REQUEST_SECONDS = histogram("ollama_request_seconds", "单次请求从发出到收到完整结果的耗时", ("model", "stage"))
+QUEUE_SECONDS = histogram("ollama_queue_wait_seconds", "请求在本地并发上限前排队等待的时间", ("model", "stage"))
+for _field, _name in DURATION_FIELDS.items():
+    histogram(_name, f"Ollama 返回的 {_field}", ("model", "stage"))
+
+gauge("ollama_backend_in_flight", "各服务器的在途请求数", ("backend",),
+      lambda: [((backend.url,), backend.outstanding) for backend in backend_pool.get_backends()])
+gauge("ollama_limiter_in_flight", "各 (服务器, 模型) 的在途请求数", ("backend", "model"),
+      lambda: [(key, limiter.in_flight) for key, limiter in concurrency_controller.get_limiters().items()])
+gauge("ollama_limiter_waiting", "各 (服务器, 模型) 在并发上限前排队的请求数", ("backend", "model"),
+      lambda: [(key, limiter.waiting) for key, limiter in concurrency_controller.get_limiters().items()])
+gauge("ollama_limiter_limit", "各 (服务器, 模型) 当前的自适应并发上限", ("backend", "model"),
+      lambda: [(key, limiter.current_limit()) for key, limiter in concurrency_controller.get_limiters().items()])
+gauge("ollama_backend_slots_waiting", "各服务器在共享请求名额前等待的请求数", ("backend",),
+      lambda: [((backend_url,), slots.waiting) for backend_url, slots in job_scheduler.get_all_backend_slots().items()])
+gauge("tagging_jobs", "调度器中各状态的任务数", ("state",),
+      lambda: list(collections.Counter((job.state,) for job in job_scheduler.list_jobs()).items()))
+gauge("tagging_items_remaining", "运行中的批量任务已发现但尚未处理完的项目数", ("mode", "job"),
+      lambda: [((job.mode, job.job_id), job.remaining()) for job in list(_active_jobs)])
+
+
+# 记录一次成功的请求：本地排队时间、请求耗时和 Ollama 返回的耗时与 token 数
+def record_response(model, stage, queue_seconds, request_seconds, response):
+    labels = (model, stage)
+    REQUESTS.inc((model, stage, "ok"))
+    QUEUE_SECONDS.observe(labels, queue_seconds)
+    REQUEST_SECONDS.observe(labels, request_seconds)
+    for field, name in DURATION_FIELDS.items():
+        if response.get(field):
+            _metrics[name].observe(labels, response[field] / 1e9)
+    if response.get("prompt_eval_count"):
+        PROMPT_TOKENS.inc(labels, response["prompt_eval_count"])
+    if response.get("eval_count"):
+        EVAL_TOKENS.inc(labels, response["eval_count"])
+
+
+def record_error(model, stage):
+    REQUESTS.inc((model, stage, "error"))
+
+
+def record_retry(model, stage):
+    RETRIES.inc((model, stage))
+
+
+def record_cache_hit(model, stage):
+    CACHE_HITS.inc((model, stage))
+
+
+def format_prometheus():
+    with _lock:
+        lines = []
+        for metric in _metrics.values():
+            lines.append(f"# HELP {metric.name} {metric.help_text}")
+            lines.append(f"# TYPE {metric.name} {metric.kind}")
+            lines.extend(metric.render())
+    for name, help_text, label_names, read in _gauges:
+        lines.append(f"# HELP {name} {help_text}")
+        lines.append(f"# TYPE {name} gauge")
+        try:
+            values = read()
+        except Exception as e:
+            logging.warning(f"读取指标 {name} 失败: {e}")
+            continue
+        lines.extend(f"{name}{_format_labels(label_names, labels)} {_format_number(value)}" for labels, value in values)
+    return "\n".join(lines) + "\n"
+
+
+def snapshot():
+    with _lock:
+        return {name: metric.snapshot() for name, metric in _metrics.items()}
+
+
+# 根据直方图各桶的计数估算分位数（桶内线性插值，与 Prometheus 的 histogram_quantile 相同）
+def _quantile(buckets, counts, quantile):
+    count = sum(counts)
+    if not count:
+        return None
+    rank = quantile * count
+    cumulative = 0
+    for index, bucket_count in enumerate(counts):
+        if cumulative + bucket_count >= rank and bucket_count:
+            if index == len(buckets):
+                return buckets[-1]
+            lower = buckets[index - 1] if index else 0
+            return lower + (buckets[index] - lower) * (rank - cumulative) / bucket_count
+        cumulative += bucket_count
+    return buckets[-1]
+
+
+def _diff_histogram(name, before, after, labels):
+    counts, total, count = after[name].get(labels, ([0] * (len(_metrics[name].buckets) + 1), 0.0, 0))
+    old_counts, old_total, old_count = before.get(name, {}).get(labels, ([0] * len(counts), 0.0, 0))
+    return [new - old for new, old in zip(counts, old_counts)], total - old_total, count - old_count
+
+
+def _diff_counter(name, before, after, labels):
+    return after[name].get(labels, 0) - before.get(name, {}).get(labels, 0)
+
+
+# 计算两个快照之间每个 (模型, 阶段) 的统计；同时运行的其他任务的请求也会计入
+def summarize_models(before, after):
+    summary = {}
+    keys = {labels[:2] for labels in after["ollama_requests_total"]} | set(after["ollama_result_cache_hits_total"])
+    for model, stage in sorted(keys):
+        labels = (model, stage)
+        requests_ok = _diff_counter("ollama_requests_total", before, after, (model, stage, "ok"))
+        errors = _diff_counter("ollama_requests_total", before, after, (model, stage, "error"))
+        cache_hits = _diff_counter("ollama_result_cache_hits_total", before, after, labels)
+        if not requests_ok and not errors and not cache_hits:
+            continue
+        counts, latency_total, latency_count = _diff_histogram("ollama_request_seconds", before, after, labels)
+        buckets = _metrics["ollama_request_seconds"].buckets
+        entry = {
+            "requests": requests_ok,
+            "errors": errors,
+            "retries": _diff_counter("ollama_retries_total", before, after, labels),
+            "cache_hits": cache_hits,
+            "latency_mean": round(latency_total / latency_count, 3) if latency_count else None,
+            "latency_p50": _round(_quantile(buckets, counts, 0.5)),
+            "latency_p95": _round(_quantile(buckets, counts, 0.95)),
+            "prompt_tokens": _diff_counter("ollama_prompt_tokens_total", before, after, labels),
+            "eval_tokens": _diff_counter("ollama_eval_tokens_total", before, after, labels)
+        }
+        _, queue_total, queue_count = _diff_histogram("ollama_queue_wait_seconds", before, after, labels)
+        entry["queue_wait_mean"] = round(queue_total / queue_count, 3) if queue_count else None
+        for field, name in DURATION_FIELDS.items():
+            _, total, count = _diff_histogram(name, before, after, labels)
+            entry[field.replace("_duration", "_seconds_mean")] = round(total / count, 3) if count else None
+            if field == "eval_duration":
+                entry["eval_tokens_per_second"] = round(entry["eval_tokens"] / total, 2) if total else None
+        summary[f"{model}/{stage}"] = entry
+    return summary
+
+
+def _round(value):
+    return None if value is None else round(value, 3)
+
+
+# 一个批量任务的进度：由结果处理线程调用 record，预计剩余时间按最近 RATE_WINDOW 次完成的吞吐量计算，
+# 并发处理时不会因为单项耗时重叠而高估或低估
+class JobProgress:
+    def __init__(self, mode, job_id=""):
+        self.mode = mode
+        self.job_id = job_id
+        self.started = time.time()
+        self.processed = 0
+        self.failed = 0
+        self.total = 0
+        self._completions = collections.deque(maxlen=METRICS_CONFIG["RATE_WINDOW"])
+        self._lock = threading.Lock()
+        self._baseline = snapshot()
+        _active_jobs.add(self)
+
+    # 记录一项完成，返回预计剩余秒数
+    def record(self, result, total):
+        failed = "失败" in str(result)
+        now = time.time()
+        with self._lock:
+            self.processed += 1
+            self.failed += failed
+            self.total = total
+            self._completions.append(now)
+        ITEMS.inc((self.mode, "failed" if failed else "ok"))
+        return self.remaining_seconds()
+
+    def remaining(self):
+        with self._lock:
+            return max(self.total - self.processed, 0)
+
+    # 每秒完成的项目数：最近的完成记录不足两条时按整个任务计算
+    def throughput(self):
+        with self._lock:
+            completions = list(self._completions)
+            processed = self.processed
+        if len(completions) >= 2 and completions[-1] > completions[0]:
+            return (len(completions) - 1) / (completions[-1] - completions[0])
+        elapsed = time.time() - self.started
+        return processed / elapsed if elapsed > 0 else 0
+
+    def remaining_seconds(self):
+        rate = self.throughput()
+        return self.remaining() / rate if rate else 0
+
+    # 任务结束时调用：生成 JSON 摘要，写入日志，有 path 时同时保存到文件
+    def finish(self, stopped=False, path=None):
+        _active_jobs.discard(self)
+        elapsed = time.time() - self.started
+        summary = {
+            "job_id": self.job_id,
+            "mode": self.mode,
+            "stopped": stopped,
+            "elapsed": round(elapsed, 2),
+            "processed": self.processed,
+            "failed": self.failed,
+            "total": self.total,
+            "items_per_second": round(self.processed / elapsed, 3) if elapsed > 0 else None,
+            "models": summarize_models(self._baseline, snapshot())
+        }
+        logging.info(f"任务统计: {json.dumps(summary, ensure_ascii=False)}")
+        if path:
+            try:
+                with open(path, "w", encoding="utf-8") as file:
+                    json.dump(summary, file, ensure_ascii=False, indent=2)
+            except OSError as e:
+                logging.warning(f"保存任务统计失败 {path}: {e}")
+        return summary
+
+
+class _MetricsHandler(http.server.BaseHTTPRequestHandler):
+    def do_GET(self):
+        if self.path.split("?")[0] != "/metrics":
+            self.send_error(404)
+            return
+        body = format_prometheus().encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+# 在后台线程中启动指标端口，返回地址；已启动或端口为 0 时不重复启动
+def start_server(port=None, host=None):
+    global _server
+    port = METRICS_CONFIG["PORT"] if port is None else port
+    host = host or METRICS_CONFIG["HOST"]
+    if _server is not None or not port:
+        return None
+    try:
+        _server = http.server.ThreadingHTTPServer((host, port), _MetricsHandler)
+    except OSError as e:
+        logging.warning(f"指标端口 {host}:{port} 启动失败: {e}")
+        return None
+    _server.daemon_threads = True
+    threading.Thread(target=_server.serve_forever, name="metrics-server", daemon=True).start()
+    logging.info(f"指标地址: http://{host}:{port}/metrics")
+    return f"http://{host}:{port}/metrics"
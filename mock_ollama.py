@@ -0,0 +1,308 @@
+import sys
+import json
+import time
+import random
+import argparse
+import threading
+import collections
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+# 本地模拟 Ollama 服务器，用于基准测试和调试：实现 /api/tags、/api/show、/api/ps、/api/generate（含流式和 keep_alive 预加载/卸载），
+# 可配置响应时间分布、模型加载延迟（显存只能同时容纳 MAX_LOADED 个模型）、超时和断开注入、响应长度，
+# 并统计收发字节数。/mock/stats 返回统计，POST /mock/reset 清零
+#
+#   python mock_ollama.py --port 11435 --latency 0.5 --jitter 0.2 --load-delay 5
+
+MOCK_CONFIG = {
+    "LATENCY": 0.05,
+    # fixed 固定 / uniform 均匀分布 ±JITTER / normal 正态分布（标准差 JITTER）/ lognormal 对数正态分布（对数标准差 JITTER）
+    "DISTRIBUTION": "lognormal",
+    "JITTER": 0.3,
+    # 同时计算的请求数（相当于 OLLAMA_NUM_PARALLEL），其余请求在服务器端排队
+    "SLOTS": 4,
+    # 切换到未加载的模型时的加载时间，显存中最多同时保留 MAX_LOADED 个模型
+    "LOAD_DELAY": 0.0,
+    "MAX_LOADED": 1,
+    # 请求未指定 keep_alive 时模型空闲多少秒后卸载（与 Ollama 默认的 5 分钟相同）
+    "DEFAULT_KEEP_ALIVE": 300,
+    # 按概率注入故障：TIMEOUT_RATE 的请求挂起 HANG_SECONDS 秒后才返回，DROP_RATE 的请求直接断开连接，ERROR_RATE 的请求返回 500
+    "TIMEOUT_RATE": 0.0,
+    "HANG_SECONDS": 150,
+    "DROP_RATE": 0.0,
+    "ERROR_RATE": 0.0,
+    # 响应的平均单词数
+    "RESPONSE_WORDS": 40,
+    "VISION_MODELS": ["llava:7b", "minicpm-v:8b"],
+    "TEXT_MODELS": ["qwen2:7b"],
+    "SEED": None
+}
+
+WORDS = ("girl", "outdoors", "smile", "long hair", "blue sky", "dress", "sitting", "flowers", "looking at viewer",
+         "solo", "tree", "day", "cloud", "standing", "hat", "brown eyes", "grass", "upper body", "white shirt", "sunlight")
+
+_stats_lock = threading.Lock()
+_stats = collections.Counter()
+# 已加载的模型 -> 卸载时间
+_loaded = collections.OrderedDict()
+_load_lock = threading.Lock()
+_slots = None
+_random = random.Random()
+
+
+def _reset_stats():
+    with _stats_lock:
+        _stats.clear()
+
+
+def _count(**values):
+    with _stats_lock:
+        _stats.update(values)
+
+
+def _sample_latency():
+    latency = MOCK_CONFIG["LATENCY"]
+    jitter = MOCK_CONFIG["JITTER"]
+    distribution = MOCK_CONFIG["DISTRIBUTION"]
+    if distribution == "uniform":
+        latency = _random.uniform(latency - jitter, latency + jitter)
+    elif distribution == "normal":
+        latency = _random.gauss(latency, jitter)
+    elif distribution == "lognormal" and latency > 0:
+        # 以 LATENCY 为中位数，长尾向右
+        latency = _random.lognormvariate(0, jitter) * latency
+    return max(latency, 0.0)
+
+
+# keep_alive 可以是秒数或 "30s"/"5m"/"1h" 这样的字符串，负数表示一直保留
+def _parse_keep_alive(value):
+    if value is None:
+        return MOCK_CONFIG["DEFAULT_KEEP_ALIVE"]
+    if isinstance(value, str):
+        units = {"s": 1, "m": 60, "h": 3600}
+        value = float(value[:-1]) * units[value[-1]] if value and value[-1] in units else float(value)
+    return float("inf") if value < 0 else float(value)
+
+
+def _expire_models():
+    now = time.time()
+    for model, expires_at in list(_loaded.items()):
+        if expires_at <= now:
+            del _loaded[model]
+
+
+# 模型不在显存中时加载（持有锁，模拟加载期间其他请求也要等待），返回加载秒数
+def _ensure_loaded(model, keep_alive=None):
+    with _load_lock:
+        _expire_models()
+        load_seconds = 0.0
+        if model in _loaded:
+            _loaded.move_to_end(model)
+        else:
+            while len(_loaded) >= MOCK_CONFIG["MAX_LOADED"]:
+                _loaded.popitem(last=False)
+            time.sleep(MOCK_CONFIG["LOAD_DELAY"])
+            _count(loads=1)
+            load_seconds = MOCK_CONFIG["LOAD_DELAY"]
+        _loaded[model] = time.time() + _parse_keep_alive(keep_alive)
+        return load_seconds
+
+
+def _unload(model):
+    with _load_lock:
+        _loaded.pop(model, None)
+
+
+def _make_response_text():
+    count = max(1, int(_random.gauss(MOCK_CONFIG["RESPONSE_WORDS"], MOCK_CONFIG["RESPONSE_WORDS"] / 4)))
+    return ", ".join(_random.choice(WORDS) for _ in range(count))
+
+
+class MockHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, format, *args):
+        pass
+
+    def _send_json(self, data, status=200):
+        body = json.dumps(data).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+        _count(bytes_sent=len(body))
+
+    def _read_json(self):
+        length = int(self.headers.get("Content-Length", 0))
+        body = self.rfile.read(length) if length else b""
+        _count(bytes_received=len(body) + sum(len(key) + len(value) + 4 for key, value in self.headers.items()))
+        return json.loads(body or b"{}")
+
+    def do_GET(self):
+        if self.path.startswith("/api/tags"):
+            models = [{"name": name, "model": name, "digest": f"mock-{name}", "size": 4 * 1024 ** 3,
+                       "details": {"family": "llama", "families": ["llama", "clip"] if name in MOCK_CONFIG["VISION_MODELS"] else ["llama"],
+                                   "parameter_size": "7B", "quantization_level": "Q4_0"}}
+                      for name in MOCK_CONFIG["VISION_MODELS"] + MOCK_CONFIG["TEXT_MODELS"]]
+            self._send_json({"models": models})
+        elif self.path.startswith("/api/ps"):
+            with _load_lock:
+                _expire_models()
+                loaded = list(_loaded)
+            self._send_json({"models": [{"name": name, "model": name, "size": 5 * 1024 ** 3, "size_vram": 5 * 1024 ** 3} for name in loaded]})
+        elif self.path.startswith("/mock/stats"):
+            with _stats_lock:
+                stats = dict(_stats)
+            self._send_json(stats)
+        else:
+            self._send_json({"error": "not found"}, 404)
+
+    def do_POST(self):
+        if self.path.startswith("/mock/reset"):
+            self._read_json()
+            _reset_stats()
+            self._send_json({})
+            return
+        payload = self._read_json()
+        if self.path.startswith("/api/show"):
+            model = payload.get("model")
+            if model not in MOCK_CONFIG["VISION_MODELS"] + MOCK_CONFIG["TEXT_MODELS"]:
+                self._send_json({"error": f"model '{model}' not found"}, 404)
+                return
+            capabilities = ["completion", "vision"] if model in MOCK_CONFIG["VISION_MODELS"] else ["completion"]
+            self._send_json({"capabilities": capabilities})
+        elif self.path.startswith("/api/generate"):
+            self._generate(payload)
+        else:
+            self._send_json({"error": "not found"}, 404)
+
+    def _generate(self, payload):
+        model = payload.get("model")
+        _count(requests=1, images=len(payload.get("images") or []))
+        if model not in MOCK_CONFIG["VISION_MODELS"] + MOCK_CONFIG["TEXT_MODELS"]:
+            self._send_json({"error": f"model '{model}' not found"}, 404)
+            return
+        # 没有提示词和图片的请求只加载（或 keep_alive 为 0 时卸载）模型
+        if not payload.get("prompt") and not payload.get("images"):
+            keep_alive = payload.get("keep_alive")
+            if keep_alive is not None and _parse_keep_alive(keep_alive) == 0:
+                _unload(model)
+                self._send_json({"model": model, "response": "", "done": True, "done_reason": "unload"})
+                return
+            load_seconds = _ensure_loaded(model, keep_alive)
+            _count(preloads=1)
+            self._send_json({"model": model, "response": "", "done": True, "done_reason": "load", "load_duration": int(load_seconds * 1e9)})
+            return
+        fault = _random.random()
+        if fault < MOCK_CONFIG["DROP_RATE"]:
+            _count(drops=1)
+            self.close_connection = True
+            return
+        fault -= MOCK_CONFIG["DROP_RATE"]
+        if fault < MOCK_CONFIG["ERROR_RATE"]:
+            _count(errors=1)
+            self._send_json({"error": "injected error"}, 500)
+            return
+        fault -= MOCK_CONFIG["ERROR_RATE"]
+        if fault < MOCK_CONFIG["TIMEOUT_RATE"]:
+            _count(hangs=1)
+            time.sleep(MOCK_CONFIG["HANG_SECONDS"])
+
+        queued_at = time.time()
+        with _slots:
+            started = time.time()
+            load_seconds = _ensure_loaded(model, payload.get("keep_alive"))
+            latency = _sample_latency()
+            time.sleep(latency)
+        text = _make_response_text()
+        eval_count = text.count(",") + 1
+        prompt_eval_count = len(payload.get("prompt", "")) // 4 + 576 * len(payload.get("images") or [])
+        final = {
+            "model": model,
+            "created_at": time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime()),
+            "done": True,
+            "done_reason": "stop",
+            "total_duration": int((time.time() - queued_at) * 1e9),
+            "load_duration": int(load_seconds * 1e9),
+            "prompt_eval_count": prompt_eval_count,
+            "prompt_eval_duration": int(latency * 0.2 * 1e9),
+            "eval_count": eval_count,
+            "eval_duration": int(latency * 0.8 * 1e9),
+        }
+        _count(server_seconds=time.time() - started)
+        if payload.get("stream", True):
+            self._stream(model, text, final)
+        else:
+            self._send_json(dict(final, response=text))
+
+    def _stream(self, model, text, final):
+        self.send_response(200)
+        self.send_header("Content-Type", "application/x-ndjson")
+        self.send_header("Transfer-Encoding", "chunked")
+        self.end_headers()
+        chunks = [json.dumps({"model": model, "response": word + ", ", "done": False}) for word in text.split(", ")]
+        chunks.append(json.dumps(dict(final, response="")))
+        sent = 0
+        for chunk in chunks:
+            data = chunk.encode() + b"\n"
+            self.wfile.write(b"%x\r\n%s\r\n" % (len(data), data))
+            sent += len(data)
+        self.wfile.write(b"0\r\n\r\n")
+        _count(bytes_sent=sent)
+
+
+def configure(**config):
+    global _slots
+    for key, value in config.items():
+        if value is not None:
+            MOCK_CONFIG[key.upper()] = value
+    _slots = threading.BoundedSemaphore(max(int(MOCK_CONFIG["SLOTS"]), 1))
+    _random.seed(MOCK_CONFIG["SEED"])
+    _loaded.clear()
+
+
+# 在当前进程的后台线程中启动，返回 (server, API 地址)；port 为 0 时自动选择空闲端口
+def start(port=0, host="127.0.0.1", **config):
+    configure(**config)
+    server = ThreadingHTTPServer((host, port), MockHandler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, name="mock-ollama", daemon=True).start()
+    return server, f"http://{host}:{server.server_address[1]}/api"
+
+
+def build_parser():
+    parser = argparse.ArgumentParser(description="模拟 Ollama 服务器")
+    parser.add_argument("--port", type=int, default=11435)
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--latency", type=float, help="每个请求的计算时间（秒，分布的中位数或均值）")
+    parser.add_argument("--distribution", choices=["fixed", "uniform", "normal", "lognormal"])
+    parser.add_argument("--jitter", type=float, help="响应时间的离散程度")
+    parser.add_argument("--slots", type=int, help="同时计算的请求数")
+    parser.add_argument("--load-delay", type=float, help="模型加载时间（秒）")
+    parser.add_argument("--max-loaded", type=int, help="显存中同时保留的模型数")
+    parser.add_argument("--timeout-rate", type=float, help="挂起请求的比例")
+    parser.add_argument("--hang-seconds", type=float, help="挂起的秒数")
+    parser.add_argument("--drop-rate", type=float, help="直接断开连接的比例")
+    parser.add_argument("--error-rate", type=float, help="返回 500 的比例")
+    parser.add_argument("--response-words", type=int, help="响应的平均单词数")
+    parser.add_argument("--seed", type=int, help="随机数种子，相同种子得到相同的响应时间序列")
+    return parser
+
+
+def main(argv=None):
+    args = build_parser().parse_args(argv)
+    config = {key: value for key, value in vars(args).items() if key not in ("port", "host")}
+    configure(**config)
+    server = ThreadingHTTPServer((args.host, args.port), MockHandler)
+    server.daemon_threads = True
+    # 启动后输出一行地址，供基准测试等调用方确认已就绪
+    print(f"http://{args.host}:{server.server_address[1]}/api", flush=True)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,148 @@
+import time
+import logging
+import threading
+import requests
+import ollama_client
+import backend_pool
+
+# 模型目录：在后台线程中从所有服务器的 /api/tags 获取模型列表并缓存（超过 TTL 后下次读取时在后台刷新），
+# 记录每个模型的大小、系列、参数量和是否支持图像识别；界面的所有模型下拉框都从缓存读取，不再阻塞启动
+
+CATALOG_CONFIG = {
+    "TTL": 300,
+    # 页面加载时最多等待首次获取完成的秒数
+    "LOAD_WAIT": 10,
+    "SHOW_TIMEOUT": 10
+}
+
+# /api/tags 中带有这些系列的模型包含图像编码器
+VISION_FAMILIES = ("clip", "mllama")
+# 旧版 Ollama 的 /api/show 不返回 capabilities 时按名称判断
+VISION_NAME_HINTS = ("llava", "vision", "-vl", "vl:", "minicpm-v", "moondream", "bakllava")
+
+_models = {}
+_updated_at = 0
+_capabilities = {}
+# 刷新后仍不存在的模型，避免每个请求都重新探测
+_missing = set()
+_lock = threading.Lock()
+_refresh_thread = None
+_loaded = threading.Event()
+
+
+def _format_size(size):
+    if not size:
+        return ""
+    return f"{size / 1024 ** 3:.1f}GB"
+
+
+# 查询模型能力（新版 Ollama 的 /api/show 返回 capabilities），按摘要缓存，模型更新后重新查询
+def _fetch_capabilities(backend_url, name, digest):
+    if digest and digest in _capabilities:
+        return _capabilities[digest]
+    try:
+        response = ollama_client.post(f"{backend_url}/show", json={"model": name}, timeout=CATALOG_CONFIG["SHOW_TIMEOUT"])
+        response.raise_for_status()
+        capabilities = response.json().get("capabilities")
+    except (requests.RequestException, ValueError) as e:
+        logging.warning(f"获取模型信息失败 {name}@{backend_url}: {e}")
+        return None
+    if digest and capabilities is not None:
+        _capabilities[digest] = capabilities
+    return capabilities
+
+
+def _is_vision(model, capabilities):
+    if capabilities is not None:
+        return "vision" in capabilities
+    families = (model.get("details") or {}).get("families") or []
+    if any(family in VISION_FAMILIES for family in families):
+        return True
+    name = model["name"].lower()
+    return any(hint in name for hint in VISION_NAME_HINTS)
+
+
+# 立即探测所有服务器并更新目录，返回 {模型名: 信息}
+def refresh():
+    global _models, _updated_at
+    catalog = {}
+    for model in backend_pool.refresh_models():
+        name = model["name"]
+        details = model.get("details") or {}
+        backend_urls = [backend.url for backend in backend_pool.get_backends() if name in backend.models]
+        capabilities = _fetch_capabilities(backend_urls[0], name, model.get("digest", "")) if backend_urls else None
+        catalog[name] = {
+            "name": name,
+            "digest": model.get("digest", ""),
+            "size": model.get("size", 0),
+            "family": details.get("family", ""),
+            "parameter_size": details.get("parameter_size", ""),
+            "quantization": details.get("quantization_level", ""),
+            "vision": _is_vision(model, capabilities),
+            "backends": backend_urls
+        }
+    with _lock:
+        _models = catalog
+        _updated_at = time.time()
+        _missing.clear()
+    _loaded.set()
+    logging.info(f"模型列表已更新: {len(catalog)} 个模型，其中支持图像 {sum(info['vision'] for info in catalog.values())} 个")
+    return catalog
+
+
+def _refresh_safely():
+    try:
+        refresh()
+    except Exception as e:
+        logging.error(f"更新模型列表失败: {e}")
+        _loaded.set()
+
+
+# 在后台刷新，已有刷新在进行时不重复启动
+def refresh_in_background():
+    global _refresh_thread
+    with _lock:
+        if _refresh_thread is not None and _refresh_thread.is_alive():
+            return
+        _refresh_thread = threading.Thread(target=_refresh_safely, name="model-catalog", daemon=True)
+        _refresh_thread.start()
+
+
+# 返回缓存的目录，不等待网络；缓存超过 TTL 时在后台刷新
+def get_catalog():
+    if time.time() - _updated_at > CATALOG_CONFIG["TTL"]:
+        refresh_in_background()
+    with _lock:
+        return dict(_models)
+
+
+# 等待首次获取完成（最多 timeout 秒），用于页面加载时填充下拉框
+def wait_until_loaded(timeout=None):
+    return _loaded.wait(CATALOG_CONFIG["LOAD_WAIT"] if timeout is None else timeout)
+
+
+def get_model_names():
+    return sorted(get_catalog())
+
+
+def describe(info):
+    parts = [part for part in (info["family"], info["parameter_size"], _format_size(info["size"])) if part]
+    if info["vision"]:
+        parts.append("图像")
+    return f"{info['name']} ({', '.join(parts)})" if parts else info["name"]
+
+
+# 下拉框选项：显示名称带系列、参数量、大小和是否支持图像，值为模型名
+def get_choices():
+    catalog = get_catalog()
+    return [(describe(catalog[name]), name) for name in sorted(catalog)]
+
+
+# 模型摘要，用作结果缓存键的一部分；目录中没有该模型时立即刷新一次
+def get_digest(model):
+    info = get_catalog().get(model)
+    if info is None and model not in _missing:
+        info = refresh().get(model)
+        if info is None:
+            _missing.add(model)
+    return info["digest"] if info else ""
@@ -0,0 +1,189 @@
+import time
+import logging
+import threading
+import concurrent.futures
+import requests
+import ollama_client
+import backend_pool
+
+# 模型常驻管理：批量任务开始前向每个服务器发送空提示词的请求预加载要用到的模型，
+# 任务期间所有请求带上 keep_alive 让模型一直留在显存中，任务结束时恢复 Ollama 默认的空闲卸载时间。
+# 多个模型放不进显存预算时（例如 AI-Multi-Tag），只常驻放得下的模型，
+# 按模型分组处理的任务在切换阶段时先卸载本任务的其他模型再加载下一个
+
+RESIDENCY_CONFIG = {
+    "ENABLED": True,
+    # 任务期间每个请求带上的 keep_alive，每次请求都会重新计时
+    "KEEP_ALIVE": "30m",
+    # 任务结束后的 keep_alive（Ollama 默认 5 分钟），设为 0 时立即卸载
+    "RELEASE_KEEP_ALIVE": "5m",
+    # 每个服务器可用于常驻模型的显存（GB），0 表示未知，同一时间只常驻一个模型
+    "VRAM_GB": 0,
+    # 显存占用按模型文件大小乘以该系数估算（包含上下文缓存等开销）
+    "SIZE_OVERHEAD": 1.2,
+    "LOAD_TIMEOUT": 600
+}
+
+# (服务器地址, 模型) -> 正在使用它的任务数
+_pins = {}
+_lock = threading.Lock()
+
+
+def configure(enabled, vram_gb):
+    RESIDENCY_CONFIG["ENABLED"] = bool(enabled)
+    RESIDENCY_CONFIG["VRAM_GB"] = max(float(vram_gb or 0), 0)
+
+
+def is_enabled():
+    return RESIDENCY_CONFIG["ENABLED"]
+
+
+# 估算模型在该服务器上占用的显存（字节），已加载的模型使用 /api/ps 返回的实际大小
+def estimate_size(backend, model, loaded_sizes=None):
+    if loaded_sizes and model in loaded_sizes:
+        return loaded_sizes[model]
+    info = backend.models.get(model) or {}
+    return int(info.get("size", 0) * RESIDENCY_CONFIG["SIZE_OVERHEAD"])
+
+
+def get_loaded_sizes(backend):
+    try:
+        response = ollama_client.get(f"{backend.url}/ps", timeout=10)
+        response.raise_for_status()
+        return {model["name"]: model.get("size_vram") or model.get("size", 0) for model in response.json().get("models", [])}
+    except (requests.RequestException, ValueError) as e:
+        logging.warning(f"获取已加载模型失败 {backend.url}: {e}")
+        return {}
+
+
+# 按顺序选出放得下显存预算的模型；预算未知时只选第一个
+def fit_budget(sizes):
+    budget = RESIDENCY_CONFIG["VRAM_GB"] * 1024 ** 3
+    selected = []
+    used = 0
+    for model, size in sizes:
+        if selected and (not budget or used + size > budget):
+            continue
+        selected.append(model)
+        used += size
+    return selected
+
+
+# 发送不带提示词的请求，只加载模型并设置 keep_alive；keep_alive 为 0 时卸载模型。返回加载秒数
+def _set_keep_alive(backend, model, keep_alive):
+    started = time.time()
+    response = ollama_client.post(f"{backend.url}/generate", json={"model": model, "keep_alive": keep_alive},
+                                  timeout=RESIDENCY_CONFIG["LOAD_TIMEOUT"])
+    response.raise_for_status()
+    return time.time() - started
+
+
+def _unpin(backend_url, model):
+    with _lock:
+        key = (backend_url, model)
+        _pins[key] = _pins.get(key, 0) - 1
+        if _pins[key] > 0:
+            return False
+        del _pins[key]
+        return True
+
+
+# 一个任务使用的模型：每个服务器上当前常驻的模型集合
+class Lease:
+    def __init__(self, models):
+        self.models = [model for model in dict.fromkeys(models) if model]
+        self.resident = {}
+
+    def _backends(self, model):
+        return [backend for backend in backend_pool.get_backends() if backend.healthy and model in backend.models]
+
+    # 在一个服务器上常驻 models（已按优先顺序排列），先卸载本任务在该服务器上不再需要的模型
+    def _place(self, backend, models):
+        loaded_sizes = get_loaded_sizes(backend)
+        selected = fit_budget([(model, estimate_size(backend, model, loaded_sizes)) for model in models])
+        resident = self.resident.setdefault(backend.url, [])
+        for model in list(resident):
+            if model not in selected:
+                resident.remove(model)
+                if _unpin(backend.url, model):
+                    self._release_model(backend, model, 0)
+        for model in selected:
+            if model in resident:
+                continue
+            try:
+                seconds = _set_keep_alive(backend, model, RESIDENCY_CONFIG["KEEP_ALIVE"])
+            except requests.RequestException as e:
+                logging.warning(f"预加载模型失败 {model}@{backend.url}: {e}")
+                continue
+            resident.append(model)
+            with _lock:
+                _pins[(backend.url, model)] = _pins.get((backend.url, model), 0) + 1
+            logging.info(f"模型已预加载 {model}@{backend.url}，用时 {seconds:.2f}秒，keep_alive {RESIDENCY_CONFIG['KEEP_ALIVE']}")
+        skipped = [model for model in models if model not in selected]
+        if skipped:
+            logging.info(f"{backend.url}: 显存预算放不下 {', '.join(skipped)}，这些模型不常驻")
+
+    # 在所有服务器上并行执行（同一服务器上的模型依次加载，避免同时加载争用显存带宽）
+    def _place_everywhere(self, models):
+        placements = {}
+        for model in models:
+            for backend in self._backends(model):
+                placements.setdefault(backend.url, (backend, []))[1].append(model)
+        if not placements:
+            return
+        with concurrent.futures.ThreadPoolExecutor(max_workers=len(placements)) as executor:
+            list(executor.map(lambda item: self._place(*item), placements.values()))
+
+    # 按模型分组处理的任务在开始某个模型的阶段前调用：显存放不下全部模型时换成这个模型
+    def activate(self, model):
+        if not is_enabled() or not model:
+            return
+        if all(model in self.resident.get(backend.url, []) for backend in self._backends(model)):
+            return
+        self._place_everywhere([model] + [other for other in self.models if other != model])
+
+    def _release_model(self, backend, model, keep_alive):
+        try:
+            _set_keep_alive(backend, model, keep_alive)
+        except requests.RequestException as e:
+            logging.warning(f"释放模型失败 {model}@{backend.url}: {e}")
+
+    def release(self):
+        backends = {backend.url: backend for backend in backend_pool.get_backends()}
+        for backend_url, models in self.resident.items():
+            for model in models:
+                if _unpin(backend_url, model) and backend_url in backends:
+                    self._release_model(backends[backend_url], model, RESIDENCY_CONFIG["RELEASE_KEEP_ALIVE"])
+        self.resident = {}
+
+
+# 任务开始时调用：预加载放得下显存预算的模型（按 models 的顺序优先），返回 Lease，任务结束时调用 release
+def acquire(models):
+    lease = Lease(models)
+    if is_enabled() and lease.models:
+        started = time.time()
+        # 还没有探测过的服务器（例如命令行刚启动时）先获取模型列表
+        for backend in backend_pool.get_backends():
+            if not backend.last_probe:
+                backend_pool.probe(backend)
+        lease._place_everywhere(lease.models)
+        logging.info(f"模型预加载完成，用时 {time.time() - started:.2f}秒: {format_pins()}")
+    return lease
+
+
+def release(lease):
+    lease.release()
+
+
+# 请求时使用的 keep_alive：模型正被某个任务常驻时返回 KEEP_ALIVE，否则返回 None（使用 Ollama 默认值）
+def get_keep_alive(backend_url, model):
+    with _lock:
+        return RESIDENCY_CONFIG["KEEP_ALIVE"] if (backend_url, model) in _pins else None
+
+
+def format_pins():
+    with _lock:
+        pins = dict(_pins)
+    if not pins:
+        return "无常驻模型"
+    return ", ".join(f"{model}@{backend_url}" + (f" ×{count}" if count > 1 else "") for (backend_url, model), count in pins.items())
@@ -0,0 +1,100 @@
+import os
+import sqlite3
+import itertools
+import threading
+
+# 按模型分组调度：AI-Multi-Tag 不再逐张图片轮流调用多个模型，
+# 而是每个窗口内先让所有图片经过模型 A，再经过模型 B……最后统一精炼，
+# 单显卡上避免模型被反复卸载和加载。中间结果写入磁盘，内存占用与数据集大小无关。
+
+# 响应中 load_duration 超过该值（纳秒）视为发生了一次模型加载
+LOAD_THRESHOLD_NS = 500_000_000
+
+_loads_lock = threading.Lock()
+_observed_loads = {}
+
+
+class CaptionStore:
+    def __init__(self, path):
+        self.path = path
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute("CREATE TABLE IF NOT EXISTS captions (file TEXT, stage INTEGER, caption TEXT, PRIMARY KEY (file, stage))")
+        self._conn.commit()
+
+    def put(self, file, stage, caption):
+        with self._lock:
+            self._conn.execute("INSERT OR REPLACE INTO captions (file, stage, caption) VALUES (?, ?, ?)", (file, stage, caption))
+            self._conn.commit()
+
+    def has(self, file, stage):
+        with self._lock:
+            return self._conn.execute("SELECT 1 FROM captions WHERE file = ? AND stage = ?", (file, stage)).fetchone() is not None
+
+    # 按阶段顺序返回该图片的所有中间结果，缺少任一阶段时返回 None
+    def get_all(self, file, stage_count):
+        with self._lock:
+            rows = dict(self._conn.execute("SELECT stage, caption FROM captions WHERE file = ?", (file,)).fetchall())
+        if any(stage not in rows for stage in range(stage_count)):
+            return None
+        return [rows[stage] for stage in range(stage_count)]
+
+    def discard(self, file):
+        with self._lock:
+            self._conn.execute("DELETE FROM captions WHERE file = ?", (file,))
+            self._conn.commit()
+
+    def close(self, remove=False):
+        with self._lock:
+            self._conn.close()
+        if remove and os.path.exists(self.path):
+            os.remove(self.path)
+
+
+# 将文件序列（可以是边扫描边产出的生成器）切分为固定大小的窗口
+def windows(files, window_size):
+    window_size = max(int(window_size or 1), 1)
+    iterator = iter(files)
+    while True:
+        window = list(itertools.islice(iterator, window_size))
+        if not window:
+            return
+        yield window
+
+
+# 在显存只能容纳一个模型的假设下，按请求顺序统计模型加载次数
+def count_model_loads(model_sequence):
+    loads = 0
+    current = None
+    for model in model_sequence:
+        if model != current:
+            loads += 1
+            current = model
+    return loads
+
+
+# 逐图处理与按模型分组两种顺序下的预计加载次数
+def estimate_loads(file_count, stage_models, window_size):
+    window_count = -(-file_count // max(int(window_size or 1), 1))
+    per_image = count_model_loads(model for _ in range(file_count) for model in stage_models)
+    # 分组后每个窗口内同一模型的请求是连续的，只加载一次
+    grouped = count_model_loads(model for _ in range(window_count) for model in stage_models)
+    return per_image, grouped
+
+
+# 记录实际发生的模型加载（根据 Ollama 返回的 load_duration）
+def record_response(model, response):
+    if response.get("load_duration", 0) >= LOAD_THRESHOLD_NS:
+        with _loads_lock:
+            _observed_loads[model] = _observed_loads.get(model, 0) + 1
+
+
+def reset_observed_loads():
+    with _loads_lock:
+        _observed_loads.clear()
+
+
+def format_observed_loads():
+    with _loads_lock:
+        loads = dict(_observed_loads)
+    return f"实际模型加载: {sum(loads.values())} 次 {loads}"
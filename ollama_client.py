@@ -0,0 +1,175 @@
+import json as _json
+import asyncio
+import threading
+import logging
+import aiohttp
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.connectionpool import HTTPConnectionPool, HTTPSConnectionPool
+
+# 所有 Ollama 请求共用的连接池客户端，避免每张图片都新建一次 TCP 连接
+
+DEFAULT_POOL_SIZE = 4
+
+_session = None
+_pool_size = 0
+_session_lock = threading.Lock()
+
+# 连接复用统计：连接编号 -> 该连接上发出的请求数
+_stats_lock = threading.Lock()
+_connection_requests = {}
+
+
+def _record_new_connection(conn):
+    with _stats_lock:
+        _connection_requests[id(conn)] = 0
+
+
+def _record_request(conn):
+    with _stats_lock:
+        _connection_requests[id(conn)] = _connection_requests.get(id(conn), 0) + 1
+
+
+class _CountingHTTPConnectionPool(HTTPConnectionPool):
+    def _new_conn(self):
+        conn = super()._new_conn()
+        _record_new_connection(conn)
+        return conn
+
+    def _make_request(self, conn, *args, **kwargs):
+        _record_request(conn)
+        return super()._make_request(conn, *args, **kwargs)
+
+
+class _CountingHTTPSConnectionPool(HTTPSConnectionPool):
+    def _new_conn(self):
+        conn = super()._new_conn()
+        _record_new_connection(conn)
+        return conn
+
+    def _make_request(self, conn, *args, **kwargs):
+        _record_request(conn)
+        return super()._make_request(conn, *args, **kwargs)
+
+
+class _PooledAdapter(HTTPAdapter):
+    def init_poolmanager(self, *args, **kwargs):
+        super().init_poolmanager(*args, **kwargs)
+        self.poolmanager.pool_classes_by_scheme = {
+            "http": _CountingHTTPConnectionPool,
+            "https": _CountingHTTPSConnectionPool,
+        }
+
+
+def _build_session(pool_size):
+    session = requests.Session()
+    # pool_block=True：连接用满时等待空闲连接，而不是额外新建用完即丢的连接
+    adapter = _PooledAdapter(pool_connections=4, pool_maxsize=pool_size, pool_block=True)
+    session.mount("http://", adapter)
+    session.mount("https://", adapter)
+    return session
+
+
+# 按并发数量调整连接池大小（只增不减，避免打断其他任务正在使用的连接）
+def configure_pool(concurrency):
+    global _session, _pool_size
+    size = max(int(concurrency or DEFAULT_POOL_SIZE), 1)
+    with _session_lock:
+        if _session is None or size > _pool_size:
+            # 旧连接池上仍可能有请求在进行，不主动关闭，交给垃圾回收
+            _session = _build_session(size)
+            _pool_size = size
+            logging.info(f"Ollama 连接池大小: {size}")
+    return _session
+
+
+def get_session():
+    with _session_lock:
+        session = _session
+    return session or configure_pool(DEFAULT_POOL_SIZE)
+
+
+def post(url, json=None, timeout=120, **kwargs):
+    return get_session().post(url, json=json, timeout=timeout, **kwargs)
+
+
+def get(url, timeout=120, **kwargs):
+    return get_session().get(url, timeout=timeout, **kwargs)
+
+
+# 异步客户端：推理引擎的事件循环里只创建一个 aiohttp 会话，连接数由引擎的并发上限约束
+_async_session = None
+
+
+async def _on_request_end(session, context, params):
+    connection = params.response.connection
+    if connection is not None and connection.transport is not None:
+        _record_request(connection.transport)
+
+
+def get_async_session():
+    global _async_session
+    if _async_session is None or _async_session.closed:
+        trace_config = aiohttp.TraceConfig()
+        trace_config.on_request_end.append(_on_request_end)
+        connector = aiohttp.TCPConnector(limit=0, keepalive_timeout=60)
+        _async_session = aiohttp.ClientSession(connector=connector, trace_configs=[trace_config])
+    return _async_session
+
+
+# 关闭异步会话（命令行退出前调用），下次请求时会重新创建
+async def close_async_session():
+    if _async_session is not None and not _async_session.closed:
+        await _async_session.close()
+
+
+# 异步 POST，返回解析后的 JSON；异常统一转换为 requests 的异常类型，调用处的错误处理保持不变
+async def async_post(url, json=None, timeout=120):
+    try:
+        async with get_async_session().post(url, json=json, timeout=aiohttp.ClientTimeout(total=timeout)) as response:
+            if response.status >= 400:
+                text = await response.text()
+                raise requests.HTTPError(f"{response.status} Error: {text} for url: {url}")
+            return await response.json(content_type=None)
+    except asyncio.TimeoutError as e:
+        raise requests.ReadTimeout(f"Read timed out. (url: {url}, timeout={timeout})") from e
+    except aiohttp.ClientError as e:
+        raise requests.ConnectionError(f"{url}: {e}") from e
+
+
+# 异步流式 POST，逐行解析 Ollama 返回的 JSON 并依次产出；timeout 为两次数据之间的最长等待时间。
+# 调用方提前停止迭代（aclose）时连接会被关闭，Ollama 随之停止生成
+async def async_stream_post(url, json=None, timeout=120):
+    try:
+        async with get_async_session().post(url, json=json, timeout=aiohttp.ClientTimeout(total=None, sock_read=timeout)) as response:
+            if response.status >= 400:
+                text = await response.text()
+                raise requests.HTTPError(f"{response.status} Error: {text} for url: {url}")
+            async for line in response.content:
+                if line.strip():
+                    yield _json.loads(line)
+    except asyncio.TimeoutError as e:
+        raise requests.ReadTimeout(f"Read timed out. (url: {url}, timeout={timeout})") from e
+    except aiohttp.ClientError as e:
+        raise requests.ConnectionError(f"{url}: {e}") from e
+
+
+# 获取连接复用统计
+def get_connection_stats():
+    with _stats_lock:
+        per_connection = dict(_connection_requests)
+    total_requests = sum(per_connection.values())
+    return {
+        "pool_size": _pool_size,
+        "connections": len(per_connection),
+        "requests": total_requests,
+        "reused_requests": sum(max(count - 1, 0) for count in per_connection.values()),
+        "per_connection": sorted(per_connection.values(), reverse=True),
+    }
+
+
+def format_connection_stats():
+    stats = get_connection_stats()
+    reuse_rate = stats["reused_requests"] / stats["requests"] * 100 if stats["requests"] else 0
+    return (f"连接池统计: 连接数 {stats['connections']}, 请求数 {stats['requests']}, "
+            f"复用率 {reuse_rate:.1f}%, 每个连接请求数 {stats['per_connection']}")
@@ -1,290 +1,57 @@
 import os
-import time
-import requests
-import base64
-import csv
-from datetime import datetime
 import logging
-import threading
+import functools
 import concurrent.futures
 import gradio as gr
-import psutil
-import subprocess
 import shutil
+import image_preprocess
+import result_cache
+import job_journal
+import backend_pool
+import model_catalog
+import concurrency_controller
+import streaming
+import cancellation
+import dataset_index
+import text_transform
+import metrics
+import model_residency
+import job_output
+import job_scheduler
+from tagging_core import (
+    get_prompt_templates,
+    save_prompt,
+    process_folder_images,
+    run_single_image_plus,
+    process_folder_multiple,
+    process_refine,
+    process_multimodal_refine,
+    JOB_FUNCTIONS
+)
 
 # 配置日志记录
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
 
-# 配置文件路径和API URL
-CONFIG = {
-    "OLLAMA_API_URL": "http://localhost:11434/api",
-    "PROMPT_TEMPLATES_FILE": "prompt_templates.csv",
-    "HISTORY_PROMPTS_FILE": "history_prompts.csv",
-    "OLLAMA_EXECUTABLE": "C:/Users/Eason/AppData/Local/Programs/Ollama/ollama app.exe",  # 修改为 Ollama 可执行文件的路径
-    "LOG_FILE": "app.log"
-}
-
 # 禁用Gradio的分析功能
 os.environ["GRADIO_ANALYTICS_ENABLED"] = "False"
 
-# 全局变量
-stop_flag = False
-
-# 获取本地模型列表
-def get_models():
-    try:
-        response = requests.get(f"{CONFIG['OLLAMA_API_URL']}/tags", timeout=120)
-        response.raise_for_status()
-        models = response.json().get("models", [])
-        return [model["name"] for model in models]
-    except requests.RequestException as e:
-        logging.error(f"Error fetching models: {e}")
-        return []
-
-# 获取Prompt模板列表
-def get_prompt_templates():
-    templates = []
-    try:
-        with open(CONFIG["PROMPT_TEMPLATES_FILE"], "r") as file:
-            reader = csv.reader(file)
-            for row in reader:
-                if len(row) >= 2:
-                    templates.append({"title": row[0], "prompt": row[1]})
-    except FileNotFoundError:
-        logging.warning(f"{CONFIG['PROMPT_TEMPLATES_FILE']} 文件未找到")
-    return templates
-
-# 保存历史记录prompt
-def save_prompt(prompt1, prompt2, model, source):
-    file_exists = os.path.isfile(CONFIG["HISTORY_PROMPTS_FILE"])
-    with open(CONFIG["HISTORY_PROMPTS_FILE"], "a", newline='') as file:
-        writer = csv.writer(file)
-        if not file_exists:
-            writer.writerow(["日期", "模型", "来源", "Prompt 1", "Prompt 2"])
-        now = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-        writer.writerow([now, model, source, prompt1, prompt2])
-
-# 重启 Ollama 软件
-def restart_ollama():
-    try:
-        logging.info("重启 Ollama 软件...")
-        
-        # 停止 Ollama 软件
-        for proc in psutil.process_iter():
-            if proc.name() in ["ollama app.exe", "ollama.exe", "ollama_llama_server.exe"]:  # 修改为 Ollama 可执行文件的名称
-                proc.kill()
-        
-        # 启动 Ollama 软件
-        subprocess.Popen([CONFIG["OLLAMA_EXECUTABLE"]])
-        
-        time.sleep(10)  # 等待 10 秒
-        logging.info("Ollama 软件已重启")
-    except Exception as e:
-        logging.error(f"重启 Ollama 软件失败: {e}")
-
-# 处理单张图片
-def process_single_image(model, prompt, image, hardware, retry_count=5):
-    if not model:
-        return "请选择一个模型。"
-
-    image_path = image
-
-    try:
-        with open(image_path, "rb") as img_file:
-            img_base64 = base64.b64encode(img_file.read()).decode('utf-8')
-
-        payload = {
-            "model": model,
-            "prompt": prompt,
-            "images": [img_base64],
-            "stream": False,
-            "hardware": hardware  # 添加硬件参数
-        }
-
-        start_time = time.time()
-        response = requests.post(f"{CONFIG['OLLAMA_API_URL']}/generate", json=payload, timeout=120)
-        response.raise_for_status()
-        elapsed_time = time.time() - start_time
-        result = response.json().get("response", "")
-        return result, elapsed_time
-    except requests.RequestException as e:
-        logging.error(f"Error processing image: {e}")
-        if "Read timed out" in str(e):
-            if retry_count > 0:
-                restart_ollama()
-                return process_single_image(model, prompt, image, hardware, retry_count - 1)
-            else:
-                return "处理失败，请检查API连接。", 0
-        return "处理失败，请检查API连接。", 0
-
-# 处理单张图片并保存结果
-def process_single_image_with_save(model, prompt, image, action, hardware):
-    if not model:
-        return "请选择一个模型。"
-
-    image_path = image
-    image_dir = os.path.dirname(image_path)
-    image_name = os.path.basename(image_path)
-    txt_path = os.path.join(image_dir, f"{os.path.splitext(image_name)[0]}.txt")
-
-    result, elapsed_time = process_single_image(model, prompt, image, hardware)
-
-    if "处理失败，请检查API连接。" in result:
-        return result
-
-    if os.path.exists(txt_path):
-        if action == "忽略":
-            return f"{image_name}: 文件已存在，选择忽略。"
-        elif action == "覆盖":
-            with open(txt_path, "w") as txt_file:
-                txt_file.write(result)
-        elif action == "加入前面":
-            with open(txt_path, "r+") as txt_file:
-                content = txt_file.read()
-                txt_file.seek(0, 0)
-                txt_file.write(result + ", " + content)
-        elif action == "加入后面":
-            with open(txt_path, "a") as txt_file:
-                txt_file.write(", " + result)
-    else:
-        with open(txt_path, "w") as txt_file:
-            txt_file.write(result)
-    return f"打标结果: {result}", elapsed_time
-
-# 遍历文件夹，获取所有图片文件及其同名txt文件的存在情况
-def get_files_and_txt_status(folder_path):
-    files = []
-    txt_status = {}
-    for root, _, filenames in os.walk(folder_path):
-        for filename in filenames:
-            if filename.lower().endswith(('.png', '.jpg', '.jpeg', '.bmp', '.gif')):
-                file_path = os.path.join(root, filename)
-                txt_path = os.path.join(root, f"{os.path.splitext(filename)[0]}.txt")
-                files.append(file_path)
-                txt_status[file_path] = os.path.exists(txt_path)
-    return files, txt_status
+# 删除/转移文件搜索结果每页显示的文件数
+SEARCH_PAGE_SIZE = 200
 
 # 获取第一个Prompt模板作为默认值
 prompt_templates = get_prompt_templates()
 default_prompt = prompt_templates[0]["prompt"] if prompt_templates else "Describe this picture in detail"
 
-# 计算剩余时间
-def format_remaining_time(seconds):
-    hours, remainder = divmod(seconds, 3600)
-    minutes, seconds = divmod(remainder, 60)
-    return f"{int(hours)}小时 {int(minutes)}分钟 {int(seconds)}秒"
-
-# 处理文件夹中的图片
-def process_folder_images(model, prompt, folder_path, action, hardware, concurrency, refine_model=None, prompt2=None, use_image=False):
-    global stop_flag
-    stop_flag = False
-
-    if not model or not prompt or not folder_path:
-        return "请选择一个模型并输入Prompt和文件夹路径。"
-    save_prompt(prompt, prompt2 or "", model, "多图处理")
-
-    if not os.path.isdir(folder_path):
-        return "无效的文件夹路径。"
-
-    files, txt_status = get_files_and_txt_status(folder_path)
-    results = []
-
-    start_time = time.time()
-    if action == "忽略":
-        files = [file for file in files if not txt_status[file]]  # 只处理没有同名txt文件的图片
-    total_files = len(files)
-    processed_files = 0
-    last_10_times = []
-    previous_time = time.time()
-
-    def process_file(file):
-        nonlocal previous_time
-        if stop_flag:
-            return f"{file}: 处理被停止。"
-        result, elapsed_time = process_single_image_with_save(model, prompt, file, action, hardware)
-        current_time = time.time()
-        elapsed_time = current_time - previous_time
-        previous_time = current_time
-        return result, elapsed_time
-
-    with concurrent.futures.ThreadPoolExecutor(max_workers=int(concurrency)) as executor:
-        future_to_file = {executor.submit(process_file, file): file for file in files}
-        for future in concurrent.futures.as_completed(future_to_file):
-            file = future_to_file[future]
-            try:
-                result, elapsed_time = future.result()
-            except Exception as e:
-                result = f"{file}: 处理失败，错误: {e}"
-                elapsed_time = 0
-            results.append(result)
-
-            processed_files += 1
-            last_10_times.append(elapsed_time)
-            if len(last_10_times) > 10:
-                last_10_times.pop(0)
-            avg_time_per_file = sum(last_10_times) / len(last_10_times) if last_10_times else 0
-            remaining_time = avg_time_per_file * (total_files - processed_files)
-            logging.info(f"当前任务耗时: {elapsed_time:.2f}秒, 进度 {processed_files}/{total_files} files. 预计剩余时间: {format_remaining_time(remaining_time)}.")
-
-    if refine_model and prompt2:
-        txt_files = [os.path.join(os.path.dirname(file), f"{os.path.splitext(os.path.basename(file))[0]}.txt") for file in files]
-
-        def refine_file(txt_file):
-            nonlocal previous_time
-            if stop_flag:
-                return f"{txt_file}: 处理被停止。"
-
-            with open(txt_file, "r") as file:
-                txt_content = file.read()
-
-            combined_prompt = prompt2.format(txt_content) if "{}" in prompt2 else f"{prompt2}\n{txt_content}"
-
-            payload = {
-                "model": refine_model,
-                "prompt": combined_prompt,
-                "stream": False,
-                "hardware": hardware
-            }
-
-            try:
-                response = requests.post(f"{CONFIG['OLLAMA_API_URL']}/generate", json=payload, timeout=120)
-                response.raise_for_status()
-                result = response.json().get("response", "")
-
-                with open(txt_file, "w") as file:
-                    file.write(result)
-
-                current_time = time.time()
-                elapsed_time = current_time - previous_time
-                previous_time = current_time
-                return f"{txt_file}: 处理完成", elapsed_time
-
-            except requests.RequestException as e:
-                logging.error(f"Error processing txt: {e}")
-                if "Read timed out" in str(e):
-                    restart_ollama()
-                return f"{txt_file}: 处理失败，请检查API连接。", 0
-
-        with concurrent.futures.ThreadPoolExecutor(max_workers=int(concurrency)) as executor:
-            future_to_file = {executor.submit(refine_file, txt_file): txt_file for txt_file in txt_files}
-            for future in concurrent.futures.as_completed(future_to_file):
-                txt_file = future_to_file[future]
-                try:
-                    result, elapsed_time = future.result()
-                except Exception as e:
-                    result = f"{txt_file}: 处理失败，错误: {e}"
-                    elapsed_time = 0
-                results.append(result)
-
-                processed_files += 1
-                last_10_times.append(elapsed_time)
-                if len(last_10_times) > 10:
-                    last_10_times.pop(0)
-                avg_time_per_file = sum(last_10_times) / len(last_10_times) if last_10_times else 0
-                remaining_time = avg_time_per_file * (total_files - processed_files)
-                logging.info(f"当前任务耗时: {elapsed_time:.2f}秒, 进度 {processed_files}/{total_files} files. 预计剩余时间: {format_remaining_time(remaining_time)}.")
-
-    return "\n".join(results)
+# 分页显示搜索结果
+def format_search_page(txt_files, page):
+    page_size = SEARCH_PAGE_SIZE
+    page_count = max((len(txt_files) + page_size - 1) // page_size, 1)
+    page = min(max(int(page or 1), 1), page_count)
+    start = (page - 1) * page_size
+    return f"符合要求的文件名称（第 {page}/{page_count} 页）:\n" + "\n".join(txt_files[start:start + page_size])
+
+# 在后台获取模型列表，界面不等待 Ollama 响应即可启动
+model_catalog.refresh_in_background()
 
 # 创建Gradio界面
 with gr.Blocks(css="""
@@ -304,7 +71,8 @@ with gr.Blocks(css="""
     gr.Markdown("### 麻瓜打标器，利用丰富的开源模型进行AI全自动打标的工具，打标偷懒作者：Eason", elem_id="title2")
     
     with gr.Row():
-        model_dropdown = gr.Dropdown(label="选择打标模型", choices=get_models(), elem_id="model-dropdown")
+        model_dropdown = gr.Dropdown(label="选择打标模型", choices=model_catalog.get_choices(), elem_id="model-dropdown")
+        refresh_models_button = gr.Button("刷新模型列表", size="sm", elem_id="refresh-models-button")
 
     with gr.Row():
         prompt_template_dropdown = gr.Dropdown(label="Prompt模板选择", choices=[template["title"] for template in prompt_templates], elem_id="template-dropdown")
@@ -319,6 +87,66 @@ with gr.Blocks(css="""
        
     with gr.Row():
         concurrency_input = gr.Number(label="并发数量", value=4, precision=0, elem_id="concurrency-input")
+        adaptive_concurrency_checkbox = gr.Checkbox(label="自适应并发（根据延迟和错误自动调整，并发数量作为上限）", value=concurrency_controller.is_enabled(), elem_id="adaptive-concurrency-checkbox")
+
+    adaptive_concurrency_checkbox.change(concurrency_controller.set_enabled, inputs=adaptive_concurrency_checkbox)
+
+    with gr.Row():
+        job_priority_dropdown = gr.Dropdown(label="新提交的批量任务优先级", choices=[name for name in job_scheduler.PRIORITIES if name != "交互"], value=job_scheduler.get_default_priority_name(), elem_id="job-priority-dropdown")
+        max_running_jobs_input = gr.Number(label="同时运行的批量任务数（其余排队）", value=job_scheduler.SCHEDULER_CONFIG["MAX_RUNNING_JOBS"], precision=0, elem_id="max-running-jobs-input")
+        backend_slots_input = gr.Number(label="每台服务器同时请求数（所有任务共享，0 为不限）", value=job_scheduler.SCHEDULER_CONFIG["BACKEND_SLOTS"], precision=0, elem_id="backend-slots-input")
+
+    job_priority_dropdown.change(job_scheduler.set_default_priority, inputs=job_priority_dropdown)
+    scheduler_inputs = [max_running_jobs_input, backend_slots_input]
+    for scheduler_component in scheduler_inputs:
+        scheduler_component.change(job_scheduler.configure, inputs=scheduler_inputs)
+
+    with gr.Row():
+        preprocess_checkbox = gr.Checkbox(label="上传前压缩图片", value=image_preprocess.PREPROCESS_CONFIG["ENABLED"], elem_id="preprocess-checkbox")
+        preprocess_max_side = gr.Number(label="最大边长", value=image_preprocess.PREPROCESS_CONFIG["MAX_SIDE"], precision=0, elem_id="preprocess-max-side")
+        preprocess_format = gr.Dropdown(label="编码格式", choices=["JPEG", "WEBP"], value=image_preprocess.PREPROCESS_CONFIG["FORMAT"], elem_id="preprocess-format")
+        preprocess_quality = gr.Number(label="压缩质量", value=image_preprocess.PREPROCESS_CONFIG["QUALITY"], precision=0, elem_id="preprocess-quality")
+
+    with gr.Row():
+        result_cache_checkbox = gr.Checkbox(label="使用结果缓存（相同模型、提示词和图片直接返回上次结果）", value=result_cache.is_enabled(), elem_id="result-cache-checkbox")
+        clear_result_cache_button = gr.Button("清空结果缓存", size="sm", elem_id="clear-result-cache-button")
+
+    with gr.Row():
+        streaming_checkbox = gr.Checkbox(label="流式生成（显示生成进度，超过上限时提前停止）", value=streaming.is_enabled(), elem_id="streaming-checkbox")
+        stream_max_tokens = gr.Number(label="最多输出 tokens（0 为不限）", value=streaming.STREAM_CONFIG["MAX_TOKENS"], precision=0, elem_id="stream-max-tokens")
+        stream_max_seconds = gr.Number(label="单次生成最长秒数（0 为不限）", value=streaming.STREAM_CONFIG["MAX_SECONDS"], elem_id="stream-max-seconds")
+
+    with gr.Row():
+        residency_checkbox = gr.Checkbox(label="预加载并常驻模型（任务开始前加载，任务期间不被卸载）", value=model_residency.is_enabled(), elem_id="residency-checkbox")
+        residency_vram = gr.Number(label="每台服务器的显存预算 GB（0 为同时只常驻一个模型）", value=model_residency.RESIDENCY_CONFIG["VRAM_GB"], elem_id="residency-vram")
+
+    residency_inputs = [residency_checkbox, residency_vram]
+    for residency_component in residency_inputs:
+        residency_component.change(model_residency.configure, inputs=residency_inputs)
+
+    result_cache_checkbox.change(result_cache.set_enabled, inputs=result_cache_checkbox)
+    clear_result_cache_button.click(lambda: gr.Info(result_cache.clear()))
+
+    with gr.Accordion("Ollama 服务器", open=False):
+        backends_input = gr.Textbox(label="服务器列表（每行一个地址，地址后可加空格和权重）", value="\n".join(f"{backend.url} {backend.weight:g}" for backend in backend_pool.get_backends()), lines=3, elem_id="backends-input")
+        with gr.Row():
+            apply_backends_button = gr.Button("应用并检测", size="sm", elem_id="apply-backends-button")
+        backends_status = gr.Textbox(label="服务器状态", value=backend_pool.format_status(), interactive=False, elem_id="backends-status")
+
+    def apply_backends(text):
+        backend_pool.configure(backend_pool.parse_backends(text))
+        model_catalog.refresh()
+        return backend_pool.format_status()
+
+    apply_backends_button.click(apply_backends, inputs=backends_input, outputs=backends_status)
+
+    streaming_inputs = [streaming_checkbox, stream_max_tokens, stream_max_seconds]
+    for streaming_component in streaming_inputs:
+        streaming_component.change(streaming.configure, inputs=streaming_inputs)
+
+    preprocess_inputs = [preprocess_checkbox, preprocess_max_side, preprocess_format, preprocess_quality]
+    for preprocess_component in preprocess_inputs:
+        preprocess_component.change(image_preprocess.configure, inputs=preprocess_inputs)
 
     def load_template(template_title):
         for template in prompt_templates:
@@ -338,7 +166,7 @@ with gr.Blocks(css="""
             with gr.Row() :
                 enable_refine_model = gr.Checkbox(label="启用精炼模型", elem_id="enable-refine-model")
             with gr.Row() :
-                refine_model_dropdown = gr.Dropdown(label="选择精炼模型", choices=get_models(), elem_id="refine-model-dropdown")
+                refine_model_dropdown = gr.Dropdown(label="选择精炼模型", choices=model_catalog.get_choices(), elem_id="refine-model-dropdown")
                 hardware_dropdown = gr.Dropdown(label="选择硬件", choices=["GPU", "CPU"], value="GPU", elem_id="hardware-dropdown")
             with gr.Row() :
                 use_image_checkbox = gr.Checkbox(label="是否识别图像", elem_id="use-image-checkbox")
@@ -349,53 +177,26 @@ with gr.Blocks(css="""
             single_output2 = gr.Textbox(label="处理结果 2", elem_id="single-output2")
 
             def handle_single_image_plus(model, prompt1, prompt2, image, enable_refine, refine_model, use_image, hardware):
-                global stop_flag
-                stop_flag = False
-
                 if not model or not prompt1 or not image:
                     return "请选择一个模型并输入Prompt和图片。", ""
                 save_prompt(prompt1, prompt2, model, "单图处理PLUS")
-                result1, elapsed_time1 = process_single_image(model, prompt1, image, hardware)
-
-                if enable_refine:
-                    combined_prompt = prompt2.format(result1)
-                    if use_image:
-                        with open(image, "rb") as img_file:
-                            img_base64 = base64.b64encode(img_file.read()).decode('utf-8')
-                        payload = {
-                            "model": refine_model,
-                            "prompt": combined_prompt,
-                            "images": [img_base64],
-                            "stream": False,
-                            "hardware": hardware
-                        }
-                    else:
-                        payload = {
-                            "model": refine_model,
-                            "prompt": combined_prompt,
-                            "stream": False,
-                            "hardware": hardware
-                        }
-
-                    try:
-                        response = requests.post(f"{CONFIG['OLLAMA_API_URL']}/generate", json=payload, timeout=120)
-                        response.raise_for_status()
-                        result2 = response.json().get("response", "")
-                        return result1, result2
-                    except requests.RequestException as e:
-                        logging.error(f"Error processing image: {e}")
-                        if "Read timed out" in str(e):
-                            restart_ollama()
-                        return result1, "处理失败，请检查API连接。"
-                else:
-                    return result1, ""
-
-            def stop_task():
-                global stop_flag
-                stop_flag = True
+                token = cancellation.start("单图处理PLUS")
+                try:
+                    return run_single_image_plus(model, prompt1, prompt2, image, enable_refine, refine_model, use_image, hardware, token)
+                except concurrent.futures.CancelledError:
+                    return "处理被停止。", ""
+                finally:
+                    cancellation.finish(token)
+
+            # 只停止从指定标签页启动的任务：未开始的图片不再处理，进行中的请求立即中断
+            def stop_task(scope):
+                if job_scheduler.cancel_queued(scope):
+                    gr.Info("已取消排队中的任务。")
+                elif cancellation.cancel(scope):
+                    gr.Info("已停止任务，已完成的文件已保存。")
 
             process_button_plus.click(handle_single_image_plus, inputs=[model_dropdown, prompt_input, prompt_input2, image_input_plus, enable_refine_model, refine_model_dropdown, use_image_checkbox, hardware_dropdown], outputs=[single_output1, single_output2])
-            stop_button_plus.click(stop_task)
+            stop_button_plus.click(lambda: stop_task("单图处理PLUS"))
 
         with gr.TabItem("多图处理", elem_id="multi-tab"):
             gr.Markdown("该功能允许用户选择一个文件夹，系统会遍历该文件夹中的所有图片文件，并通过选择的AI模型生成描述。用户可以选择不同的打标方式（忽略、覆盖、加入前面、加入后面）来处理已存在的同名txt文件。", elem_id="multi-description")
@@ -406,198 +207,53 @@ with gr.Blocks(css="""
             stop_button_folder = gr.Button("停止", elem_id="stop-button-folder")
             folder_output = gr.Textbox(label="处理结果", elem_id="folder-output", interactive=False)
 
-            process_folder_button.click(process_folder_images, inputs=[model_dropdown, prompt_input, folder_input, action_dropdown_folder, gr.State("GPU"), concurrency_input], outputs=folder_output)
-            stop_button_folder.click(stop_task)
+            process_folder_button.click(functools.partial(job_output.stream_job, process_folder_images, scope="多图处理"), inputs=[model_dropdown, prompt_input, folder_input, action_dropdown_folder, gr.State("GPU"), concurrency_input], outputs=folder_output)
+            stop_button_folder.click(lambda: stop_task("多图处理"))
 
         with gr.TabItem("多图处理PLUS", elem_id="multi-plus-tab"):
-            gr.Markdown("选择一个文件夹，会遍历该文件夹中的所有图片文件，执行后，先通过选择的AI模型整体生成一遍描述，存在本地目录，再将该描述返回给精炼模型进行二次处理，对文本精度进行多一轮的保证。", elem_id="multi-plus-description")
+            gr.Markdown("选择一个文件夹，会遍历该文件夹中的所有图片文件，执行后，每张图片先通过选择的AI模型生成描述并存在本地目录，随即交给精炼模型进行二次处理（打标和精炼同时进行），对文本精度进行多一轮的保证。", elem_id="multi-plus-description")
 
             folder_input_plus = gr.Textbox(label="文件夹路径", elem_id="folder-input-plus")
             action_dropdown_folder_plus = gr.Dropdown(label="选择打标方式", choices=["忽略", "覆盖", "加入前面", "加入后面"], elem_id="action-dropdown-folder-plus")
-            refine_model_dropdown_plus = gr.Dropdown(label="选择精炼模型", choices=get_models(), elem_id="refine-model-dropdown-plus")
+            refine_model_dropdown_plus = gr.Dropdown(label="选择精炼模型", choices=model_catalog.get_choices(), elem_id="refine-model-dropdown-plus")
             use_image_checkbox_plus = gr.Checkbox(label="是否识别图像", elem_id="use-image-checkbox-plus")
             hardware_dropdown_plus = gr.Dropdown(label="选择硬件", choices=["GPU", "CPU"], value="GPU", elem_id="hardware-dropdown-plus")
             process_folder_button_plus = gr.Button("执行", elem_id="process-folder-button-plus")
             stop_button_folder_plus = gr.Button("停止", elem_id="stop-button-folder-plus")
             folder_output_plus = gr.Textbox(label="处理结果", elem_id="folder-output-plus", interactive=False)
 
-            process_folder_button_plus.click(process_folder_images, inputs=[model_dropdown, prompt_input, folder_input_plus, action_dropdown_folder_plus, hardware_dropdown_plus, concurrency_input, refine_model_dropdown_plus, prompt_input2, use_image_checkbox_plus], outputs=folder_output_plus)
-            stop_button_folder_plus.click(stop_task)
+            process_folder_button_plus.click(functools.partial(job_output.stream_job, process_folder_images, scope="多图处理PLUS"), inputs=[model_dropdown, prompt_input, folder_input_plus, action_dropdown_folder_plus, hardware_dropdown_plus, concurrency_input, refine_model_dropdown_plus, prompt_input2, use_image_checkbox_plus], outputs=folder_output_plus)
+            stop_button_folder_plus.click(lambda: stop_task("多图处理PLUS"))
 
         with gr.TabItem("AI-Multi-Tag", elem_id="ai-multiple-tab"):
-            gr.Markdown("该功能为实现性功能，选择一个文件夹，并通过多个选择的AI模型生成描述，再将其给到精炼模型对结果进行进一步处理，增加描述的丰富度。", elem_id="ai-multiple-description")
+            gr.Markdown("该功能为实现性功能，选择一个文件夹，并通过多个选择的AI模型生成描述，再将其给到精炼模型对结果进行进一步处理，增加描述的丰富度。图片按窗口分批，每批内先用一个模型处理完所有图片再换下一个模型，减少单显卡上模型反复加载的时间。", elem_id="ai-multiple-description")
 
             folder_input_multiple = gr.Textbox(label="文件夹路径", elem_id="folder-input-multiple")
             action_dropdown_multiple = gr.Dropdown(label="选择打标方式", choices=["忽略", "覆盖", "加入前面", "加入后面"], elem_id="action-dropdown-multiple")
 
             with gr.Row():
-                multi_tag_model_1 = gr.Dropdown(label="Multi-Tag 1 模型", choices=get_models(), elem_id="multi-tag-model-1")
+                multi_tag_model_1 = gr.Dropdown(label="Multi-Tag 1 模型", choices=model_catalog.get_choices(), elem_id="multi-tag-model-1")
                 enable_multi_tag_model_1 = gr.Checkbox(label="启用", value=True, elem_id="enable-multi-tag-model-1")
 
             with gr.Row():
-                multi_tag_model_2 = gr.Dropdown(label="Multi-Tag 2 模型", choices=get_models(), elem_id="multi-tag-model-2")
+                multi_tag_model_2 = gr.Dropdown(label="Multi-Tag 2 模型", choices=model_catalog.get_choices(), elem_id="multi-tag-model-2")
                 enable_multi_tag_model_2 = gr.Checkbox(label="启用", value=False, elem_id="enable-multi-tag-model-2")
 
             with gr.Row():
-                multi_tag_model_3 = gr.Dropdown(label="Multi-Tag 3 模型", choices=get_models(), elem_id="multi-tag-model-3")
+                multi_tag_model_3 = gr.Dropdown(label="Multi-Tag 3 模型", choices=model_catalog.get_choices(), elem_id="multi-tag-model-3")
                 enable_multi_tag_model_3 = gr.Checkbox(label="启用", value=False, elem_id="enable-multi-tag-model-3")
 
             enable_refine_model_multiple = gr.Checkbox(label="启用精炼模型", elem_id="enable-refine-model-multiple")
-            refine_model_dropdown_multiple = gr.Dropdown(label="选择精炼模型", choices=get_models(), elem_id="refine-model-dropdown-multiple")
+            refine_model_dropdown_multiple = gr.Dropdown(label="选择精炼模型", choices=model_catalog.get_choices(), elem_id="refine-model-dropdown-multiple")
             use_image_checkbox_multiple = gr.Checkbox(label="是否识别图像", elem_id="use-image-checkbox-multiple")
             hardware_dropdown_multiple = gr.Dropdown(label="选择硬件", choices=["GPU", "CPU"], value="GPU", elem_id="hardware-dropdown-multiple")
+            window_size_multiple = gr.Number(label="分组窗口大小（每批图片数量，按模型分组处理）", value=200, precision=0, elem_id="window-size-multiple")
             process_folder_button_multiple = gr.Button("执行", elem_id="process-folder-button-multiple")
             stop_button_folder_multiple = gr.Button("停止", elem_id="stop-button-folder-multiple")
             folder_output_multiple = gr.Textbox(label="处理结果", elem_id="folder-output-multiple", interactive=False)
 
-            def process_folder_multiple(model, prompt1, folder_path, action, multi_tag_model_1, enable_multi_tag_model_1, multi_tag_model_2, enable_multi_tag_model_2, multi_tag_model_3, enable_multi_tag_model_3, refine_model, enable_refine, use_image, hardware, prompt2, concurrency):
-                global stop_flag
-                stop_flag = False
-
-                multi_tag_models = [(multi_tag_model_1, enable_multi_tag_model_1), (multi_tag_model_2, enable_multi_tag_model_2), (multi_tag_model_3, enable_multi_tag_model_3)]
-                if not model or not prompt1 or not folder_path or not any(enable for _, enable in multi_tag_models):
-                    return "请选择一个模型并输入Prompt和文件夹路径。"
-                save_prompt(prompt1, prompt2, model, "AI-Multiple")
-
-                if not os.path.isdir(folder_path):
-                    return "无效的文件夹路径。"
-
-                files, txt_status = get_files_and_txt_status(folder_path)
-                results = []
-
-                start_time = time.time()
-                if action == "忽略":
-                    files = [file for file in files if not txt_status[file]]  # 只处理没有同名txt文件的图片
-                total_files = len(files)
-                processed_files = 0
-                last_10_times = []
-                previous_time = time.time()
-
-                def process_file(file):
-                    nonlocal previous_time
-                    if stop_flag:
-                        return f"{file}: 处理被停止。"
-                    if txt_status[file] and action == "忽略":
-                        return f"{file}: 文件已存在，选择忽略。"
-
-                    # 处理第一步，使用选择的模型
-                    result1, elapsed_time1 = process_single_image(model, prompt1, file, hardware)
-                    combined_results = [result1]
-
-                    # 处理 Multi-Tag 模型
-                    for multi_tag_model, enable in multi_tag_models:
-                        if enable:
-                            multi_tag_result, elapsed_time_multi = process_single_image(multi_tag_model, prompt1, file, hardware)
-                            combined_results.append(multi_tag_result)
-
-                    # 将所有结果合并到 Prompt 2
-                    combined_prompt = prompt2.format("\n————————————————\n".join(combined_results))
-
-                    if enable_refine:
-                        if use_image:
-                            with open(file, "rb") as img_file:
-                                img_base64 = base64.b64encode(img_file.read()).decode('utf-8')
-                            payload = {
-                                "model": refine_model,
-                                "prompt": combined_prompt,
-                                "images": [img_base64],
-                                "stream": False,
-                                "hardware": hardware  # 添加硬件参数
-                            }
-                        else:
-                            payload = {
-                                "model": refine_model,
-                                "prompt": combined_prompt,
-                                "stream": False,
-                                "hardware": hardware  # 添加硬件参数
-                            }
-
-                        try:
-                            response = requests.post(f"{CONFIG['OLLAMA_API_URL']}/generate", json=payload, timeout=120)
-                            response.raise_for_status()
-                            result2 = response.json().get("response", "")
-
-                            txt_path = os.path.join(os.path.dirname(file), f"{os.path.splitext(os.path.basename(file))[0]}.txt")
-                            if os.path.exists(txt_path):
-                                if action == "忽略":
-                                    return f"{file}: 文件已存在，选择忽略。", elapsed_time1
-                                elif action == "覆盖":
-                                    with open(txt_path, "w") as txt_file:
-                                        txt_file.write(result2)
-                                    return f"{file}: 处理完成，结果已覆盖到 {txt_path}", elapsed_time1
-                                elif action == "加入前面":
-                                    with open(txt_path, "r+") as txt_file:
-                                        content = txt_file.read()
-                                        txt_file.seek(0, 0)
-                                        txt_file.write(result2 + ", " + content)
-                                    return f"{file}: 处理完成，结果已加入前面到 {txt_path}", elapsed_time1
-                                elif action == "加入后面":
-                                    with open(txt_path, "a") as txt_file:
-                                        txt_file.write(", " + result2)
-                                    return f"{file}: 处理完成，结果已加入后面到 {txt_path}", elapsed_time1
-                            else:
-                                with open(txt_path, "w") as txt_file:
-                                    txt_file.write(result2)
-                                return f"{file}: 处理完成，结果已保存到 {txt_path}", elapsed_time1
-
-                        except requests.RequestException as e:
-                            logging.error(f"Error processing image: {e}")
-                            if "Read timed out" in str(e):
-                                restart_ollama()
-                            return f"{file}: 处理失败，请检查API连接。", elapsed_time1
-
-                    else:
-                        txt_path = os.path.join(os.path.dirname(file), f"{os.path.splitext(os.path.basename(file))[0]}.txt")
-                        if os.path.exists(txt_path):
-                            if action == "忽略":
-                                return f"{file}: 文件已存在，选择忽略。", elapsed_time1
-                            elif action == "覆盖":
-                                with open(txt_path, "w") as txt_file:
-                                    txt_file.write("\n————————————————\n".join(combined_results))
-                                return f"{file}: 处理完成，结果已覆盖到 {txt_path}", elapsed_time1
-                            elif action == "加入前面":
-                                with open(txt_path, "r+") as txt_file:
-                                    content = txt_file.read()
-                                    txt_file.seek(0, 0)
-                                    txt_file.write("\n————————————————\n".join(combined_results) + ", " + content)
-                                return f"{file}: 处理完成，结果已加入前面到 {txt_path}", elapsed_time1
-                            elif action == "加入后面":
-                                with open(txt_path, "a") as txt_file:
-                                    txt_file.write(", " + "\n————————————————\n".join(combined_results))
-                                return f"{file}: 处理完成，结果已加入后面到 {txt_path}", elapsed_time1
-                        else:
-                            with open(txt_path, "w") as txt_file:
-                                txt_file.write("\n————————————————\n".join(combined_results))
-                            return f"{file}: 处理完成，结果已保存到 {txt_path}", elapsed_time1
-
-                    current_time = time.time()
-                    elapsed_time = current_time - previous_time
-                    previous_time = current_time
-                    return result1, elapsed_time
-
-                with concurrent.futures.ThreadPoolExecutor(max_workers=int(concurrency)) as executor:
-                    future_to_file = {executor.submit(process_file, file): file for file in files if not txt_status[file]}
-                    for future in concurrent.futures.as_completed(future_to_file):
-                        file = future_to_file[future]
-                        try:
-                            result, elapsed_time = future.result()
-                        except Exception as e:
-                            result = f"{file}: 处理失败，错误: {e}"
-                            elapsed_time = 0
-                        results.append(result)
-
-                        processed_files += 1
-                        last_10_times.append(elapsed_time)
-                        if len(last_10_times) > 10:
-                            last_10_times.pop(0)
-                        avg_time_per_file = sum(last_10_times) / len(last_10_times) if last_10_times else 0
-                        remaining_time = avg_time_per_file * (total_files - processed_files)
-                        logging.info(f"当前任务耗时: {elapsed_time:.2f}秒, 进度 {processed_files}/{total_files} files. 预计剩余时间: {format_remaining_time(remaining_time)}.")
-
-                return "\n".join(results)
-
             process_folder_button_multiple.click(
-                process_folder_multiple,
+                functools.partial(job_output.stream_job, process_folder_multiple),
                 inputs=[
                     model_dropdown,
                     prompt_input,
@@ -614,11 +270,12 @@ with gr.Blocks(css="""
                     use_image_checkbox_multiple,
                     hardware_dropdown_multiple,
                     prompt_input2,
-                    concurrency_input
+                    concurrency_input,
+                    window_size_multiple
                 ],
                 outputs=folder_output_multiple
             )
-            stop_button_folder_multiple.click(stop_task)
+            stop_button_folder_multiple.click(lambda: stop_task("AI-Multi-Tag"))
 
         with gr.TabItem("文字处理", elem_id="post-process-tab"):
             with gr.Tabs():
@@ -636,24 +293,11 @@ with gr.Blocks(css="""
                         if not os.path.isdir(folder_path):
                             return "无效的文件夹路径。"
 
-                        results = []
-                        for root, _, files in os.walk(folder_path):
-                            txt_files = [f for f in files if f.lower().endswith('.txt')]
-                            for txt_file in txt_files:
-                                txt_path = os.path.join(root, txt_file)
-                                with open(txt_path, "r") as file:
-                                    content = file.read()
-
-                                if insert_position == "front":
-                                    with open(txt_path, "w") as file:
-                                        file.write(text + content)
-                                    results.append(f"{txt_file}: 插入最前面")
-                                elif insert_position == "end":
-                                    with open(txt_path, "a") as file:
-                                        file.write(", " + text)
-                                    results.append(f"{txt_file}: 插入最后面")
-
-                        return "\n".join(results)
+                        if insert_position == "front":
+                            operation = text_transform.prepend_operation(text)
+                        else:
+                            operation = text_transform.append_operation(text)
+                        return text_transform.transform_folder(folder_path, [operation]).format()
 
                     insert_front_button.click(handle_txt_folder, inputs=[folder_txt_input, text_input, gr.State("front")], outputs=txt_output)
                     insert_end_button.click(handle_txt_folder, inputs=[folder_txt_input, text_input, gr.State("end")], outputs=txt_output)
@@ -671,30 +315,44 @@ with gr.Blocks(css="""
                         if not os.path.isdir(folder_path):
                             return "无效的文件夹路径。"
 
-                        results = []
-                        for root, _, files in os.walk(folder_path):
-                            txt_files = [f for f in files if f.lower().endswith('.txt')]
-                            for txt_file in txt_files:
-                                txt_path = os.path.join(root, txt_file)
-                                with open(txt_path, "r") as file:
-                                    content = file.read()
+                        if not find_text:
+                            return "查找文字不能为空。"
 
-                                new_content = content.replace(find_text, replace_text)
+                        return text_transform.transform_folder(folder_path, [text_transform.replace_operation(find_text, replace_text)]).format()
 
-                                with open(txt_path, "w") as file:
-                                    file.write(new_content)
+                    replace_button.click(handle_txt_replace, inputs=[folder_txt_replace_input, find_text_input, replace_text_input], outputs=replace_output)
 
-                                results.append(f"{txt_file}: 替换完成")
+                with gr.TabItem("批量处理"):
+                    gr.Markdown("该功能允许用户一次输入多条文字处理操作（替换、正则替换、插入、标签去重、修剪），对文件夹中的所有txt文件并行处理一遍，内容没有变化的文件不会重写。", elem_id="batch-transform-description")
 
-                        return "\n".join(results)
+                    folder_transform_input = gr.Textbox(label="TXT 文件夹路径", elem_id="folder-transform-input")
+                    transform_rules_input = gr.Textbox(label="处理规则", lines=8, placeholder=text_transform.RULE_HELP, elem_id="transform-rules-input")
+                    transform_button = gr.Button("执行", elem_id="transform-button")
+                    transform_output = gr.Textbox(label="处理结果", elem_id="transform-output")
 
-                    replace_button.click(handle_txt_replace, inputs=[folder_txt_replace_input, find_text_input, replace_text_input], outputs=replace_output)
+                    def handle_txt_transform(folder_path, rules_text):
+                        if not os.path.isdir(folder_path):
+                            return "无效的文件夹路径。"
+
+                        try:
+                            operations = text_transform.parse_rules(rules_text)
+                        except ValueError as e:
+                            return str(e)
+                        if not operations:
+                            return "请输入处理规则。"
+
+                        return text_transform.transform_folder(folder_path, operations).format()
+
+                    transform_button.click(handle_txt_transform, inputs=[folder_transform_input, transform_rules_input], outputs=transform_output)
 
                 with gr.TabItem("删除文件"):
                     gr.Markdown("该功能允许用户在指定文件夹中查找包含指定文字的txt文件，并删除这些文件。用户可以选择是否区分大小写进行查找。", elem_id="delete-files-description")
 
                     folder_delete_input = gr.Textbox(label="文件夹地址输入", elem_id="folder-delete-input")
                     delete_text_input = gr.Textbox(label="包含文字", elem_id="delete-text-input")
+                    with gr.Row():
+                        delete_search_mode_dropdown = gr.Dropdown(label="搜索方式", choices=dataset_index.SEARCH_MODES, value=dataset_index.SEARCH_MODES[0], elem_id="delete-search-mode-dropdown")
+                        delete_page_input = gr.Number(label="页码", value=1, precision=0, minimum=1, elem_id="delete-page-input")
                     case_sensitive_checkbox = gr.Checkbox(label="区分大小写", elem_id="case-sensitive-checkbox")
                     search_button = gr.Button("搜索", elem_id="search-button")
                     with gr.Row():
@@ -708,31 +366,23 @@ with gr.Blocks(css="""
 
                     delete_empty_txt_button = gr.Button("删除空TXT文件", elem_id="delete-empty-txt-button")
 
-                    def search_files(folder_path, search_text, case_sensitive):
+                    def search_files(folder_path, search_text, case_sensitive, search_mode="包含文字", page=1):
                         global txt_files_global
                         if not os.path.isdir(folder_path):
                             return "无效的文件夹路径。"
 
-                        txt_files = []
-                        all_txt_files = 0
-                        all_image_files = 0
-                        for root, _, files in os.walk(folder_path):
-                            for file in files:
-                                if file.lower().endswith('.txt'):
-                                    all_txt_files += 1
-                                    txt_path = os.path.join(root, file)
-                                    with open(txt_path, "r", encoding="utf-8", errors="ignore") as txt_file:
-                                        content = txt_file.read()
-                                        if (case_sensitive and search_text in content) or (not case_sensitive and search_text.lower() in content.lower()):
-                                            txt_files.append(txt_path)
-                                elif file.lower().endswith(('.png', '.jpg', '.jpeg', '.bmp', '.gif')):
-                                    all_image_files += 1
+                        index = dataset_index.refreshed_index(folder_path)
+                        try:
+                            txt_files = index.search_captions(search_text, case_sensitive, search_mode)
+                        except ValueError as e:
+                            return str(e)
+                        all_image_files, all_txt_files = index.count_files()
 
                         txt_files_global = txt_files
                         result = f"符合文件的数量: {len(txt_files)}\n"
                         result += f"已打标签图片总数: {all_txt_files}\n"
                         result += f"图片文件总数: {all_image_files}\n"
-                        result += "符合要求的文件名称:\n" + "\n".join(txt_files)
+                        result += format_search_page(txt_files, page)
                         return result
 
                     def delete_files(txt_files, delete_images=False):
@@ -745,6 +395,7 @@ with gr.Blocks(css="""
                                 if os.path.exists(image_file):
                                     os.remove(image_file)
                                     deleted_files.append(image_file)
+                        dataset_index.forget_files(deleted_files)
                         return f"已删除文件: {', '.join(deleted_files)}"
 
                     def search_non_utf8_files(folder_path):
@@ -752,16 +403,7 @@ with gr.Blocks(css="""
                         if not os.path.isdir(folder_path):
                             return "无效的文件夹路径。"
 
-                        non_utf8_files = []
-                        for root, _, files in os.walk(folder_path):
-                            for file in files:
-                                if file.lower().endswith('.txt'):
-                                    txt_path = os.path.join(root, file)
-                                    try:
-                                        with open(txt_path, "r", encoding="utf-8") as txt_file:
-                                            txt_file.read()
-                                    except UnicodeDecodeError:
-                                        non_utf8_files.append(txt_path)
+                        non_utf8_files = dataset_index.refreshed_index(folder_path).non_utf8_files()
                         non_utf8_files_global = non_utf8_files
                         return f"符合非UTF-8文件的数量: {len(non_utf8_files)}\n非UTF-8文件名称:\n" + "\n".join(non_utf8_files)
 
@@ -770,6 +412,7 @@ with gr.Blocks(css="""
                         for txt_file in non_utf8_files:
                             os.remove(txt_file)
                             deleted_files.append(txt_file)
+                        dataset_index.forget_files(deleted_files)
                         return f"已删除非UTF-8文件: {', '.join(deleted_files)}"
 
                     def delete_empty_txt_files(folder_path):
@@ -777,16 +420,16 @@ with gr.Blocks(css="""
                             return "无效的文件夹路径。"
 
                         deleted_files = []
-                        for root, _, files in os.walk(folder_path):
-                            for file in files:
-                                if file.lower().endswith('.txt'):
-                                    txt_path = os.path.join(root, file)
-                                    if os.path.getsize(txt_path) == 0:
-                                        os.remove(txt_path)
-                                        deleted_files.append(txt_path)
+                        for txt_path in dataset_index.refreshed_index(folder_path).empty_txt_files():
+                            if os.path.getsize(txt_path) == 0:
+                                os.remove(txt_path)
+                                deleted_files.append(txt_path)
+                        dataset_index.forget_files(deleted_files)
                         return f"已删除空TXT文件: {', '.join(deleted_files)}"
 
-                    search_button.click(search_files, inputs=[folder_delete_input, delete_text_input, case_sensitive_checkbox], outputs=file_count_output)
+                    search_inputs = [folder_delete_input, delete_text_input, case_sensitive_checkbox, delete_search_mode_dropdown, delete_page_input]
+                    search_button.click(search_files, inputs=search_inputs, outputs=file_count_output)
+                    delete_page_input.submit(search_files, inputs=search_inputs, outputs=file_count_output)
                     delete_txt_button.click(lambda: delete_files(txt_files_global, delete_images=False), outputs=file_count_output)
                     delete_txt_image_button.click(lambda: delete_files(txt_files_global, delete_images=True), outputs=file_count_output)
 
@@ -800,6 +443,9 @@ with gr.Blocks(css="""
                     folder_move_input = gr.Textbox(label="文件夹地址输入", elem_id="folder-move-input")
                     move_target_input = gr.Textbox(label="转移地址", elem_id="move-target-input")
                     move_text_input = gr.Textbox(label="包含文字", elem_id="move-text-input")
+                    with gr.Row():
+                        move_search_mode_dropdown = gr.Dropdown(label="搜索方式", choices=dataset_index.SEARCH_MODES, value=dataset_index.SEARCH_MODES[0], elem_id="move-search-mode-dropdown")
+                        move_page_input = gr.Number(label="页码", value=1, precision=0, minimum=1, elem_id="move-page-input")
                     case_sensitive_move_checkbox = gr.Checkbox(label="区分大小写", elem_id="case-sensitive-move-checkbox")
                     search_move_button = gr.Button("搜索", elem_id="search-move-button")
                     with gr.Row():
@@ -807,42 +453,43 @@ with gr.Blocks(css="""
                         move_txt_image_button = gr.Button("转移txt+同名图片", elem_id="move-txt-image-button", elem_classes="red-button")
                     file_count_move_output = gr.Textbox(label="文件数量显示栏", elem_id="file-count-move-output", interactive=False)
 
-                    def search_move_files(folder_path, search_text, case_sensitive):
+                    def search_move_files(folder_path, search_text, case_sensitive, search_mode="包含文字", page=1):
                         global txt_files_global
                         if not os.path.isdir(folder_path):
                             return "无效的文件夹路径。"
 
-                        txt_files = []
-                        for root, _, files in os.walk(folder_path):
-                            for file in files:
-                                if file.lower().endswith('.txt'):
-                                    txt_path = os.path.join(root, file)
-                                    with open(txt_path, "r", encoding="utf-8", errors="ignore") as txt_file:
-                                        content = txt_file.read()
-                                        if (case_sensitive and search_text in content) or (not case_sensitive and search_text.lower() in content.lower()):
-                                            txt_files.append(txt_path)
+                        try:
+                            txt_files = dataset_index.refreshed_index(folder_path).search_captions(search_text, case_sensitive, search_mode)
+                        except ValueError as e:
+                            return str(e)
 
                         txt_files_global = txt_files
-                        return f"符合文件的数量: {len(txt_files)}\n符合要求的文件名称:\n" + "\n".join(txt_files)
+                        return f"符合文件的数量: {len(txt_files)}\n" + format_search_page(txt_files, page)
 
                     def move_files(txt_files, target_folder, move_images=False):
                         if not os.path.isdir(target_folder):
                             return "无效的目标文件夹路径。"
 
                         moved_files = []
+                        source_files = []
                         for txt_file in txt_files:
                             target_path = os.path.join(target_folder, os.path.basename(txt_file))
                             shutil.move(txt_file, target_path)
                             moved_files.append(target_path)
+                            source_files.append(txt_file)
                             if move_images:
                                 image_file = os.path.splitext(txt_file)[0] + os.path.splitext(txt_file)[1]
                                 if os.path.exists(image_file):
                                     target_image_path = os.path.join(target_folder, os.path.basename(image_file))
                                     shutil.move(image_file, target_image_path)
                                     moved_files.append(target_image_path)
+                                    source_files.append(image_file)
+                        dataset_index.forget_files(source_files)
                         return f"已转移文件: {', '.join(moved_files)}"
 
-                    search_move_button.click(search_move_files, inputs=[folder_move_input, move_text_input, case_sensitive_move_checkbox], outputs=file_count_move_output)
+                    search_move_inputs = [folder_move_input, move_text_input, case_sensitive_move_checkbox, move_search_mode_dropdown, move_page_input]
+                    search_move_button.click(search_move_files, inputs=search_move_inputs, outputs=file_count_move_output)
+                    move_page_input.submit(search_move_files, inputs=search_move_inputs, outputs=file_count_move_output)
                     move_txt_button.click(lambda target_folder: move_files(txt_files_global, target_folder, move_images=False), inputs=[move_target_input], outputs=file_count_move_output)
                     move_txt_image_button.click(lambda target_folder: move_files(txt_files_global, target_folder, move_images=True), inputs=[move_target_input], outputs=file_count_move_output)
 
@@ -852,95 +499,14 @@ with gr.Blocks(css="""
                     gr.Markdown("对已近有标签的图片进行文字精炼或润色，比如WD14或者“多图处理”等打完一次标的文件。但是仅对文字进行优化，不会再次识别图片。选择一个文件夹，系统会遍历该文件夹及其子文件夹中的所有txt文件，并将txt文件的内容插入到精炼提示词的{}内，然后使用选择的精炼模型处理，结果将覆盖原txt文件。", elem_id="refine-description")
 
                     folder_input_refine = gr.Textbox(label="文件夹路径", elem_id="folder-input-refine")
-                    refine_model_dropdown_refine = gr.Dropdown(label="选择精炼模型", choices=get_models(), elem_id="refine-model-dropdown-refine")
+                    refine_model_dropdown_refine = gr.Dropdown(label="选择精炼模型", choices=model_catalog.get_choices(), elem_id="refine-model-dropdown-refine")
                     hardware_dropdown_refine = gr.Dropdown(label="选择硬件", choices=["GPU", "CPU"], value="GPU", elem_id="hardware-dropdown-refine")
                     process_refine_button = gr.Button("执行", elem_id="process-refine-button")
                     stop_button_refine = gr.Button("停止", elem_id="stop-button-refine")
                     refine_output = gr.Textbox(label="处理结果", elem_id="refine-output", interactive=False)
 
-                    def process_refine(folder_path, refine_model, prompt2, hardware, concurrency):
-                        global stop_flag
-                        stop_flag = False
-
-                        if not refine_model or not prompt2 or not folder_path:
-                            return "请选择一个精炼模型并输入Prompt和文件夹路径。"
-
-                        if not os.path.isdir(folder_path):
-                            return "无效的文件夹路径。"
-
-                        txt_files = []
-                        for root, _, files in os.walk(folder_path):
-                            for file in files:
-                                if file.lower().endswith('.txt'):
-                                    txt_files.append(os.path.join(root, file))
-
-                        results = []
-
-                        start_time = time.time()
-                        total_files = len(txt_files)
-                        processed_files = 0
-                        last_10_times = []
-                        previous_time = time.time()
-
-                        def process_file(txt_file):
-                            nonlocal previous_time
-                            if stop_flag:
-                                return f"{txt_file}: 处理被停止。"
-
-                            with open(txt_file, "r") as file:
-                                txt_content = file.read()
-
-                            combined_prompt = prompt2.format(txt_content) if "{}" in prompt2 else f"{prompt2}\n{txt_content}"
-
-                            payload = {
-                                "model": refine_model,
-                                "prompt": combined_prompt,
-                                "stream": False,
-                                "hardware": hardware  # 使用指定的硬件参数
-                            }
-
-                            try:
-                                response = requests.post(f"{CONFIG['OLLAMA_API_URL']}/generate", json=payload, timeout=120)
-                                response.raise_for_status()
-                                result = response.json().get("response", "")
-
-                                with open(txt_file, "w") as file:
-                                    file.write(result)
-
-                                current_time = time.time()
-                                elapsed_time = current_time - previous_time
-                                previous_time = current_time
-                                return f"{txt_file}: 处理完成", elapsed_time
-
-                            except requests.RequestException as e:
-                                logging.error(f"Error processing txt: {e}")
-                                if "Read timed out" in str(e):
-                                    restart_ollama()
-                                return f"{txt_file}: 处理失败，请检查API连接。", 0
-
-                        with concurrent.futures.ThreadPoolExecutor(max_workers=int(concurrency)) as executor:
-                            future_to_file = {executor.submit(process_file, txt_file): txt_file for txt_file in txt_files}
-                            for future in concurrent.futures.as_completed(future_to_file):
-                                txt_file = future_to_file[future]
-                                try:
-                                    result, elapsed_time = future.result()
-                                except Exception as e:
-                                    result = f"{txt_file}: 处理失败，错误: {e}"
-                                    elapsed_time = 0
-                                results.append(result)
-
-                                processed_files += 1
-                                last_10_times.append(elapsed_time)
-                                if len(last_10_times) > 10:
-                                    last_10_times.pop(0)
-                                avg_time_per_file = sum(last_10_times) / len(last_10_times) if last_10_times else 0
-                                remaining_time = avg_time_per_file * (total_files - processed_files)
-                                logging.info(f"当前任务耗时: {elapsed_time:.2f}秒, 进度 {processed_files}/{total_files} files. 预计剩余时间: {format_remaining_time(remaining_time)}.")
-
-                        return "\n".join(results)
-
-                    process_refine_button.click(process_refine, inputs=[folder_input_refine, refine_model_dropdown_refine, prompt_input2, hardware_dropdown_refine, concurrency_input], outputs=refine_output)
-                    stop_button_refine.click(stop_task)
+                    process_refine_button.click(functools.partial(job_output.stream_job, process_refine), inputs=[folder_input_refine, refine_model_dropdown_refine, prompt_input2, hardware_dropdown_refine, concurrency_input], outputs=refine_output)
+                    stop_button_refine.click(lambda: stop_task("精炼标签"))
 
                 with gr.TabItem("多模态标签润色"):
                     gr.Markdown("与精炼标签功能不同，该功能可以对已有标签的图片，通过通用AI模型对其标签文字和图片同时识别并进行重新润色处理或二次加工。用户可以输入文件夹地址，系统将遍历该文件夹及其子文件夹中的图片文件和txt文件，对包含txt文件的图片进行处理。", elem_id="post-refine-description")
@@ -948,152 +514,15 @@ with gr.Blocks(css="""
                     folder_input_multimodal_refine = gr.Textbox(label="文件夹路径", elem_id="folder-input-multimodal-refine")
                     action_dropdown_multimodal_refine = gr.Dropdown(label="选择打标方式", choices=["忽略", "覆盖", "加入前面", "加入后面"], value="覆盖", elem_id="action-dropdown-multimodal-refine")
                     enable_refine_model_multimodal = gr.Checkbox(label="启用精炼模型", elem_id="enable-refine-model-multimodal")
-                    refine_model_dropdown_multimodal_refine = gr.Dropdown(label="选择精炼模型", choices=get_models(), elem_id="refine-model-dropdown-multimodal-refine")
+                    refine_model_dropdown_multimodal_refine = gr.Dropdown(label="选择精炼模型", choices=model_catalog.get_choices(), elem_id="refine-model-dropdown-multimodal-refine")
                     use_image_checkbox_multimodal_refine = gr.Checkbox(label="是否识别图像", elem_id="use-image-checkbox-multimodal-refine")
                     hardware_dropdown_multimodal_refine = gr.Dropdown(label="选择硬件", choices=["GPU", "CPU"], value="GPU", elem_id="hardware-dropdown-multimodal-refine")
                     process_multimodal_refine_button = gr.Button("执行", elem_id="process-multimodal-refine-button")
                     stop_button_multimodal_refine = gr.Button("停止", elem_id="stop-button-multimodal-refine")
                     multimodal_refine_output = gr.Textbox(label="处理结果", elem_id="multimodal-refine-output", interactive=False)
 
-                    def process_multimodal_refine(model, prompt1, folder_path, action, refine_model, enable_refine, use_image, hardware, prompt2, concurrency):
-                        global stop_flag
-                        stop_flag = False
-
-                        if not model or not prompt1 or not folder_path:
-                            return "请选择一个模型并输入Prompt和文件夹路径。"
-                        save_prompt(prompt1, prompt2, model, "多模态标签润色")
-
-                        if not os.path.isdir(folder_path):
-                            return "无效的文件夹路径。"
-
-                        files, txt_status = get_files_and_txt_status(folder_path)
-                        results = []
-
-                        start_time = time.time()
-                        total_files = len([file for file in files if txt_status[file]])  # 只计算需要润色的文件数量
-                        processed_files = 0
-                        last_10_times = []
-                        previous_time = time.time()
-
-                        def process_file(file):
-                            nonlocal previous_time
-                            if stop_flag:
-                                return f"{file}: 处理被停止。"
-                            if not txt_status[file]:
-                                return f"{file}: 未找到对应的txt文件，跳过。"
-
-                            with open(txt_status[file], "r") as txt_file:
-                                txt_content = txt_file.read()
-
-                            combined_prompt = prompt1.format(txt_content) if "{}" in prompt1 else f"{prompt1}\n{txt_content}"
-
-                            result1, elapsed_time1 = process_single_image(model, combined_prompt, file, hardware)
-
-                            if enable_refine:
-                                if use_image:
-                                    with open(file, "rb") as img_file:
-                                        img_base64 = base64.b64encode(img_file.read()).decode('utf-8')
-                                    payload = {
-                                        "model": refine_model,
-                                        "prompt": f"{prompt2}\n{result1}",
-                                        "images": [img_base64],
-                                        "stream": False,
-                                        "hardware": hardware  # 添加硬件参数
-                                    }
-                                else:
-                                    payload = {
-                                        "model": refine_model,
-                                        "prompt": f"{prompt2}\n{result1}",
-                                        "stream": False,
-                                        "hardware": hardware  # 添加硬件参数
-                                    }
-
-                                try:
-                                    response = requests.post(f"{CONFIG['OLLAMA_API_URL']}/generate", json=payload, timeout=120)
-                                    response.raise_for_status()
-                                    result2 = response.json().get("response", "")
-
-                                    txt_path = os.path.join(os.path.dirname(file), f"{os.path.splitext(os.path.basename(file))[0]}.txt")
-                                    if os.path.exists(txt_path):
-                                        if action == "忽略":
-                                            return f"{file}: 文件已存在，选择忽略。", elapsed_time1
-                                        elif action == "覆盖":
-                                            with open(txt_path, "w") as txt_file:
-                                                txt_file.write(result2)
-                                            return f"{file}: 处理完成，结果已覆盖到 {txt_path}", elapsed_time1
-                                        elif action == "加入前面":
-                                            with open(txt_path, "r+") as txt_file:
-                                                content = txt_file.read()
-                                                txt_file.seek(0, 0)
-                                                txt_file.write(result2 + ", " + content)
-                                            return f"{file}: 处理完成，结果已加入前面到 {txt_path}", elapsed_time1
-                                        elif action == "加入后面":
-                                            with open(txt_path, "a") as txt_file:
-                                                txt_file.write(", " + result2)
-                                            return f"{file}: 处理完成，结果已加入后面到 {txt_path}", elapsed_time1
-                                    else:
-                                        with open(txt_path, "w") as txt_file:
-                                            txt_file.write(result2)
-                                        return f"{file}: 处理完成，结果已保存到 {txt_path}", elapsed_time1
-
-                                except requests.RequestException as e:
-                                    logging.error(f"Error processing image: {e}")
-                                    if "Read timed out" in str(e):
-                                        restart_ollama()
-                                    return f"{file}: 处理失败，请检查API连接。", elapsed_time1
-
-                            else:
-                                txt_path = os.path.join(os.path.dirname(file), f"{os.path.splitext(os.path.basename(file))[0]}.txt")
-                                if os.path.exists(txt_path):
-                                    if action == "忽略":
-                                        return f"{file}: 文件已存在，选择忽略。", elapsed_time1
-                                    elif action == "覆盖":
-                                        with open(txt_path, "w") as txt_file:
-                                            txt_file.write(result1)
-                                        return f"{file}: 处理完成，结果已覆盖到 {txt_path}", elapsed_time1
-                                    elif action == "加入前面":
-                                        with open(txt_path, "r+") as txt_file:
-                                            content = txt_file.read()
-                                            txt_file.seek(0, 0)
-                                            txt_file.write(result1 + ", " + content)
-                                        return f"{file}: 处理完成，结果已加入前面到 {txt_path}", elapsed_time1
-                                    elif action == "加入后面":
-                                        with open(txt_path, "a") as txt_file:
-                                            txt_file.write(", " + result1)
-                                        return f"{file}: 处理完成，结果已加入后面到 {txt_path}", elapsed_time1
-                                else:
-                                    with open(txt_path, "w") as txt_file:
-                                        txt_file.write(result1)
-                                    return f"{file}: 处理完成，结果已保存到 {txt_path}", elapsed_time1
-
-                            current_time = time.time()
-                            elapsed_time = current_time - previous_time
-                            previous_time = current_time
-                            return result1, elapsed_time
-
-                        with concurrent.futures.ThreadPoolExecutor(max_workers=int(concurrency)) as executor:
-                            future_to_file = {executor.submit(process_file, file): file for file in files if txt_status[file]}
-                            for future in concurrent.futures.as_completed(future_to_file):
-                                file = future_to_file[future]
-                                try:
-                                    result, elapsed_time = future.result()
-                                except Exception as e:
-                                    result = f"{file}: 处理失败，错误: {e}"
-                                    elapsed_time = 0
-                                results.append(result)
-
-                                processed_files += 1
-                                last_10_times.append(elapsed_time)
-                                if len(last_10_times) > 10:
-                                    last_10_times.pop(0)
-                                avg_time_per_file = sum(last_10_times) / len(last_10_times) if last_10_times else 0
-                                remaining_time = avg_time_per_file * (total_files - processed_files)
-                                logging.info(f"当前任务耗时: {elapsed_time:.2f}秒, 进度 {processed_files}/{total_files} files. 预计剩余时间: {format_remaining_time(remaining_time)}.")
-
-                        return "\n".join(results)
-
                     process_multimodal_refine_button.click(
-                        process_multimodal_refine,
+                        functools.partial(job_output.stream_job, process_multimodal_refine),
                         inputs=[
                             model_dropdown,
                             prompt_input,
@@ -1108,6 +537,63 @@ with gr.Blocks(css="""
                         ],
                         outputs=multimodal_refine_output
                     )
-                    stop_button_multimodal_refine.click(stop_task)
+                    stop_button_multimodal_refine.click(lambda: stop_task("多模态标签润色"))
+
+        with gr.TabItem("任务恢复", elem_id="resume-tab"):
+            gr.Markdown("程序中断或任务被停止后，可以在这里选择未完成的批量任务继续执行。每个文件已完成的阶段都记录在 jobs 文件夹中，恢复时会被跳过，不会重复打标或重复润色。", elem_id="resume-description")
 
-demo.launch(server_port=7888)
\ No newline at end of file
+            def list_resume_choices():
+                return [(f"{job['job_id']} | {job['mode']} | {job['params'].get('folder_path')} | 已完成 {job['completed']}", job["job_id"]) for job in job_journal.list_unfinished_jobs()]
+
+            def resume_job(job_id):
+                if not job_id:
+                    yield "请选择一个未完成的任务。"
+                    return
+                header = job_journal.load_job(job_id)
+                yield from job_output.stream_job(JOB_FUNCTIONS[header["mode"]], **header["params"], resume_job_id=job_id, scope="任务恢复")
+
+            resume_job_dropdown = gr.Dropdown(label="未完成的任务", choices=list_resume_choices(), elem_id="resume-job-dropdown")
+            with gr.Row():
+                refresh_jobs_button = gr.Button("刷新任务列表", size="sm", elem_id="refresh-jobs-button")
+                resume_job_button = gr.Button("恢复任务", elem_id="resume-job-button")
+                stop_button_resume = gr.Button("停止", elem_id="stop-button-resume")
+            resume_output = gr.Textbox(label="处理结果", elem_id="resume-output", interactive=False)
+
+            refresh_jobs_button.click(lambda: gr.update(choices=list_resume_choices()), outputs=resume_job_dropdown)
+            resume_job_button.click(resume_job, inputs=resume_job_dropdown, outputs=resume_output)
+            stop_button_resume.click(lambda: stop_task("任务恢复"))
+
+        with gr.TabItem("任务队列", elem_id="job-queue-tab"):
+            gr.Markdown("所有标签页提交的批量任务按优先级排队，同时运行的任务数和每台服务器的请求数由上方设置控制。单图处理不进入队列，总是优先拿到服务器的请求名额。", elem_id="job-queue-description")
+            job_queue_table = gr.Dataframe(headers=["编号", "任务", "优先级", "状态", "进度", "速度（项/秒）", "排队用时", "运行用时"], value=job_scheduler.format_jobs, interactive=False, elem_id="job-queue-table")
+            backend_slots_status = gr.Textbox(label="服务器请求名额", value=job_scheduler.format_backend_slots, interactive=False, elem_id="backend-slots-status")
+            job_queue_timer = gr.Timer(2)
+            job_queue_timer.tick(lambda: (job_scheduler.format_jobs(), job_scheduler.format_backend_slots()), outputs=[job_queue_table, backend_slots_status])
+
+    # 所有模型下拉框共用模型目录：页面加载时从缓存填充（首次获取未完成时稍等），点击按钮时立即重新获取
+    model_dropdowns = [
+        model_dropdown,
+        refine_model_dropdown,
+        refine_model_dropdown_plus,
+        multi_tag_model_1,
+        multi_tag_model_2,
+        multi_tag_model_3,
+        refine_model_dropdown_multiple,
+        refine_model_dropdown_refine,
+        refine_model_dropdown_multimodal_refine
+    ]
+
+    def update_model_dropdowns(refresh=False):
+        if refresh:
+            model_catalog.refresh()
+        else:
+            model_catalog.wait_until_loaded()
+        choices = model_catalog.get_choices()
+        return [gr.update(choices=choices) for _ in model_dropdowns]
+
+    refresh_models_button.click(lambda: update_model_dropdowns(refresh=True), outputs=model_dropdowns)
+    demo.load(update_model_dropdowns, outputs=model_dropdowns)
+
+if __name__ == "__main__":
+    metrics.start_server()
+    demo.launch(server_port=7888)
\ No newline at end of file
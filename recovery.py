@@ -0,0 +1,113 @@
+import time
+import random
+import asyncio
+import logging
+import threading
+import requests
+import ollama_client
+import backend_pool
+
+# 服务器故障恢复：每个服务器一个熔断器，由第一个发现超时/连接失败的请求发起恢复，
+# 恢复期间其他请求暂停等待而不是失败；一次故障最多重启一次 Ollama，
+# 重启后轮询 /api/tags 直到服务就绪（指数退避加随机抖动），而不是固定等待 10 秒
+
+RECOVERY_CONFIG = {
+    "MAX_ATTEMPTS": 5,
+    "READY_TIMEOUT": 120,
+    "BACKOFF_BASE": 0.5,
+    "BACKOFF_MAX": 30
+}
+
+_breakers = {}
+_restart_handlers = {}
+_lock = threading.Lock()
+
+
+# 超时和连接失败视为服务器故障，其余错误（如模型不存在）直接返回给调用方
+def is_recoverable(error):
+    return isinstance(error, (requests.Timeout, requests.ConnectionError))
+
+
+# 第 attempt 次重试前的等待时间（full jitter）
+def backoff(attempt):
+    return random.uniform(0, min(RECOVERY_CONFIG["BACKOFF_MAX"], RECOVERY_CONFIG["BACKOFF_BASE"] * 2 ** attempt))
+
+
+class CircuitBreaker:
+    def __init__(self, url):
+        self.url = url
+        self.state = "closed"
+        self.incidents = 0
+        self.consecutive_failures = 0
+        self.recovered_at = 0
+        self._ready = None
+        self._task = None
+
+    async def wait_until_closed(self):
+        if self.state != "closed":
+            await self._ready.wait()
+
+    def record_success(self):
+        self.consecutive_failures = 0
+
+    # 请求失败后调用：熔断器关闭时打开并发起恢复；已在恢复中时等待恢复完成。
+    # started 早于上次恢复完成的请求属于已经处理过的故障，只退避后重试
+    async def report_failure(self, started):
+        self.consecutive_failures += 1
+        if self.state == "open":
+            await self._ready.wait()
+            return
+        if started < self.recovered_at:
+            await asyncio.sleep(backoff(self.consecutive_failures))
+            return
+        self.state = "open"
+        self.incidents += 1
+        self._ready = asyncio.Event()
+        backend_pool.set_healthy(self.url, False)
+        logging.warning(f"{self.url}: 熔断器打开，暂停发送请求并开始恢复（第 {self.incidents} 次故障）")
+        # 恢复在独立的任务中进行，发起恢复的请求被取消时不会中断恢复
+        self._task = asyncio.ensure_future(self._recover())
+        await self._ready.wait()
+
+    async def _recover(self):
+        ready = False
+        try:
+            restart = _restart_handlers.get(self.url)
+            if restart is not None:
+                await asyncio.to_thread(restart)
+            ready = await self._wait_ready()
+        finally:
+            self.state = "closed"
+            self.recovered_at = time.time()
+            backend_pool.set_healthy(self.url, ready)
+            self._ready.set()
+        if ready:
+            logging.info(f"{self.url}: 服务已就绪，熔断器关闭，恢复发送请求")
+        else:
+            logging.error(f"{self.url}: {RECOVERY_CONFIG['READY_TIMEOUT']} 秒内服务未就绪")
+
+    async def _wait_ready(self):
+        deadline = time.time() + RECOVERY_CONFIG["READY_TIMEOUT"]
+        attempt = 0
+        while time.time() < deadline:
+            try:
+                response = await asyncio.to_thread(ollama_client.get, f"{self.url}/tags", timeout=5)
+                if response.status_code == 200:
+                    return True
+            except requests.RequestException:
+                pass
+            attempt += 1
+            await asyncio.sleep(min(backoff(attempt), max(deadline - time.time(), 0)))
+        return False
+
+
+def get_breaker(url):
+    with _lock:
+        if url not in _breakers:
+            _breakers[url] = CircuitBreaker(url)
+        return _breakers[url]
+
+
+# 为本机服务器注册重启方法（只负责结束并重新启动进程，就绪检测由熔断器完成）
+def set_restart_handler(url, handler):
+    _restart_handlers[url.rstrip("/")] = handler
@@ -0,0 +1,129 @@
+import os
+import json
+import time
+import sqlite3
+import hashlib
+import logging
+import threading
+
+# 推理结果缓存：以 (模型摘要, 参数, 完整提示词, 图片内容哈希) 为键保存 /api/generate 的返回，
+# 重复执行相同请求时直接返回，不再调用模型
+
+RESULT_CACHE_CONFIG = {
+    "ENABLED": True,
+    "DB_FILE": "result_cache.sqlite3",
+    "MAX_BYTES": 512 * 1024 * 1024
+}
+
+# 这些字段不影响生成结果或单独参与计算，不直接放进键里
+_EXCLUDED_FIELDS = ("images", "stream", "keep_alive")
+
+_conn = None
+_lock = threading.Lock()
+_stats = {"hits": 0, "misses": 0}
+_inserts_since_evict = 0
+
+
+def set_enabled(enabled):
+    RESULT_CACHE_CONFIG["ENABLED"] = bool(enabled)
+
+
+def is_enabled():
+    return RESULT_CACHE_CONFIG["ENABLED"]
+
+
+def _get_conn():
+    global _conn
+    if _conn is None:
+        _conn = sqlite3.connect(RESULT_CACHE_CONFIG["DB_FILE"], check_same_thread=False)
+        _conn.execute("PRAGMA journal_mode=WAL")
+        _conn.execute("""
+            CREATE TABLE IF NOT EXISTS results (
+                key TEXT PRIMARY KEY,
+                model TEXT,
+                response TEXT,
+                size INTEGER,
+                created REAL,
+                last_used REAL
+            )
+        """)
+        _conn.execute("CREATE INDEX IF NOT EXISTS idx_results_last_used ON results(last_used)")
+        _conn.commit()
+    return _conn
+
+
+# 计算缓存键
+def make_key(payload, model_digest):
+    hasher = hashlib.sha256()
+    options = {k: v for k, v in payload.items() if k not in _EXCLUDED_FIELDS}
+    hasher.update(json.dumps({"digest": model_digest, **options}, sort_keys=True, ensure_ascii=False).encode("utf-8"))
+    for image in payload.get("images", []):
+        hasher.update(hashlib.sha256(image.encode("ascii")).digest())
+    return hasher.hexdigest()
+
+
+def get(key):
+    with _lock:
+        row = _get_conn().execute("SELECT response FROM results WHERE key = ?", (key,)).fetchone()
+        if row is None:
+            _stats["misses"] += 1
+            return None
+        _stats["hits"] += 1
+        _get_conn().execute("UPDATE results SET last_used = ? WHERE key = ?", (time.time(), key))
+        _get_conn().commit()
+    return json.loads(row[0])
+
+
+def put(key, model, response):
+    global _inserts_since_evict
+    data = json.dumps(response, ensure_ascii=False)
+    now = time.time()
+    with _lock:
+        conn = _get_conn()
+        conn.execute("INSERT OR REPLACE INTO results (key, model, response, size, created, last_used) VALUES (?, ?, ?, ?, ?, ?)",
+                     (key, model, data, len(data), now, now))
+        conn.commit()
+        _inserts_since_evict += 1
+        if _inserts_since_evict >= 100:
+            _inserts_since_evict = 0
+            _evict(conn)
+
+
+# 超过容量上限时，删除最久未使用的结果
+def _evict(conn):
+    total = conn.execute("SELECT COALESCE(SUM(size), 0) FROM results").fetchone()[0]
+    excess = total - RESULT_CACHE_CONFIG["MAX_BYTES"]
+    if excess <= 0:
+        return
+    removed = 0
+    freed = 0
+    for key, size in conn.execute("SELECT key, size FROM results ORDER BY last_used").fetchall():
+        if freed >= excess:
+            break
+        conn.execute("DELETE FROM results WHERE key = ?", (key,))
+        freed += size
+        removed += 1
+    conn.commit()
+    logging.info(f"结果缓存超出上限，已淘汰 {removed} 条记录")
+
+
+def clear():
+    with _lock:
+        conn = _get_conn()
+        conn.execute("DELETE FROM results")
+        conn.commit()
+        conn.execute("VACUUM")
+    return "结果缓存已清空。"
+
+
+def reset_stats():
+    _stats["hits"] = 0
+    _stats["misses"] = 0
+
+
+def format_stats():
+    with _lock:
+        count, total = _get_conn().execute("SELECT COUNT(*), COALESCE(SUM(size), 0) FROM results").fetchone()
+    return (f"结果缓存: 命中 {_stats['hits']}, 未命中 {_stats['misses']}, "
+            f"条目 {count}, 占用 {total / 1048576:.1f}/{RESULT_CACHE_CONFIG['MAX_BYTES'] / 1048576:.0f}MB "
+            f"({os.path.abspath(RESULT_CACHE_CONFIG['DB_FILE'])})")
@@ -0,0 +1,107 @@
+import time
+import logging
+import threading
+import contextlib
+import ollama_client
+
+# 流式生成：逐块读取 /api/generate 的输出，可以看到长描述的生成进度，
+# 输出超过 token 数或时间上限时提前断开（例如模型陷入重复循环），并统计首字延迟和生成速度
+
+STREAM_CONFIG = {
+    "ENABLED": False,
+    "MAX_TOKENS": 0,  # 0 表示不限制
+    "MAX_SECONDS": 0,  # 0 表示不限制
+    "PROGRESS_INTERVAL": 10
+}
+
+_stats_lock = threading.Lock()
+_stats = {}
+
+
+def configure(enabled, max_tokens, max_seconds):
+    STREAM_CONFIG["ENABLED"] = bool(enabled)
+    STREAM_CONFIG["MAX_TOKENS"] = max(int(max_tokens or 0), 0)
+    STREAM_CONFIG["MAX_SECONDS"] = max(float(max_seconds or 0), 0)
+
+
+def is_enabled():
+    return STREAM_CONFIG["ENABLED"]
+
+
+# 流式调用 /api/generate，拼接为与非流式相同格式的返回；因达到上限被截断时 done 为 False
+async def stream_generate(url, payload, timeout=120):
+    model = payload["model"]
+    max_tokens = STREAM_CONFIG["MAX_TOKENS"]
+    max_seconds = STREAM_CONFIG["MAX_SECONDS"]
+    start_time = time.time()
+    last_report = start_time
+    first_token_time = None
+    parts = []
+    final = None
+    capped = None
+
+    async with contextlib.aclosing(ollama_client.async_stream_post(url, json={**payload, "stream": True}, timeout=timeout)) as chunks:
+        async for chunk in chunks:
+            if chunk.get("response"):
+                if first_token_time is None:
+                    first_token_time = time.time()
+                parts.append(chunk["response"])
+            if chunk.get("done"):
+                final = chunk
+                break
+            now = time.time()
+            if max_tokens and len(parts) >= max_tokens:
+                capped = f"超过 {max_tokens} tokens"
+                break
+            if max_seconds and now - start_time >= max_seconds:
+                capped = f"超过 {max_seconds:g} 秒"
+                break
+            if now - last_report >= STREAM_CONFIG["PROGRESS_INTERVAL"]:
+                last_report = now
+                logging.info(f"{model}: 正在生成，已输出 {len(parts)} tokens，用时 {now - start_time:.0f}秒")
+
+    end_time = time.time()
+    if capped:
+        logging.warning(f"{model}: 输出{capped}，已提前停止生成")
+    response = dict(final) if final else {"model": model, "done": False, "done_reason": "cap"}
+    response["response"] = "".join(parts)
+    _record(model, start_time, first_token_time, end_time, len(parts), final, capped)
+    return response
+
+
+def _record(model, start_time, first_token_time, end_time, token_count, final, capped):
+    # 优先使用 Ollama 报告的生成 token 数和耗时，被截断时按客户端计时估算
+    if final and final.get("eval_duration"):
+        tokens = final.get("eval_count", token_count)
+        generation_seconds = final["eval_duration"] / 1e9
+    else:
+        tokens = token_count
+        generation_seconds = end_time - first_token_time if first_token_time else 0
+    with _stats_lock:
+        stats = _stats.setdefault(model, {"requests": 0, "ttft_total": 0.0, "ttft_count": 0, "tokens": 0, "generation_seconds": 0.0, "capped": 0})
+        stats["requests"] += 1
+        if first_token_time:
+            stats["ttft_total"] += first_token_time - start_time
+            stats["ttft_count"] += 1
+        stats["tokens"] += tokens
+        stats["generation_seconds"] += generation_seconds
+        if capped:
+            stats["capped"] += 1
+
+
+def reset_stats():
+    with _stats_lock:
+        _stats.clear()
+
+
+def format_stats():
+    with _stats_lock:
+        stats = {model: dict(model_stats) for model, model_stats in _stats.items()}
+    if not stats:
+        return "流式生成统计: 无"
+    lines = []
+    for model, model_stats in stats.items():
+        ttft = model_stats["ttft_total"] / model_stats["ttft_count"] if model_stats["ttft_count"] else 0
+        speed = model_stats["tokens"] / model_stats["generation_seconds"] if model_stats["generation_seconds"] else 0
+        lines.append(f"{model}: 请求 {model_stats['requests']}, 平均首字延迟 {ttft:.2f}秒, 生成速度 {speed:.1f} tokens/秒, 截断 {model_stats['capped']}")
+    return "流式生成统计: " + "; ".join(lines)
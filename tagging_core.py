@@ -0,0 +1,792 @@
+import os
+import time
+import requests
+import base64
+import csv
+import contextlib
+from datetime import datetime
+import logging
+import asyncio
+import psutil
+import subprocess
+import ollama_client
+import inference_engine
+import image_preprocess
+import image_worker
+import image_cache
+import result_cache
+import job_journal
+import model_scheduler
+import backend_pool
+import model_catalog
+import concurrency_controller
+import streaming
+import recovery
+import cancellation
+import dataset_scanner
+import dataset_index
+import caption_writer
+import metrics
+import model_residency
+import job_output
+import job_scheduler
+
+# 打标核心：推理请求和各批量模式的处理流程，不依赖 Gradio，
+# 网页界面（ollama_interface.py）和命令行（cli.py）都从这里调用
+
+# 配置文件路径和API URL
+CONFIG = {
+    "OLLAMA_API_URL": "http://localhost:11434/api",
+    "OLLAMA_BACKENDS": [],  # 其他 Ollama 服务器，格式为 ("http://host:11434/api", 权重)
+    "PROMPT_TEMPLATES_FILE": "prompt_templates.csv",
+    "HISTORY_PROMPTS_FILE": "history_prompts.csv",
+    "OLLAMA_EXECUTABLE": "C:/Users/Eason/AppData/Local/Programs/Ollama/ollama app.exe",  # 修改为 Ollama 可执行文件的路径
+    "LOG_FILE": "app.log"
+}
+
+# Ollama 服务器池，默认只有本机一个服务器
+backend_pool.configure([(CONFIG["OLLAMA_API_URL"], 1)] + CONFIG["OLLAMA_BACKENDS"])
+
+# 立即刷新并返回所有服务器上的模型列表
+def get_models():
+    return sorted(model_catalog.refresh())
+
+# 获取Prompt模板列表
+def get_prompt_templates():
+    templates = []
+    try:
+        with open(CONFIG["PROMPT_TEMPLATES_FILE"], "r") as file:
+            reader = csv.reader(file)
+            for row in reader:
+                if len(row) >= 2:
+                    templates.append({"title": row[0], "prompt": row[1]})
+    except FileNotFoundError:
+        logging.warning(f"{CONFIG['PROMPT_TEMPLATES_FILE']} 文件未找到")
+    return templates
+
+# 保存历史记录prompt
+def save_prompt(prompt1, prompt2, model, source):
+    file_exists = os.path.isfile(CONFIG["HISTORY_PROMPTS_FILE"])
+    with open(CONFIG["HISTORY_PROMPTS_FILE"], "a", newline='') as file:
+        writer = csv.writer(file)
+        if not file_exists:
+            writer.writerow(["日期", "模型", "来源", "Prompt 1", "Prompt 2"])
+        now = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+        writer.writerow([now, model, source, prompt1, prompt2])
+
+# 重启 Ollama 软件（由故障恢复流程调用，重启后的就绪检测见 recovery.py）
+def restart_ollama():
+    try:
+        logging.info("重启 Ollama 软件...")
+        
+        # 停止 Ollama 软件
+        for proc in psutil.process_iter():
+            if proc.name() in ["ollama app.exe", "ollama.exe", "ollama_llama_server.exe"]:  # 修改为 Ollama 可执行文件的名称
+                proc.kill()
+        
+        # 启动 Ollama 软件
+        subprocess.Popen([CONFIG["OLLAMA_EXECUTABLE"]])
+    except Exception as e:
+        logging.error(f"重启 Ollama 软件失败: {e}")
+
+recovery.set_restart_handler(CONFIG["OLLAMA_API_URL"], restart_ollama)
+
+# 读取图片并进行 base64 编码
+def encode_image(image_path):
+    with open(image_path, "rb") as img_file:
+        return base64.b64encode(img_file.read()).decode('utf-8')
+
+# 向指定服务器发送一次 /api/generate 请求，受该服务器和模型的自适应并发上限约束；
+# stage 为指标中的阶段名称（tag 打标 / refine 精炼）
+async def post_generate(backend, payload, timeout=120, stage="tag"):
+    limiter = concurrency_controller.get_limiter(backend.url, payload["model"])
+    error = None
+    response = None
+    # 模型正被批量任务常驻时带上 keep_alive，任务期间不会因为空闲被卸载
+    keep_alive = model_residency.get_keep_alive(backend.url, payload["model"])
+    if keep_alive is not None:
+        payload = dict(payload, keep_alive=keep_alive)
+    # 自适应并发上限和服务器的请求名额都按优先级分配，优先级高的请求（例如单图处理）先拿到空出的位置
+    priority = job_scheduler.get_priority()
+    started, queue_seconds = await limiter.acquire(priority)
+    # 所有任务共用服务器的请求名额
+    slots = job_scheduler.get_backend_slots(backend.url)
+    try:
+        await slots.acquire(priority)
+    except BaseException:
+        # 等待名额时被取消，请求没有发出
+        await limiter.release(started, cancelled=True)
+        raise
+    # 等待名额的时间算作排队，不计入自适应并发看到的请求延迟
+    queue_seconds += time.time() - started
+    started = time.time()
+    cancelled = False
+    try:
+        if streaming.is_enabled():
+            response = await streaming.stream_generate(f"{backend.url}/generate", payload, timeout=timeout)
+        else:
+            response = await ollama_client.async_post(f"{backend.url}/generate", json=payload, timeout=timeout)
+    except requests.RequestException as e:
+        error = e
+        metrics.record_error(payload["model"], stage)
+        raise
+    except asyncio.CancelledError:
+        cancelled = True
+        raise
+    finally:
+        slots.release()
+        await limiter.release(started, error, response, cancelled)
+    metrics.record_response(payload["model"], stage, queue_seconds, time.time() - started, response)
+    return response
+
+# 调用 /api/generate，命中结果缓存时直接返回保存的结果，否则发往负载最低的服务器；
+# 服务器超时或连接失败时交给熔断器恢复，恢复完成后重试
+async def generate(payload, timeout=120, stage="tag"):
+    cache_key = None
+    if result_cache.is_enabled():
+        # 模型摘要是结果缓存键的一部分，模型更新后旧结果自动失效
+        digest = await asyncio.to_thread(model_catalog.get_digest, payload["model"])
+        cache_key = result_cache.make_key(payload, digest)
+        cached = await asyncio.to_thread(result_cache.get, cache_key)
+        if cached is not None:
+            metrics.record_cache_hit(payload["model"], stage)
+            return cached
+    max_attempts = recovery.RECOVERY_CONFIG["MAX_ATTEMPTS"]
+    for attempt in range(1, max_attempts + 1):
+        backend = backend_pool.acquire(payload["model"])
+        breaker = recovery.get_breaker(backend.url)
+        started = time.time()
+        error = None
+        cancelled = False
+        try:
+            await breaker.wait_until_closed()
+            started = time.time()
+            response = await post_generate(backend, payload, timeout, stage)
+        except requests.RequestException as e:
+            error = e
+        except asyncio.CancelledError:
+            cancelled = True
+            raise
+        finally:
+            backend_pool.release(backend, error, cancelled)
+        if error is None:
+            breaker.record_success()
+            break
+        if not recovery.is_recoverable(error) or attempt == max_attempts:
+            raise error
+        logging.warning(f"{backend.url} 请求失败（第 {attempt}/{max_attempts} 次）: {error}")
+        metrics.record_retry(payload["model"], stage)
+        await breaker.report_failure(started)
+    model_scheduler.record_response(payload["model"], response)
+    if cache_key is not None and response.get("done", True):
+        await asyncio.to_thread(result_cache.put, cache_key, payload["model"], response)
+    return response
+
+# 读取图片并编码，启用预处理时在进程池中缩放并重新编码
+async def encode_image_async(image_path):
+    if image_preprocess.is_enabled():
+        config = image_preprocess.PREPROCESS_CONFIG
+        try:
+            img_base64, original_bytes, encoded_bytes = await asyncio.get_running_loop().run_in_executor(
+                image_preprocess.get_pool(), image_worker.preprocess_image,
+                image_path, config["MAX_SIDE"], config["FORMAT"], config["QUALITY"])
+            image_preprocess.record(original_bytes, encoded_bytes)
+            return img_base64
+        except Exception as e:
+            logging.warning(f"图片预处理失败，改为上传原图: {image_path}: {e}")
+    return await asyncio.to_thread(encode_image, image_path)
+
+# 获取图片的编码结果；传入任务的图片缓存时，同一张图片被多个模型使用时只编码一次
+async def load_image(image_path, images=None):
+    if images is None:
+        return await encode_image_async(image_path)
+    stat = await asyncio.to_thread(os.stat, image_path)
+    preprocess_key = tuple(image_preprocess.PREPROCESS_CONFIG.values()) if image_preprocess.is_enabled() else None
+    cache_key = (os.path.abspath(image_path), stat.st_mtime_ns, stat.st_size, preprocess_key)
+    return await images.get_or_load(cache_key, lambda: encode_image_async(image_path))
+
+# 处理单张图片
+async def process_single_image(model, prompt, image, hardware, images=None):
+    if not model:
+        return "请选择一个模型。"
+
+    image_path = image
+
+    try:
+        img_base64 = await load_image(image_path, images)
+
+        payload = {
+            "model": model,
+            "prompt": prompt,
+            "images": [img_base64],
+            "stream": False,
+            "hardware": hardware  # 添加硬件参数
+        }
+
+        start_time = time.time()
+        response = await generate(payload)
+        elapsed_time = time.time() - start_time
+        result = response.get("response", "")
+        return result, elapsed_time
+    except requests.RequestException as e:
+        logging.error(f"Error processing image: {e}")
+        return "处理失败，请检查API连接。", 0
+
+# 处理单张图片并保存结果，返回 (结果信息, 耗时, 保存后的txt内容)
+async def process_single_image_with_save(model, prompt, image, action, hardware):
+    if not model:
+        return "请选择一个模型。", 0, None
+
+    image_name = os.path.basename(image)
+    txt_path = get_txt_path(image)
+
+    result, elapsed_time = await process_single_image(model, prompt, image, hardware)
+
+    if "处理失败，请检查API连接。" in result:
+        return result, elapsed_time, None
+
+    if action == "忽略" and os.path.exists(txt_path):
+        return f"{image_name}: 文件已存在，选择忽略。", elapsed_time, None
+
+    content = await caption_writer.write_async(txt_path, result, action)
+    return f"打标结果: {result}", elapsed_time, content
+
+# 把结果按处理方式写入图片的同名txt，返回 (结果信息, 耗时, 保存后的txt内容)，忽略时内容为 None
+async def save_caption(file, text, action, elapsed_time):
+    txt_path = get_txt_path(file)
+    existed = os.path.exists(txt_path)
+    if existed and action == "忽略":
+        return f"{file}: 文件已存在，选择忽略。", elapsed_time, None
+    content = await caption_writer.write_async(txt_path, text, action)
+    if existed and action in ("覆盖", "加入前面", "加入后面"):
+        return f"{file}: 处理完成，结果已{action}到 {txt_path}", elapsed_time, content
+    return f"{file}: 处理完成，结果已保存到 {txt_path}", elapsed_time, content
+
+# 图片对应的同名txt文件路径
+def get_txt_path(image_path):
+    return os.path.join(os.path.dirname(image_path), f"{os.path.splitext(os.path.basename(image_path))[0]}.txt")
+
+# 在线程中读取txt文件，不阻塞推理引擎的事件循环
+async def read_text_async(path):
+    def read():
+        with open(path, "r") as file:
+            return file.read()
+    return await asyncio.to_thread(read)
+
+# 计算剩余时间
+def format_remaining_time(seconds):
+    hours, remainder = divmod(seconds, 3600)
+    minutes, seconds = divmod(remainder, 60)
+    return f"{int(hours)}小时 {int(minutes)}分钟 {int(seconds)}秒"
+
+# 每处理完一项调用一次进度回调（命令行用它逐行输出 JSON），没有回调时什么也不做
+def report_progress(progress, item, result, elapsed_time, processed_files, total_files, remaining_time):
+    if progress is not None:
+        progress({"item": item, "result": result, "elapsed": round(elapsed_time, 3), "processed": processed_files, "total": total_files, "remaining": round(remaining_time, 1)})
+
+# 批量处理函数的返回值：界面照常作为文字显示，命令行按 status 区分参数错误、完成和停止
+JOB_INVALID = "参数错误"
+JOB_DONE = "完成"
+JOB_STOPPED = "已停止"
+
+class JobResult(str):
+    def __new__(cls, text, status):
+        result = super().__new__(cls, text)
+        result.status = status
+        return result
+
+# 任务结束时把统计摘要交给进度回调
+def report_summary(progress, summary):
+    if progress is not None:
+        progress({"summary": summary})
+
+# 一次批量任务的运行状态和收尾工作
+class BatchJob:
+    def __init__(self, journal, job_progress, token, log, images):
+        self.journal = journal
+        self.job_progress = job_progress
+        self.token = token
+        self.log = log
+        # 同一张图片会被多个模型使用时才有图片缓存
+        self.images = images
+        self.residency = None
+        self.failed = False
+        self.output = ""
+        self._cleanups = []
+
+    # 被停止或出错的任务都不写结束标记，之后仍可恢复
+    @property
+    def stopped(self):
+        return self.token.cancelled or self.failed
+
+    # 注册任务结束时先执行的清理（按注册的相反顺序）
+    def add_cleanup(self, function):
+        self._cleanups.append(function)
+
+    # 无论任务正常结束、被停止还是出错都会执行：写完待写入的标签、释放常驻模型、结束任务记录和取消令牌，
+    # 输出统计并关闭任务日志；前面的步骤出错时记录日志后继续，保证后面的资源都被释放
+    def close(self, progress):
+        steps = list(reversed(self._cleanups)) + [caption_writer.flush, dataset_index.flush_all]
+        if self.residency is not None:
+            steps.append(lambda: model_residency.release(self.residency))
+        for step in steps:
+            try:
+                step()
+            except Exception:
+                logging.exception("任务收尾出错")
+        self.journal.finish(stopped=self.stopped)
+        report_summary(progress, self.job_progress.finish(self.stopped, os.path.splitext(self.journal.path)[0] + ".metrics.json"))
+        cancellation.finish(self.token)
+        if self.token.cancelled:
+            self.log.add(f"任务已停止：已处理 {self.job_progress.processed} 项，剩余 {self.job_progress.remaining()} 项未处理，可在「任务恢复」中继续。")
+        elif self.failed:
+            self.log.add(f"任务出错中止：已处理 {self.job_progress.processed} 项，已完成的文件已保存，可在「任务恢复」中继续。")
+        logging.info(ollama_client.format_connection_stats())
+        if image_preprocess.is_enabled():
+            logging.info(image_preprocess.format_stats())
+        if self.images is not None:
+            logging.info(self.images.format_stats())
+            self.images.clear()
+        logging.info(caption_writer.format_stats())
+        if result_cache.is_enabled():
+            logging.info(result_cache.format_stats())
+        if streaming.is_enabled():
+            logging.info(streaming.format_stats())
+        self.output = JobResult(self.log.finish(), JOB_STOPPED if self.token.cancelled else JOB_DONE)
+
+# 批量任务的准备和收尾：设置并发、开始任务记录和日志、预加载模型；
+# 退出时（包括出错）执行 BatchJob.close，处理函数返回 job.output
+@contextlib.contextmanager
+def batch_job(mode, params, resume_job_id, scope, progress, concurrency, models, reuse_images=False):
+    ollama_client.configure_pool(concurrency)
+    concurrency_controller.set_ceiling(concurrency)
+    image_preprocess.reset_stats()
+    result_cache.reset_stats()
+    streaming.reset_stats()
+    journal = job_journal.start_job(mode, params, resume_job_id)
+    # 每个文件的结果写入任务日志，内存中只保留最近的若干行
+    job = BatchJob(journal, metrics.JobProgress(mode, journal.job_id), cancellation.start(scope), job_output.open_log(journal),
+                   image_cache.create_cache() if reuse_images else None)
+    try:
+        job.residency = model_residency.acquire(models)
+        yield job
+    except BaseException:
+        job.failed = True
+        raise
+    finally:
+        job.close(progress)
+
+# 处理文件夹中的图片
+def process_folder_images(model, prompt, folder_path, action, hardware, concurrency, refine_model=None, prompt2=None, use_image=False, resume_job_id=None, scope="多图处理", progress=None):
+    params = {key: value for key, value in locals().items() if key not in ("resume_job_id", "scope", "progress")}
+
+    if not model or not prompt or not folder_path:
+        return JobResult("请选择一个模型并输入Prompt和文件夹路径。", JOB_INVALID)
+    save_prompt(prompt, prompt2 or "", model, "多图处理")
+
+    if not os.path.isdir(folder_path):
+        return JobResult("无效的文件夹路径。", JOB_INVALID)
+
+    with batch_job("多图处理", params, resume_job_id, scope, progress, concurrency, [model] + ([refine_model] if refine_model and prompt2 else [])) as job:
+        journal, job_progress, token, job_log = job.journal, job.job_progress, job.token, job.log
+
+        refine_enabled = bool(refine_model and prompt2)
+        total_files = 0
+        processed_files = 0
+        skipped_refines = 0
+        refine_pending = set()  # 总数中计入了精炼步骤的图片
+        refine_queued = set()  # 已交给精炼阶段的图片
+
+        # 边扫描边产出需要处理的图片，总数随扫描进度增加
+        def iter_pending_files():
+            nonlocal total_files
+            for file, txt_path in dataset_scanner.iter_images(folder_path):
+                if action == "忽略" and txt_path and not journal.is_done(file, "tag"):
+                    continue  # 只处理没有同名txt文件的图片，恢复任务时包含本任务已打标的图片
+                needs_tag = not journal.is_done(file, "tag")
+                needs_refine = refine_enabled and not journal.is_done(get_txt_path(file), "refine")
+                if needs_tag or needs_refine:
+                    if needs_refine:
+                        refine_pending.add(file)
+                    total_files += 1 + needs_refine
+                    yield file
+
+        # 第一阶段：打标并保存，保存后的内容直接交给精炼阶段，不再从磁盘重新读取
+        async def process_file(file):
+            started = time.time()
+            if journal.is_done(file, "tag"):
+                # 恢复任务时打标已完成，只需读取已保存的结果进入精炼阶段
+                refine_queued.add(file)
+                return (f"{file}: 已打标，继续精炼", 0), await read_text_async(get_txt_path(file))
+            result, elapsed_time, content = await process_single_image_with_save(model, prompt, file, action, hardware)
+            if content is not None:
+                journal.mark_done(file, "tag")
+                await dataset_index.record_caption_async(folder_path, get_txt_path(file), model, prompt, content)
+            if refine_enabled and content is not None:
+                refine_queued.add(file)
+                return (result, time.time() - started), content
+            return (result, time.time() - started), None
+
+        # 第二阶段：精炼模型处理打标结果并覆盖txt
+        async def refine_file(file, txt_content):
+            started = time.time()
+            txt_file = get_txt_path(file)
+
+            combined_prompt = prompt2.format(txt_content) if "{}" in prompt2 else f"{prompt2}\n{txt_content}"
+
+            payload = {
+                "model": refine_model,
+                "prompt": combined_prompt,
+                "stream": False,
+                "hardware": hardware
+            }
+
+            try:
+                response = await generate(payload, stage="refine")
+                result = response.get("response", "")
+
+                content = await caption_writer.write_async(txt_file, result)
+                journal.mark_done(txt_file, "refine")
+                await dataset_index.record_caption_async(folder_path, txt_file, refine_model, prompt2, content)
+                return f"{txt_file}: 处理完成", time.time() - started
+
+            except requests.RequestException as e:
+                logging.error(f"Error processing txt: {e}")
+                return f"{txt_file}: 处理失败，请检查API连接。", 0
+
+        for stage, file, future in inference_engine.run_pipeline(process_file, refine_file, iter_pending_files(), concurrency, token):
+            try:
+                result, elapsed_time = future.result()
+            except Exception as e:
+                result = f"{file if stage == 0 else get_txt_path(file)}: 处理失败，错误: {e}"
+                elapsed_time = 0
+            job_log.add(result)
+            if stage == 0 and file in refine_pending and file not in refine_queued:
+                # 打标失败时不会再精炼，从总数中扣除这一步，进度才能走到100%
+                skipped_refines += 1
+
+            processed_files += 1
+            total_steps = total_files - skipped_refines
+            remaining_time = job_progress.record(result, total_steps)
+            logging.info(f"当前任务耗时: {elapsed_time:.2f}秒, 进度 {processed_files}/{total_steps} files. 预计剩余时间: {format_remaining_time(remaining_time)}. 并发上限: {concurrency_controller.format_limits()}")
+            report_progress(progress, file if stage == 0 else get_txt_path(file), result, elapsed_time, processed_files, total_steps, remaining_time)
+    return job.output
+
+# 单图处理PLUS：打标后可选由精炼模型再处理一次，返回 (打标结果, 精炼结果)
+def run_single_image_plus(model, prompt1, prompt2, image, enable_refine, refine_model, use_image, hardware, token):
+    images = image_cache.create_cache() if enable_refine and use_image else None
+    result1, _ = inference_engine.run_sync(process_single_image(model, prompt1, image, hardware, images), token)
+
+    if enable_refine:
+        combined_prompt = prompt2.format(result1)
+        if use_image:
+            img_base64 = inference_engine.run_sync(load_image(image, images), token)
+            payload = {
+                "model": refine_model,
+                "prompt": combined_prompt,
+                "images": [img_base64],
+                "stream": False,
+                "hardware": hardware
+            }
+        else:
+            payload = {
+                "model": refine_model,
+                "prompt": combined_prompt,
+                "stream": False,
+                "hardware": hardware
+            }
+
+        try:
+            response = inference_engine.run_sync(generate(payload, stage="refine"), token)
+            result2 = response.get("response", "")
+            return result1, result2
+        except requests.RequestException as e:
+            logging.error(f"Error processing image: {e}")
+            return result1, "处理失败，请检查API连接。"
+    else:
+        return result1, ""
+
+# AI-Multi-Tag：多个模型分别打标，合并后交给精炼模型
+def process_folder_multiple(model, prompt1, folder_path, action, multi_tag_model_1, enable_multi_tag_model_1, multi_tag_model_2, enable_multi_tag_model_2, multi_tag_model_3, enable_multi_tag_model_3, refine_model, enable_refine, use_image, hardware, prompt2, concurrency, window_size=200, resume_job_id=None, scope="AI-Multi-Tag", progress=None):
+    params = {key: value for key, value in locals().items() if key not in ("resume_job_id", "scope", "progress")}
+
+    multi_tag_models = [(multi_tag_model_1, enable_multi_tag_model_1), (multi_tag_model_2, enable_multi_tag_model_2), (multi_tag_model_3, enable_multi_tag_model_3)]
+    if not model or not prompt1 or not folder_path or not any(enable for _, enable in multi_tag_models):
+        return JobResult("请选择一个模型并输入Prompt和文件夹路径。", JOB_INVALID)
+    save_prompt(prompt1, prompt2, model, "AI-Multiple")
+
+    if not os.path.isdir(folder_path):
+        return JobResult("无效的文件夹路径。", JOB_INVALID)
+
+    stage_models = [model] + [multi_tag_model for multi_tag_model, enable in multi_tag_models if enable]
+    # 显存放不下所有模型时按阶段切换常驻的模型；多个模型为同一张图片打标，或精炼时再次识别图片，才需要缓存编码结果
+    with batch_job("AI-Multiple", params, resume_job_id, scope, progress, concurrency, stage_models + ([refine_model] if enable_refine else []), reuse_images=len(stage_models) > 1 or (enable_refine and use_image)) as job:
+        journal, job_progress, token, job_log = job.journal, job.job_progress, job.token, job.log
+        residency, images = job.residency, job.images
+
+        # 只处理没有同名txt文件的图片，边扫描边按窗口分批
+        work_files = (file for file, txt_path in dataset_scanner.iter_images(folder_path) if not txt_path and not journal.is_done(file, "multi"))
+        caption_store = model_scheduler.CaptionStore(os.path.splitext(journal.path)[0] + ".captions.sqlite3")
+        # 被停止或出错时保留中间结果，恢复任务时不必重新打标
+        job.add_cleanup(lambda: caption_store.close(remove=not job.stopped))
+        work_file_count = 0
+        total_files = 0
+        processed_files = 0
+        model_scheduler.reset_observed_loads()
+
+        # 第一阶段：由一个模型为窗口内的所有图片打标，结果暂存到磁盘
+        def make_tag_file(stage, stage_model):
+            async def tag_file(file):
+                result, elapsed_time = await process_single_image(stage_model, prompt1, file, hardware, images)
+                if "处理失败，请检查API连接。" in result:
+                    return f"{file}: {stage_model} 处理失败，请检查API连接。", 0
+                # 中间结果存放在 SQLite 中，在线程中写入，不阻塞推理引擎的事件循环
+                await asyncio.to_thread(caption_store.put, file, stage, result)
+                return f"{file}: {stage_model} 打标完成", elapsed_time
+            return tag_file
+
+        # 第二阶段：合并所有模型的结果，交给精炼模型后写入txt
+        async def finish_file(file):
+            started = time.time()
+            combined_results = await asyncio.to_thread(caption_store.get_all, file, len(stage_models))
+            if combined_results is None:
+                return f"{file}: 部分模型打标失败，跳过。", 0
+
+            # 将所有结果合并到 Prompt 2
+            combined_prompt = prompt2.format("\n————————————————\n".join(combined_results))
+
+            if enable_refine:
+                if use_image:
+                    img_base64 = await load_image(file, images)
+                    payload = {
+                        "model": refine_model,
+                        "prompt": combined_prompt,
+                        "images": [img_base64],
+                        "stream": False,
+                        "hardware": hardware  # 添加硬件参数
+                    }
+                else:
+                    payload = {
+                        "model": refine_model,
+                        "prompt": combined_prompt,
+                        "stream": False,
+                        "hardware": hardware  # 添加硬件参数
+                    }
+
+                try:
+                    response = await generate(payload, stage="refine")
+                    caption = response.get("response", "")
+
+                except requests.RequestException as e:
+                    logging.error(f"Error processing image: {e}")
+                    return f"{file}: 处理失败，请检查API连接。", 0
+
+            else:
+                caption = "\n————————————————\n".join(combined_results)
+
+            result, elapsed_time, content = await save_caption(file, caption, action, time.time() - started)
+            # 写入后立即记录完成，停止或崩溃后恢复时不会重复写入
+            if content is not None:
+                journal.mark_done(file, "multi")
+                await dataset_index.record_caption_async(folder_path, get_txt_path(file), refine_model if enable_refine else "+".join(stage_models), prompt2 if enable_refine else prompt1, content)
+            return result, elapsed_time
+
+        def report(file, future):
+            nonlocal processed_files
+            try:
+                result, elapsed_time = future.result()
+            except Exception as e:
+                result = f"{file}: 处理失败，错误: {e}"
+                elapsed_time = 0
+
+            processed_files += 1
+            remaining_time = job_progress.record(result, total_files)
+            logging.info(f"当前任务耗时: {elapsed_time:.2f}秒, 进度 {processed_files}/{total_files} files. 预计剩余时间: {format_remaining_time(remaining_time)}. 并发上限: {concurrency_controller.format_limits()}")
+            report_progress(progress, file, result, elapsed_time, processed_files, total_files, remaining_time)
+            return result
+
+        # 每个窗口内按模型依次处理，同一模型的请求连续发出，避免反复切换模型
+        for window in model_scheduler.windows(work_files, window_size):
+            work_file_count += len(window)
+            total_files += len(window) * (len(stage_models) + 1)
+            for stage, stage_model in enumerate(stage_models):
+                stage_files = [file for file in window if not caption_store.has(file, stage)]
+                if stage_files and not token.cancelled:
+                    residency.activate(stage_model)
+                for file, future in inference_engine.run_batch(make_tag_file(stage, stage_model), stage_files, concurrency, token):
+                    result = report(file, future)
+                    if "打标完成" not in result:
+                        job_log.add(result)
+
+            if enable_refine and not token.cancelled:
+                residency.activate(refine_model)
+            for file, future in inference_engine.run_batch(finish_file, window, concurrency, token):
+                result = report(file, future)
+                if "处理完成" in result:
+                    caption_store.discard(file)
+                job_log.add(result)
+
+            if token.cancelled:
+                break
+
+        per_image_loads, grouped_loads = model_scheduler.estimate_loads(work_file_count, stage_models + ([refine_model] if enable_refine else []), window_size)
+        logging.info(f"模型加载次数估算（显存只能容纳一个模型时）: 逐图处理 {per_image_loads} 次, 按模型分组 {grouped_loads} 次")
+        logging.info(model_scheduler.format_observed_loads())
+    return job.output
+
+# 精炼标签：用精炼模型重写已有的 txt
+def process_refine(folder_path, refine_model, prompt2, hardware, concurrency, resume_job_id=None, scope="精炼标签", progress=None):
+    params = {key: value for key, value in locals().items() if key not in ("resume_job_id", "scope", "progress")}
+
+    if not refine_model or not prompt2 or not folder_path:
+        return JobResult("请选择一个精炼模型并输入Prompt和文件夹路径。", JOB_INVALID)
+
+    if not os.path.isdir(folder_path):
+        return JobResult("无效的文件夹路径。", JOB_INVALID)
+
+    with batch_job("精炼标签", params, resume_job_id, scope, progress, concurrency, [refine_model]) as job:
+        journal, job_progress, token, job_log = job.journal, job.job_progress, job.token, job.log
+
+        total_files = 0
+
+        def iter_pending_files():
+            nonlocal total_files
+            for txt_path in dataset_scanner.iter_txt_files(folder_path):
+                if not journal.is_done(txt_path, "refine"):
+                    total_files += 1
+                    yield txt_path
+        processed_files = 0
+
+        async def process_file(txt_file):
+            started = time.time()
+
+            txt_content = await read_text_async(txt_file)
+
+            combined_prompt = prompt2.format(txt_content) if "{}" in prompt2 else f"{prompt2}\n{txt_content}"
+
+            payload = {
+                "model": refine_model,
+                "prompt": combined_prompt,
+                "stream": False,
+                "hardware": hardware  # 使用指定的硬件参数
+            }
+
+            try:
+                response = await generate(payload, stage="refine")
+                result = response.get("response", "")
+
+                content = await caption_writer.write_async(txt_file, result)
+                journal.mark_done(txt_file, "refine")
+                await dataset_index.record_caption_async(folder_path, txt_file, refine_model, prompt2, content)
+                return f"{txt_file}: 处理完成", time.time() - started
+
+            except requests.RequestException as e:
+                logging.error(f"Error processing txt: {e}")
+                return f"{txt_file}: 处理失败，请检查API连接。", 0
+
+        for txt_file, future in inference_engine.run_batch(process_file, iter_pending_files(), concurrency, token):
+            try:
+                result, elapsed_time = future.result()
+            except Exception as e:
+                result = f"{txt_file}: 处理失败，错误: {e}"
+                elapsed_time = 0
+            job_log.add(result)
+
+            processed_files += 1
+            remaining_time = job_progress.record(result, total_files)
+            logging.info(f"当前任务耗时: {elapsed_time:.2f}秒, 进度 {processed_files}/{total_files} files. 预计剩余时间: {format_remaining_time(remaining_time)}. 并发上限: {concurrency_controller.format_limits()}")
+            report_progress(progress, txt_file, result, elapsed_time, processed_files, total_files, remaining_time)
+    return job.output
+
+# 多模态标签润色：对已有 txt 的图片，结合图片和原标签重新生成
+def process_multimodal_refine(model, prompt1, folder_path, action, refine_model, enable_refine, use_image, hardware, prompt2, concurrency, resume_job_id=None, scope="多模态标签润色", progress=None):
+    params = {key: value for key, value in locals().items() if key not in ("resume_job_id", "scope", "progress")}
+
+    if not model or not prompt1 or not folder_path:
+        return JobResult("请选择一个模型并输入Prompt和文件夹路径。", JOB_INVALID)
+    save_prompt(prompt1, prompt2, model, "多模态标签润色")
+
+    if not os.path.isdir(folder_path):
+        return JobResult("无效的文件夹路径。", JOB_INVALID)
+
+    # 精炼时再次识别图片才需要缓存编码结果
+    with batch_job("多模态标签润色", params, resume_job_id, scope, progress, concurrency, [model] + ([refine_model] if enable_refine else []), reuse_images=enable_refine and use_image) as job:
+        journal, job_progress, token, job_log = job.journal, job.job_progress, job.token, job.log
+        images = job.images
+
+        total_files = 0  # 只计算需要润色的文件数量，随扫描进度增加
+        processed_files = 0
+
+        # 只处理有同名txt文件的图片
+        def iter_pending_files():
+            nonlocal total_files
+            for file, txt_path in dataset_scanner.iter_images(folder_path):
+                if txt_path and not journal.is_done(file, "multimodal"):
+                    total_files += 1
+                    yield file
+
+        async def process_file(file):
+            started = time.time()
+            txt_content = await read_text_async(get_txt_path(file))
+
+            combined_prompt = prompt1.format(txt_content) if "{}" in prompt1 else f"{prompt1}\n{txt_content}"
+
+            result1, _ = await process_single_image(model, combined_prompt, file, hardware, images)
+
+            if enable_refine:
+                if use_image:
+                    img_base64 = await load_image(file, images)
+                    payload = {
+                        "model": refine_model,
+                        "prompt": f"{prompt2}\n{result1}",
+                        "images": [img_base64],
+                        "stream": False,
+                        "hardware": hardware  # 添加硬件参数
+                    }
+                else:
+                    payload = {
+                        "model": refine_model,
+                        "prompt": f"{prompt2}\n{result1}",
+                        "stream": False,
+                        "hardware": hardware  # 添加硬件参数
+                    }
+
+                try:
+                    response = await generate(payload, stage="refine")
+                    caption = response.get("response", "")
+
+                except requests.RequestException as e:
+                    logging.error(f"Error processing image: {e}")
+                    return f"{file}: 处理失败，请检查API连接。", time.time() - started
+
+            else:
+                caption = result1
+
+            result, elapsed_time, content = await save_caption(file, caption, action, time.time() - started)
+            # 写入后立即记录完成，停止或崩溃后恢复时不会再次加入前面/后面
+            if content is not None:
+                journal.mark_done(file, "multimodal")
+                await dataset_index.record_caption_async(folder_path, get_txt_path(file), refine_model if enable_refine else model, prompt2 if enable_refine else prompt1, content)
+            return result, elapsed_time
+
+        for file, future in inference_engine.run_batch(process_file, iter_pending_files(), concurrency, token):
+            try:
+                result, elapsed_time = future.result()
+            except Exception as e:
+                result = f"{file}: 处理失败，错误: {e}"
+                elapsed_time = 0
+            job_log.add(result)
+
+            processed_files += 1
+            remaining_time = job_progress.record(result, total_files)
+            logging.info(f"当前任务耗时: {elapsed_time:.2f}秒, 进度 {processed_files}/{total_files} files. 预计剩余时间: {format_remaining_time(remaining_time)}. 并发上限: {concurrency_controller.format_limits()}")
+            report_progress(progress, file, result, elapsed_time, processed_files, total_files, remaining_time)
+    return job.output
+
+# 各批量模式在任务记录中的名称和对应的处理函数，用于恢复任务
+JOB_FUNCTIONS = {
+    "多图处理": process_folder_images,
+    "AI-Multiple": process_folder_multiple,
+    "精炼标签": process_refine,
+    "多模态标签润色": process_multimodal_refine
+}
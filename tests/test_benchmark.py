@@ -0,0 +1,60 @@
+import os
+import json
+import argparse
+import pytest
+import benchmark
+
+
+@pytest.fixture
+def results_file(tmp_path, monkeypatch):
+    path = tmp_path / "results.jsonl"
+    monkeypatch.setitem(benchmark.BENCHMARK_CONFIG, "RESULTS_FILE", str(path))
+    return path
+
+
+def _result(version, files_per_sec, latency_p50=0.1, label="", config=None):
+    return {"scenario": "tag", "files": 100, "version": version, "label": label, "config": config or {},
+            "files_per_sec": files_per_sec, "latency_p50": latency_p50, "latency_p99": 0.2, "peak_rss_mb": 100, "bytes_sent": 1000}
+
+
+def _compare(results_file, results, baseline=None):
+    results_file.write_text("".join(json.dumps(result) + "\n" for result in results), encoding="utf-8")
+    return benchmark.command_compare(argparse.Namespace(baseline=baseline, threshold=0.1))
+
+
+def test_compare_flags_regression(results_file, capsys):
+    assert _compare(results_file, [_result("a", 100), _result("b", 80)]) == 1
+    assert "变慢" in capsys.readouterr().out
+
+
+def test_compare_within_threshold(results_file):
+    assert _compare(results_file, [_result("a", 100), _result("b", 95, latency_p50=0.105)]) == 0
+
+
+def test_compare_uses_previous_version_or_baseline(results_file):
+    # 同一版本的多次运行不互相比较
+    assert _compare(results_file, [_result("a", 100), _result("b", 50), _result("b", 100)]) == 0
+    assert _compare(results_file, [_result("a", 200), _result("b", 100, label="新扫描器"), _result("c", 100)], baseline="a") == 1
+    assert _compare(results_file, [_result("a", 200), _result("b", 100, label="新扫描器"), _result("c", 100)], baseline="新扫描器") == 0
+
+
+def test_percentile():
+    assert benchmark._percentile([], 0.5) is None
+    assert benchmark._percentile([3, 1, 2, 4], 0.5) == 3
+    assert benchmark._percentile(list(range(100)), 0.99) == 99
+
+
+def test_prepare_and_reset_dataset(tmp_path, monkeypatch):
+    monkeypatch.setitem(benchmark.BENCHMARK_CONFIG, "DATA_DIR", str(tmp_path / "data"))
+    monkeypatch.setitem(benchmark.BENCHMARK_CONFIG, "FILES_PER_DIR", 3)
+    folder = benchmark.prepare_dataset("captions", 7)
+    paths = sorted(os.path.join(root, name) for root, _, names in os.walk(folder) for name in names if name.endswith(".txt"))
+    assert len(paths) == 7
+    assert len({os.path.dirname(path) for path in paths}) == 3
+    # 已生成的数据集直接复用
+    assert benchmark.prepare_dataset("captions", 7) == folder
+    benchmark.reset_dataset("captions", folder)
+    first = [open(path).read() for path in paths]
+    benchmark.reset_dataset("captions", folder)
+    assert [open(path).read() for path in paths] == first
+    assert all(first)
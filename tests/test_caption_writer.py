@@ -0,0 +1,84 @@
+import os
+import stat
+import time
+import asyncio
+import threading
+import pytest
+import caption_writer
+
+
+@pytest.mark.parametrize("existing, action, expected", [
+    (None, "忽略", "new"),
+    ("old", "忽略", "old"),
+    ("old", "覆盖", "new"),
+    ("old", "加入前面", "new, old"),
+    ("old", "加入后面", "old, new"),
+])
+def test_merge_caption(existing, action, expected):
+    assert caption_writer.merge_caption(existing, "new", action) == expected
+
+
+def test_write_atomic_replaces_file_and_keeps_mode(tmp_path):
+    path = tmp_path / "a.txt"
+    path.write_text("old")
+    os.chmod(path, 0o640)
+    caption_writer.write_atomic(str(path), "new")
+    assert path.read_text() == "new"
+    assert stat.S_IMODE(os.stat(path).st_mode) == 0o640
+    assert os.listdir(tmp_path) == ["a.txt"]
+
+
+def test_write_atomic_failure_keeps_original(tmp_path, monkeypatch):
+    path = tmp_path / "a.txt"
+    path.write_text("old")
+
+    def fail(source, target):
+        raise OSError("disk full")
+    monkeypatch.setattr(os, "replace", fail)
+    with pytest.raises(OSError):
+        caption_writer.write_atomic(str(path), "new")
+    # 原文件不变，也不留下临时文件
+    assert path.read_text() == "old"
+    assert os.listdir(tmp_path) == ["a.txt"]
+
+
+def test_writes_to_same_file_apply_in_order(tmp_path):
+    path = str(tmp_path / "a.txt")
+    futures = [caption_writer.write(path, "tag"),
+               caption_writer.write(path, "refined", "加入后面"),
+               caption_writer.update(path, lambda existing: existing.upper())]
+    caption_writer.flush()
+    assert [future.result() for future in futures] == ["tag", "tag, refined", "TAG, REFINED"]
+    assert open(path).read() == "TAG, REFINED"
+
+
+def test_write_error_is_reported_on_future(tmp_path):
+    future = caption_writer.write(str(tmp_path / "missing" / "a.txt"), "tag")
+    caption_writer.flush()
+    with pytest.raises(OSError):
+        future.result()
+
+
+# 协程在等待写入时被取消（例如任务停止），尚未开始的写入不再执行，也不影响之后的写入
+def test_cancelled_write_is_skipped(tmp_path):
+    path = str(tmp_path / "a.txt")
+    busy = threading.Event()
+
+    def slow_update(existing):
+        busy.set()
+        time.sleep(0.2)
+        return "slow"
+    slow = caption_writer.update(str(tmp_path / "b.txt"), slow_update)
+    # 等写入线程开始处理这一批后再提交，被取消的写入一定在下一批
+    assert busy.wait(5)
+
+    async def cancel_write():
+        task = asyncio.ensure_future(caption_writer.write_async(path, "cancelled"))
+        await asyncio.sleep(0.05)
+        task.cancel()
+        await asyncio.sleep(0)
+    asyncio.run(cancel_write())
+    after = caption_writer.write(str(tmp_path / "c.txt"), "after")
+    assert after.result(timeout=5) == "after"
+    assert slow.result() == "slow"
+    assert not os.path.exists(path)
@@ -0,0 +1,50 @@
+import json
+import pytest
+import cli
+import job_journal
+import tagging_core
+
+
+@pytest.fixture(autouse=True)
+def isolated(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    monkeypatch.setitem(job_journal.JOURNAL_CONFIG, "JOBS_DIR", str(tmp_path / "jobs"))
+    monkeypatch.setattr(cli, "install_interrupt_handler", lambda stopped: None)
+
+
+def _parse(*argv):
+    return cli.build_parser().parse_args(list(argv))
+
+
+def _events(capsys):
+    return [json.loads(line) for line in capsys.readouterr().out.splitlines()]
+
+
+def test_resume_keeps_journaled_concurrency_unless_given():
+    journal = job_journal.start_job("精炼标签", {"folder_path": "d", "refine_model": "qwen2:7b", "prompt2": "p", "hardware": "GPU", "concurrency": 12})
+    journal.finish(stopped=True)
+    function, params = cli.build_job(_parse("resume", journal.job_id))
+    assert function is tagging_core.process_refine
+    assert (params["concurrency"], params["resume_job_id"]) == (12, journal.job_id)
+    _, params = cli.build_job(_parse("resume", journal.job_id, "--concurrency", "2"))
+    assert params["concurrency"] == 2
+
+
+def test_new_job_uses_default_concurrency():
+    _, params = cli.build_job(_parse("refine", "d", "--refine-model", "qwen2:7b", "--refine-prompt", "p"))
+    assert params["concurrency"] == cli.DEFAULT_CONCURRENCY
+
+
+def test_invalid_params_report_error(tmp_path, capsys):
+    args = _parse("tag", str(tmp_path / "missing"), "--model", "llava:7b", "--prompt", "p")
+    assert cli.run_job(args) == 2
+    assert _events(capsys)[-1] == {"event": "error", "message": "无效的文件夹路径。"}
+
+
+def test_failed_job_reports_error(monkeypatch, capsys):
+    def fail(progress=None, scope=None):
+        raise RuntimeError("disk full")
+    monkeypatch.setattr(cli, "build_job", lambda args: (fail, {}))
+    assert cli.run_job(_parse("refine", "d", "--refine-model", "m", "--refine-prompt", "p")) == 1
+    event = _events(capsys)[-1]
+    assert event["event"] == "error" and "disk full" in event["message"]
@@ -0,0 +1,115 @@
+import time
+import asyncio
+import pytest
+import requests
+import concurrency_controller
+from concurrency_controller import AdaptiveLimiter
+
+
+@pytest.fixture(autouse=True)
+def adaptive_config(monkeypatch):
+    monkeypatch.setitem(concurrency_controller.ADAPTIVE_CONFIG, "ENABLED", True)
+    monkeypatch.setitem(concurrency_controller.ADAPTIVE_CONFIG, "INITIAL_LIMIT", 1)
+
+
+def _complete(limiter, error=None, response=None):
+    async def run():
+        started, _ = await limiter.acquire()
+        await limiter.release(started, error, response)
+    asyncio.run(run())
+
+
+def test_limit_grows_by_one_per_window_of_successes():
+    limiter = AdaptiveLimiter("test", 8)
+    assert limiter.current_limit() == 1
+    _complete(limiter)
+    assert limiter.current_limit() == 2
+    # 每次成功增加 1/limit：2 -> 2.5 -> 2.9 -> 3.24
+    _complete(limiter)
+    _complete(limiter)
+    assert limiter.current_limit() == 2
+    _complete(limiter)
+    assert limiter.current_limit() == 3
+
+
+def test_limit_never_exceeds_ceiling():
+    limiter = AdaptiveLimiter("test", 2)
+    for _ in range(20):
+        _complete(limiter)
+    assert limiter.current_limit() == 2
+
+
+def test_failure_halves_limit_once_per_congestion():
+    limiter = AdaptiveLimiter("test", 16)
+    limiter.limit = 8.0
+    started = time.time()
+
+    async def run():
+        await limiter.release(started, requests.Timeout("Read timed out"))
+        # 减速之前已经发出的请求随后失败，不再重复减速
+        await limiter.release(started, requests.ConnectionError("reset"))
+    limiter.in_flight = 2
+    asyncio.run(run())
+    assert limiter.current_limit() == 4
+    assert limiter.decreases == 1
+    _complete(limiter, requests.ConnectionError("reset"))
+    assert limiter.current_limit() == 2
+
+
+def test_limit_does_not_drop_below_one():
+    limiter = AdaptiveLimiter("test", 4)
+    for _ in range(3):
+        _complete(limiter, requests.ConnectionError("reset"))
+        # 每次失败都在上一次减速之后发出
+        limiter.last_decrease -= 1
+    assert limiter.current_limit() == 1
+
+
+def test_server_side_queueing_counts_as_overload(monkeypatch):
+    limiter = AdaptiveLimiter("test", 8)
+    limiter.limit = 4.0
+    # 请求耗时 3 秒，Ollama 报告的计算时间只有 0.5 秒
+    monkeypatch.setattr(time, "time", lambda: 103.0)
+    limiter._on_success(100.0, {"load_duration": 0, "prompt_eval_duration": 1e8, "eval_duration": 4e8})
+    assert limiter.current_limit() == 2
+
+
+def test_disabled_uses_ceiling(monkeypatch):
+    monkeypatch.setitem(concurrency_controller.ADAPTIVE_CONFIG, "ENABLED", False)
+    limiter = AdaptiveLimiter("test", 6)
+    assert limiter.current_limit() == 6
+
+
+def test_set_ceiling_lowers_current_limit():
+    limiter = AdaptiveLimiter("test", 8)
+    limiter.limit = 6.0
+    limiter.set_ceiling(3)
+    assert limiter.current_limit() == 3
+
+
+def test_acquire_waits_for_a_free_place():
+    limiter = AdaptiveLimiter("test", 1)
+
+    async def run():
+        started, _ = await limiter.acquire()
+        second = asyncio.ensure_future(limiter.acquire())
+        await asyncio.sleep(0.01)
+        assert not second.done()
+        assert limiter.waiting == 1
+        await limiter.release(started)
+        _, queue_seconds = await second
+        assert queue_seconds >= 0.01
+        assert limiter.in_flight == 1
+        assert limiter.waiting == 0
+    asyncio.run(run())
+
+
+def test_cancelled_release_keeps_limit():
+    limiter = AdaptiveLimiter("test", 8)
+    limiter.limit = 4.0
+
+    async def run():
+        started, _ = await limiter.acquire()
+        await limiter.release(started, cancelled=True)
+    asyncio.run(run())
+    assert (limiter.limit, limiter.in_flight, limiter.decreases) == (4.0, 0, 0)
@@ -0,0 +1,129 @@
+import os
+import sqlite3
+import pytest
+import dataset_index
+import text_transform
+
+CAPTIONS = {
+    "a.txt": "1girl, Cat ears, smile",
+    "b.txt": "catgirl, dog, 女孩",
+    "c.txt": "landscape, mountain",
+    "sub/d.txt": "cat, dog, 男孩和女孩",
+}
+
+
+@pytest.fixture
+def index(tmp_path, monkeypatch):
+    monkeypatch.setitem(dataset_index.INDEX_CONFIG, "INDEX_DIR", str(tmp_path / "index"))
+    folder = tmp_path / "dataset"
+    for name, caption in CAPTIONS.items():
+        path = folder / name
+        path.parent.mkdir(parents=True, exist_ok=True)
+        path.write_text(caption, encoding="utf-8")
+        (folder / name.replace(".txt", ".jpg")).write_bytes(b"")
+    index = dataset_index.open_index(str(folder))
+    index.refresh()
+    return index
+
+
+def _names(index, paths):
+    return sorted(os.path.relpath(path, index.folder_path).replace(os.sep, "/") for path in paths)
+
+
+@pytest.fixture(params=[True, False], ids=["fts", "scan"])
+def search_index(request, index):
+    if request.param and not index.fts_enabled:
+        pytest.skip("当前 SQLite 不支持 FTS5 trigram")
+    # 不使用全文索引时逐条比较，结果应当相同
+    if not request.param:
+        index.fts_enabled = False
+    return index
+
+
+def test_contains_text(search_index):
+    assert _names(search_index, search_index.search_captions("cat")) == ["a.txt", "b.txt", "sub/d.txt"]
+    assert _names(search_index, search_index.search_captions("Cat", case_sensitive=True)) == ["a.txt"]
+
+
+# trigram 全文索引查不到不足 3 个字符的文字，需要退回逐条比较
+def test_short_text_falls_back_to_scan(search_index):
+    assert _names(search_index, search_index.search_captions("女孩")) == ["b.txt", "sub/d.txt"]
+    assert _names(search_index, search_index.search_captions("do")) == ["b.txt", "sub/d.txt"]
+    assert _names(search_index, search_index.search_captions("CA", case_sensitive=True)) == []
+
+
+def test_whole_word(search_index):
+    assert _names(search_index, search_index.search_captions("cat", mode="完整词语")) == ["a.txt", "sub/d.txt"]
+    assert _names(search_index, search_index.search_captions("cat", case_sensitive=True, mode="完整词语")) == ["sub/d.txt"]
+
+
+def test_regex(search_index):
+    assert _names(search_index, search_index.search_captions(r"^\w+girl", mode="正则表达式")) == ["a.txt", "b.txt"]
+    with pytest.raises(ValueError):
+        search_index.search_captions("(", mode="正则表达式")
+
+
+def test_boolean_expression(index):
+    if not index.fts_enabled:
+        with pytest.raises(ValueError):
+            index.search_captions("cat AND dog", mode="布尔表达式")
+        return
+    assert _names(index, index.search_captions("cat AND dog", mode="布尔表达式")) == ["b.txt", "sub/d.txt"]
+    assert _names(index, index.search_captions("cat NOT dog", mode="布尔表达式")) == ["a.txt"]
+    with pytest.raises(ValueError):
+        index.search_captions("cat AND", mode="布尔表达式")
+
+
+def test_refresh_picks_up_changes(index):
+    folder = index.folder_path
+    with open(os.path.join(folder, "c.txt"), "w", encoding="utf-8") as file:
+        file.write("mountain, black cat")
+    os.remove(os.path.join(folder, "a.txt"))
+    with open(os.path.join(folder, "e.txt"), "w", encoding="utf-8") as file:
+        file.write("cat")
+    index.refresh()
+    assert _names(index, index.search_captions("cat")) == ["b.txt", "c.txt", "e.txt", "sub/d.txt"]
+
+
+def _committed_captions(index):
+    conn = sqlite3.connect(index.db_path)
+    try:
+        return dict(conn.execute("SELECT path, caption FROM files WHERE kind = 'txt'").fetchall())
+    finally:
+        conn.close()
+
+
+# 写入后的内容直接记入索引：同一索引上立即可以搜索到，按批提交，之后刷新不必重新读取
+def test_record_caption_uses_written_content_and_batches_commits(index, monkeypatch):
+    monkeypatch.setitem(dataset_index.INDEX_CONFIG, "RECORD_BATCH", 2)
+    monkeypatch.setitem(dataset_index.INDEX_CONFIG, "RECORD_SECONDS", 3600)
+    folder = index.folder_path
+    paths = [os.path.join(folder, name) for name in ("c.txt", "e.txt", "f.txt")]
+    for path in paths:
+        with open(path, "w") as file:
+            file.write("red fox")
+        dataset_index.record_caption(folder, path, "llava:7b", "describe", "red fox")
+    assert _names(index, index.search_captions("fox")) == ["c.txt", "e.txt", "f.txt"]
+    committed = _committed_captions(index)
+    # 前两条已按批提交，第三条等待下一批
+    assert committed[paths[1]] == "red fox"
+    assert paths[2] not in committed
+    dataset_index.flush_all()
+    assert _committed_captions(index)[paths[2]] == "red fox"
+    assert index.get_provenance(paths[0])["model"] == "llava:7b"
+    assert index.refresh() == (0, 0, 0)
+
+
+# 文字工具修改后不必等到下次刷新，已打开的索引立即可以搜索到新内容
+def test_text_transform_updates_open_index(index, tmp_path):
+    other = tmp_path / "other"
+    other.mkdir()
+    (other / "x.txt").write_text("dog", encoding="utf-8")
+    other_index = dataset_index.open_index(str(other))
+    other_index.refresh()
+    report = text_transform.transform_folder(index.folder_path, [text_transform.replace_operation("dog", "wolf")])
+    assert report.changed == 2
+    assert _names(index, index.search_captions("wolf")) == ["b.txt", "sub/d.txt"]
+    assert index.search_captions("dog") == []
+    assert index.refresh() == (0, 0, 0)
+    assert [os.path.basename(path) for path in other_index.search_captions("dog")] == ["x.txt"]
@@ -0,0 +1,53 @@
+import queue
+import asyncio
+import inference_engine
+
+
+def _collect(out_queue):
+    entries = []
+    while not out_queue.empty():
+        entries.append(out_queue.get())
+    return entries
+
+
+def test_map_bounded_limits_in_flight():
+    state = {"running": 0, "peak": 0}
+
+    async def handler(item):
+        state["running"] += 1
+        state["peak"] = max(state["peak"], state["running"])
+        await asyncio.sleep(0.001)
+        state["running"] -= 1
+        return item * 2
+
+    out_queue = queue.Queue()
+    asyncio.run(inference_engine._run_batch(handler, range(50), 4, out_queue))
+    assert sorted(future.result() for _, future in _collect(out_queue)) == [item * 2 for item in range(50)]
+    assert state["peak"] == 4
+
+
+# 两个阶段合计同时进行的处理不超过并发数量
+def test_pipeline_stages_share_concurrency():
+    state = {"running": 0, "peak": 0}
+
+    async def work():
+        state["running"] += 1
+        state["peak"] = max(state["peak"], state["running"])
+        await asyncio.sleep(0.001)
+        state["running"] -= 1
+
+    async def first(item):
+        await work()
+        # 奇数条目没有第二阶段
+        return f"tag {item}", item if item % 2 == 0 else None
+
+    async def second(item, value):
+        await work()
+        return f"refine {value}"
+
+    out_queue = queue.Queue()
+    asyncio.run(inference_engine._run_pipeline(first, second, list(range(40)), 3, out_queue))
+    entries = _collect(out_queue)
+    assert sorted(future.result() for stage, _, future in entries if stage == 0) == sorted(f"tag {item}" for item in range(40))
+    assert sorted(future.result() for stage, _, future in entries if stage == 1) == sorted(f"refine {item}" for item in range(0, 40, 2))
+    assert state["peak"] <= 3
@@ -0,0 +1,62 @@
+import json
+import pytest
+import job_journal
+
+
+@pytest.fixture(autouse=True)
+def jobs_dir(tmp_path, monkeypatch):
+    monkeypatch.setitem(job_journal.JOURNAL_CONFIG, "JOBS_DIR", str(tmp_path / "jobs"))
+    return tmp_path / "jobs"
+
+
+def test_resume_skips_completed_stages():
+    journal = job_journal.start_job("tag", {"folder_path": "d:/dataset", "concurrency": 4})
+    journal.mark_done("a.jpg", "tag")
+    journal.mark_done("a.jpg", "refine")
+    journal.mark_done("b.jpg", "tag")
+    journal.finish(stopped=True)
+
+    resumed = job_journal.start_job("tag", {}, resume_job_id=journal.job_id)
+    assert resumed.is_done("a.jpg", "tag")
+    assert resumed.is_done("a.jpg", "refine")
+    assert resumed.is_done("b.jpg", "tag")
+    assert not resumed.is_done("b.jpg", "refine")
+    assert resumed.count_done("tag") == 2
+    # 恢复时沿用原任务的参数，而不是恢复时传入的参数
+    assert resumed.header["params"] == {"folder_path": "d:/dataset", "concurrency": 4}
+    resumed.finish(stopped=True)
+
+
+def test_stopped_job_is_listed_until_finished():
+    journal = job_journal.start_job("multi", {"folder_path": "x"})
+    journal.mark_done("a.jpg", "tag")
+    journal.finish(stopped=True)
+    jobs = job_journal.list_unfinished_jobs()
+    assert [(job["job_id"], job["mode"], job["completed"]) for job in jobs] == [(journal.job_id, "multi", 1)]
+    assert job_journal.load_job(journal.job_id)["params"] == {"folder_path": "x"}
+
+    resumed = job_journal.start_job("multi", {}, resume_job_id=journal.job_id)
+    resumed.mark_done("b.jpg", "tag")
+    resumed.finish()
+    assert job_journal.list_unfinished_jobs() == []
+
+
+def test_mark_done_writes_each_stage_once(jobs_dir):
+    journal = job_journal.start_job("refine", {})
+    journal.mark_done("a.txt", "refine")
+    journal.mark_done("a.txt", "refine")
+    journal.finish()
+    entries = [json.loads(line) for line in (jobs_dir / f"{journal.job_id}.jsonl").read_text(encoding="utf-8").splitlines()]
+    assert [entry["type"] for entry in entries] == ["job", "stage", "finished"]
+
+
+def test_truncated_last_line_is_ignored(jobs_dir):
+    journal = job_journal.start_job("tag", {})
+    journal.mark_done("a.jpg", "tag")
+    journal.finish(stopped=True)
+    # 进程在写入最后一行时中断
+    with open(jobs_dir / f"{journal.job_id}.jsonl", "a", encoding="utf-8") as file:
+        file.write('{"type": "stage", "file": "b.j')
+    resumed = job_journal.start_job("tag", {}, resume_job_id=journal.job_id)
+    assert resumed.completed == {("a.jpg", "tag")}
+    resumed.finish(stopped=True)
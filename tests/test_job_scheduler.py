@@ -0,0 +1,129 @@
+import asyncio
+import threading
+import collections
+import pytest
+import job_scheduler
+import concurrency_controller
+
+
+@pytest.fixture(autouse=True)
+def scheduler(monkeypatch):
+    monkeypatch.setattr(job_scheduler, "SCHEDULER_CONFIG", dict(job_scheduler.SCHEDULER_CONFIG))
+    monkeypatch.setattr(job_scheduler, "_queued", [])
+    monkeypatch.setattr(job_scheduler, "_running", [])
+    monkeypatch.setattr(job_scheduler, "_finished", collections.deque(maxlen=10))
+    monkeypatch.setattr(job_scheduler, "_backend_slots", {})
+    monkeypatch.setitem(concurrency_controller.ADAPTIVE_CONFIG, "ENABLED", True)
+    monkeypatch.setitem(concurrency_controller.ADAPTIVE_CONFIG, "INITIAL_LIMIT", 1)
+
+
+# 先占满 capacity 个位置，再按 arrivals 的顺序（优先级列表）排队，逐个释放，返回获得位置的顺序
+async def _grant_order(acquire, release, capacity, arrivals):
+    for _ in range(capacity):
+        await acquire(job_scheduler.PRIORITIES["低"])
+    order = []
+
+    async def wait(name, priority):
+        await acquire(priority)
+        order.append(name)
+    tasks = [asyncio.ensure_future(wait(name, priority)) for name, priority in arrivals]
+    await asyncio.sleep(0)
+    for _ in range(capacity + len(arrivals)):
+        release()
+        await asyncio.sleep(0)
+    await asyncio.gather(*tasks)
+    return order
+
+
+ARRIVALS = [("batch-1", 2), ("batch-2", 2), ("low", 3), ("interactive", 0), ("high", 1), ("batch-3", 2)]
+EXPECTED = ["interactive", "high", "batch-1", "batch-2", "batch-3", "low"]
+
+
+def test_backend_slots_grant_by_priority_then_arrival():
+    job_scheduler.configure(1, 1)
+    slots = job_scheduler.get_backend_slots("http://a")
+    assert asyncio.run(_grant_order(slots.acquire, slots.release, 1, ARRIVALS)) == EXPECTED
+
+
+def test_limiter_grants_by_priority_then_arrival():
+    limiter = concurrency_controller.AdaptiveLimiter("test", 1)
+
+    def release():
+        limiter.in_flight -= 1
+        limiter._wake()
+    assert asyncio.run(_grant_order(limiter.acquire, release, 1, ARRIVALS)) == EXPECTED
+
+
+def test_backend_slots_unbounded_by_default():
+    slots = job_scheduler.get_backend_slots("http://a")
+
+    async def run():
+        for _ in range(100):
+            await asyncio.wait_for(slots.acquire(2), 1)
+    asyncio.run(run())
+    assert slots.in_use == 100
+    assert "在途 100/不限" in job_scheduler.format_backend_slots()
+
+
+@pytest.mark.parametrize("make", ["slots", "limiter"])
+def test_cancelled_waiter_does_not_leak_capacity(make):
+    if make == "slots":
+        job_scheduler.configure(1, 1)
+        holder = job_scheduler.get_backend_slots("http://a")
+        acquire, release, in_use = holder.acquire, holder.release, lambda: holder.in_use
+    else:
+        holder = concurrency_controller.AdaptiveLimiter("test", 1)
+
+        def release():
+            holder.in_flight -= 1
+            holder._wake()
+        acquire, in_use = holder.acquire, lambda: holder.in_flight
+
+    async def run():
+        await acquire(2)
+        waiter = asyncio.ensure_future(acquire(2))
+        await asyncio.sleep(0)
+        waiter.cancel()
+        await asyncio.sleep(0)
+        assert holder.waiting == 0
+        release()
+        assert in_use() == 0
+        # 位置已经分给等待的请求后才被取消，也要还回去
+        await acquire(2)
+        granted = asyncio.ensure_future(acquire(2))
+        await asyncio.sleep(0)
+        release()
+        granted.cancel()
+        await asyncio.sleep(0)
+        assert in_use() == 0
+        await asyncio.wait_for(acquire(2), 1)
+    asyncio.run(run())
+
+
+def test_jobs_start_by_priority_and_can_be_cancelled_while_queued():
+    gate = threading.Event()
+    started = []
+
+    def work(name, progress=None):
+        started.append(name)
+        gate.wait(5)
+        return name
+    running = job_scheduler.submit("running", work, "running")
+    low = job_scheduler.submit("low", work, "low", priority=job_scheduler.PRIORITIES["低"])
+    normal = job_scheduler.submit("normal", work, "normal")
+    high = job_scheduler.submit("high", work, "high", priority=job_scheduler.PRIORITIES["高"])
+    cancelled = job_scheduler.submit("cancelled", work, "cancelled")
+    assert [job.state for job in (low, normal, high)] == ["排队中"] * 3
+    assert (high.position(), normal.position(), low.position()) == (0, 1, 3)
+    assert job_scheduler.cancel_queued("cancelled")
+    assert cancelled.state == "已取消" and "已取消" in cancelled.future.result()
+    gate.set()
+    assert [job.future.result(5) for job in (running, high, normal, low)] == ["running", "high", "normal", "low"]
+    assert started == ["running", "high", "normal", "low"]
+
+
+def test_job_runs_with_its_priority():
+    job = job_scheduler.submit("priority", lambda progress=None: job_scheduler.get_priority(), priority=job_scheduler.PRIORITIES["高"])
+    assert job.future.result(5) == job_scheduler.PRIORITIES["高"]
+    # 未经过调度器的调用按交互优先级处理
+    assert job_scheduler.get_priority() == job_scheduler.INTERACTIVE
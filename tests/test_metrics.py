@@ -0,0 +1,76 @@
+import json
+import pytest
+import metrics
+
+
+@pytest.fixture(autouse=True)
+def gauges(monkeypatch):
+    # 测试中注册的仪表不留在全局列表中
+    monkeypatch.setattr(metrics, "_gauges", list(metrics._gauges))
+
+
+def _sample(text, name):
+    return [line for line in text.splitlines() if line.startswith(name)]
+
+
+def test_counter_and_histogram_render():
+    histogram = metrics.Histogram("test_seconds", "测试", ("model",), buckets=(1, 5))
+    for value in (0.5, 1, 3, 10):
+        histogram.observe(("m",), value)
+    assert histogram.render() == [
+        'test_seconds_bucket{model="m",le="1"} 2',
+        'test_seconds_bucket{model="m",le="5"} 3',
+        'test_seconds_bucket{model="m",le="+Inf"} 4',
+        'test_seconds_sum{model="m"} 14.5',
+        'test_seconds_count{model="m"} 4',
+    ]
+    counter = metrics.Counter("test_total", "测试", ("model", "stage"))
+    counter.inc(('say "hi"', "tag"), 2)
+    assert counter.render() == ['test_total{model="say \\"hi\\"",stage="tag"} 2']
+
+
+def test_registry_returns_existing_metric():
+    assert metrics.counter("ollama_requests_total", "x", ("model", "stage", "status")) is metrics.REQUESTS
+
+
+def test_format_prometheus_includes_responses_and_gauges():
+    metrics.record_response("prom-test", "tag", 0.2, 1.5, {"eval_count": 10, "eval_duration": 5e8})
+    metrics.record_error("prom-test", "tag")
+    metrics.gauge("test_gauge", "测试仪表", ("backend",), lambda: [(("http://a",), 3)])
+    text = metrics.format_prometheus()
+    assert "# TYPE ollama_request_seconds histogram" in text
+    assert 'ollama_requests_total{model="prom-test",stage="tag",status="ok"} 1' in text
+    assert 'ollama_requests_total{model="prom-test",stage="tag",status="error"} 1' in text
+    assert 'ollama_eval_tokens_total{model="prom-test",stage="tag"} 10' in text
+    assert 'ollama_eval_duration_seconds_sum{model="prom-test",stage="tag"} 0.5' in text
+    assert _sample(text, "test_gauge") == ['test_gauge{backend="http://a"} 3']
+
+
+def test_failing_gauge_does_not_break_output():
+    metrics.gauge("test_broken_gauge", "测试", (), lambda: 1 / 0)
+    assert "# TYPE ollama_requests_total counter" in metrics.format_prometheus()
+
+
+def test_quantile_interpolates_within_bucket():
+    assert metrics._quantile((1, 2), [0, 4, 0], 0.5) == pytest.approx(1.5)
+    assert metrics._quantile((1, 2), [0, 0, 3], 0.5) == 2
+    assert metrics._quantile((1, 2), [0, 0, 0], 0.5) is None
+
+
+def test_job_summary_counts_only_this_job(tmp_path):
+    metrics.record_response("summary-test", "tag", 0, 1.0, {})
+    progress = metrics.JobProgress("tag", "job-1")
+    for latency in (0.2, 0.3):
+        metrics.record_response("summary-test", "tag", 0.1, latency, {"eval_count": 5, "eval_duration": 1e9})
+    metrics.record_retry("summary-test", "tag")
+    progress.record("处理完成", 3)
+    progress.record("处理失败", 3)
+    path = tmp_path / "summary.json"
+    summary = progress.finish(stopped=True, path=str(path))
+    assert json.loads(path.read_text(encoding="utf-8")) == summary
+    assert (summary["processed"], summary["failed"], summary["total"], summary["stopped"]) == (2, 1, 3, True)
+    entry = summary["models"]["summary-test/tag"]
+    assert (entry["requests"], entry["errors"], entry["retries"]) == (2, 0, 1)
+    assert entry["latency_mean"] == 0.25
+    assert entry["eval_tokens_per_second"] == 5
+    assert progress not in metrics._active_jobs
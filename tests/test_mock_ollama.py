@@ -0,0 +1,60 @@
+import json
+import pytest
+import requests
+import mock_ollama
+
+
+@pytest.fixture
+def server(monkeypatch):
+    monkeypatch.setattr(mock_ollama, "MOCK_CONFIG", dict(mock_ollama.MOCK_CONFIG))
+    server, url = mock_ollama.start(0, LATENCY=0.01, DISTRIBUTION="fixed", LOAD_DELAY=0.05, MAX_LOADED=1, SEED=1)
+    mock_ollama._reset_stats()
+    yield url
+    server.shutdown()
+    server.server_close()
+
+
+def _generate(url, model, **payload):
+    return requests.post(f"{url}/generate", json=dict({"model": model, "prompt": "describe", "stream": False}, **payload), timeout=10)
+
+
+def _stats(url):
+    return requests.get(url.replace("/api", "/mock/stats"), timeout=10).json()
+
+
+def test_generate_reports_ollama_timings(server):
+    response = _generate(server, "llava:7b", images=["aGk="]).json()
+    assert response["done"] and response["response"]
+    assert response["load_duration"] == int(0.05 * 1e9)
+    assert response["eval_count"] == response["response"].count(",") + 1
+    assert response["prompt_eval_duration"] + response["eval_duration"] == pytest.approx(0.01 * 1e9, rel=0.01)
+    # 模型已加载，第二次请求没有加载时间
+    assert _generate(server, "llava:7b").json()["load_duration"] == 0
+    assert _stats(server)["images"] == 1
+
+
+def test_model_swaps_reload(server):
+    for model in ("llava:7b", "qwen2:7b", "llava:7b", "llava:7b"):
+        _generate(server, model)
+    # 只能同时加载一个模型：切换两次，加上第一次加载
+    assert _stats(server)["loads"] == 3
+
+
+def test_unknown_model_and_injected_errors(server):
+    assert _generate(server, "missing:1b").status_code == 404
+    mock_ollama.configure(ERROR_RATE=1.0)
+    assert _generate(server, "llava:7b").status_code == 500
+    assert _stats(server)["errors"] == 1
+
+
+def test_streaming_ends_with_final_chunk(server):
+    with requests.post(f"{server}/generate", json={"model": "qwen2:7b", "prompt": "hi"}, stream=True, timeout=10) as response:
+        chunks = [json.loads(line) for line in response.iter_lines() if line]
+    assert not any(chunk["done"] for chunk in chunks[:-1])
+    assert chunks[-1]["done"] and chunks[-1]["eval_count"] == len(chunks) - 1
+
+
+def test_keep_alive_zero_unloads(server):
+    _generate(server, "llava:7b")
+    requests.post(f"{server}/generate", json={"model": "llava:7b", "keep_alive": 0}, timeout=10)
+    assert _generate(server, "llava:7b").json()["load_duration"] > 0
@@ -0,0 +1,50 @@
+import asyncio
+import pytest
+import backend_pool
+import job_scheduler
+import concurrency_controller
+import ollama_client
+import result_cache
+import streaming
+import tagging_core
+
+URL = "http://test-backend/api"
+
+
+@pytest.fixture
+def backend(monkeypatch):
+    backend = backend_pool.Backend(URL)
+    monkeypatch.setattr(backend_pool, "_backends", [backend])
+    monkeypatch.setattr(concurrency_controller, "_limiters", {})
+    monkeypatch.setattr(job_scheduler, "_backend_slots", {})
+    monkeypatch.setattr(job_scheduler, "SCHEDULER_CONFIG", dict(job_scheduler.SCHEDULER_CONFIG, BACKEND_SLOTS=1))
+    monkeypatch.setitem(concurrency_controller.ADAPTIVE_CONFIG, "ENABLED", True)
+    monkeypatch.setitem(concurrency_controller.ADAPTIVE_CONFIG, "INITIAL_LIMIT", 2)
+    monkeypatch.setattr(result_cache, "is_enabled", lambda: False)
+    monkeypatch.setattr(streaming, "is_enabled", lambda: False)
+
+    async def hang(url, json, timeout):
+        await asyncio.sleep(60)
+    monkeypatch.setattr(ollama_client, "async_post", hang)
+    return backend
+
+
+# 请求进行中和等待服务器名额时被取消，都只还回位置：并发上限和服务器的完成次数不变
+def test_cancelled_requests_are_not_counted_as_success(backend):
+    payload = {"model": "llava:7b", "prompt": "describe"}
+
+    async def run():
+        in_request = asyncio.ensure_future(tagging_core.generate(payload))
+        waiting_for_slot = asyncio.ensure_future(tagging_core.generate(payload))
+        await asyncio.sleep(0.05)
+        assert job_scheduler.get_backend_slots(URL).waiting == 1
+        for task in (waiting_for_slot, in_request):
+            task.cancel()
+        for task in (waiting_for_slot, in_request):
+            with pytest.raises(asyncio.CancelledError):
+                await task
+    asyncio.run(run())
+    limiter = concurrency_controller.get_limiter(URL, "llava:7b")
+    assert (limiter.limit, limiter.in_flight) == (2.0, 0)
+    assert job_scheduler.get_backend_slots(URL).in_use == 0
+    assert (backend.outstanding, backend.completed, backend.failures) == (0, 0, 0)
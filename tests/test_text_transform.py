@@ -0,0 +1,35 @@
+import re
+import pytest
+import text_transform
+
+
+def _write(folder, captions):
+    for name, caption in captions.items():
+        (folder / name).write_text(caption, encoding="utf-8")
+
+
+def test_parse_rules_reports_line_of_invalid_regex():
+    with pytest.raises(ValueError, match="第 2 行正则表达式无效"):
+        text_transform.parse_rules("去重\n正则: (a => b")
+    with pytest.raises(ValueError, match="第 3 行替换文字无效"):
+        text_transform.parse_rules("去重\n\n正则: foo => \\2")
+    assert text_transform.parse_rules(r"正则: (f)oo => \1x")[0]["replace"] == r"\1x"
+
+
+def test_transform_folder(tmp_path):
+    _write(tmp_path, {"a.txt": "girl, outdoors,  smile, smile", "b.txt": "cat"})
+    operations = text_transform.parse_rules("替换: girl => 1girl\n正则: \\s+, => ,\n去重\n修剪")
+    report = text_transform.transform_folder(str(tmp_path), operations)
+    assert (report.scanned, report.changed, report.errors) == (2, 1, [])
+    assert (tmp_path / "a.txt").read_text(encoding="utf-8") == "1girl, outdoors, smile"
+    assert (tmp_path / "b.txt").read_text(encoding="utf-8") == "cat"
+
+
+# 替换时才出现的正则错误只记为该文件失败，不中止整个处理
+def test_regex_error_is_reported_per_file(tmp_path):
+    _write(tmp_path, {"a.txt": "foo", "b.txt": "foo"})
+    operation = text_transform._operation("regex", "bad", pattern=re.compile("foo"), replace="\\2")
+    report = text_transform.transform_folder(str(tmp_path), [operation])
+    assert report.scanned == 2
+    assert len(report.errors) == 2
+    assert (tmp_path / "a.txt").read_text(encoding="utf-8") == "foo"
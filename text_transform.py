@@ -0,0 +1,278 @@
+import re
+import time
+import logging
+import itertools
+import concurrent.futures
+import dataset_scanner
+import dataset_index
+import caption_writer
+
+# 批量文字处理：把多条操作按顺序组成一个处理流程，对文件夹中的所有 txt 并行执行一遍。
+# 相邻的多条文字替换合并成一个正则同时匹配（较长的优先），内容没有变化的文件不重写，
+# 并统计每条操作的命中次数和涉及的文件数
+
+TRANSFORM_CONFIG = {
+    "MAX_WORKERS": 8,
+    # 同时提交给线程池的文件数，避免一次性为几十万个文件创建任务
+    "CHUNK_SIZE": 256
+}
+
+# 规则文本中每行一条操作，例如：
+#   替换: 查找文字 => 替换文字
+#   正则: \s+, => ,
+#   前加: 插入最前面的文字
+#   后加: 插入最后面的文字
+#   去重
+#   修剪
+RULE_HELP = """每行一条操作，按顺序执行：
+替换: 查找文字 => 替换文字（相邻的多条替换同时匹配）
+正则: 正则表达式 => 替换文字（可以使用 \\1 引用分组）
+前加: 文字（直接插入最前面）
+后加: 文字（以 ", " 连接插入最后面）
+去重：删除重复的逗号分隔标签
+修剪：去掉每个标签前后的空白和空标签"""
+
+
+def _operation(kind, label, **params):
+    return dict(kind=kind, label=label, **params)
+
+
+def replace_operation(find_text, replace_text):
+    return _operation("replace", f"替换 '{find_text}' => '{replace_text}'", find=find_text, replace=replace_text)
+
+
+def regex_operation(pattern, replace_text):
+    try:
+        compiled = re.compile(pattern)
+    except re.error as e:
+        raise ValueError(f"正则表达式无效 '{pattern}': {e}")
+    # 替换文字中的分组引用（例如 \2、\g<name>）在替换时才检查，先对空文字替换一次，无效时在解析阶段报错
+    try:
+        compiled.sub(replace_text, "")
+    except re.error as e:
+        raise ValueError(f"替换文字无效 '{replace_text}': {e}")
+    return _operation("regex", f"正则 '{pattern}' => '{replace_text}'", pattern=compiled, replace=replace_text)
+
+
+def prepend_operation(text, separator=""):
+    return _operation("prepend", f"前加 '{text}'", text=text, separator=separator)
+
+
+def append_operation(text, separator=", "):
+    return _operation("append", f"后加 '{text}'", text=text, separator=separator)
+
+
+def dedupe_operation():
+    return _operation("dedupe", "去重")
+
+
+def trim_operation():
+    return _operation("trim", "修剪")
+
+
+# 把规则文本解析为操作列表，格式错误时抛出 ValueError（包含行号）
+def parse_rules(rules_text):
+    operations = []
+    for line_number, line in enumerate(rules_text.splitlines(), 1):
+        line = line.strip()
+        if not line or line.startswith("#"):
+            continue
+        name, _, argument = line.replace("：", ":", 1).partition(":")
+        name = name.strip()
+        argument = argument.strip()
+        if name in ("替换", "正则"):
+            if "=>" not in argument:
+                raise ValueError(f"第 {line_number} 行缺少 '=>': {line}")
+            find_text, replace_text = (part.strip() for part in argument.split("=>", 1))
+            if not find_text:
+                raise ValueError(f"第 {line_number} 行查找内容为空: {line}")
+            if name == "替换":
+                operations.append(replace_operation(find_text, replace_text))
+                continue
+            try:
+                operations.append(regex_operation(find_text, replace_text))
+            except ValueError as e:
+                raise ValueError(f"第 {line_number} 行{e}: {line}")
+        elif name in ("前加", "后加"):
+            if not argument:
+                raise ValueError(f"第 {line_number} 行文字为空: {line}")
+            operations.append(prepend_operation(argument) if name == "前加" else append_operation(argument))
+        elif name == "去重":
+            operations.append(dedupe_operation())
+        elif name == "修剪":
+            operations.append(trim_operation())
+        else:
+            raise ValueError(f"第 {line_number} 行无法识别的操作: {line}")
+    return operations
+
+
+# 把操作列表编译为处理步骤：相邻的文字替换合并为一步，每一步返回 (新内容, {操作序号: 命中次数})
+def compile_operations(operations):
+    steps = []
+    index = 0
+    while index < len(operations):
+        operation = operations[index]
+        if operation["kind"] == "replace":
+            group = {}
+            while index < len(operations) and operations[index]["kind"] == "replace":
+                group.setdefault(operations[index]["find"], (index, operations[index]["replace"]))
+                index += 1
+            steps.append(_replace_step(group))
+            continue
+        steps.append(_STEP_BUILDERS[operation["kind"]](index, operation))
+        index += 1
+    return steps
+
+
+def _replace_step(group):
+    pattern = re.compile("|".join(re.escape(find_text) for find_text in sorted(group, key=len, reverse=True)))
+
+    def step(content):
+        hits = {}
+
+        def substitute(match):
+            operation_index, replace_text = group[match.group(0)]
+            hits[operation_index] = hits.get(operation_index, 0) + 1
+            return replace_text
+
+        return pattern.sub(substitute, content), hits
+    return step
+
+
+def _regex_step(index, operation):
+    def step(content):
+        new_content, count = operation["pattern"].subn(operation["replace"], content)
+        return new_content, {index: count} if count else {}
+    return step
+
+
+def _prepend_step(index, operation):
+    def step(content):
+        return operation["text"] + operation["separator"] + content, {index: 1}
+    return step
+
+
+def _append_step(index, operation):
+    def step(content):
+        return content + operation["separator"] + operation["text"], {index: 1}
+    return step
+
+
+def _dedupe_step(index, operation):
+    def step(content):
+        seen = set()
+        tags = []
+        for tag in content.split(","):
+            key = tag.strip()
+            if key and key in seen:
+                continue
+            seen.add(key)
+            tags.append(tag)
+        removed = content.count(",") + 1 - len(tags)
+        if not removed:
+            return content, {}
+        return ",".join(tags), {index: removed}
+    return step
+
+
+def _trim_step(index, operation):
+    def step(content):
+        new_content = ", ".join(tag.strip() for tag in content.split(",") if tag.strip())
+        return new_content, {index: 1} if new_content != content else {}
+    return step
+
+
+_STEP_BUILDERS = {
+    "regex": _regex_step,
+    "prepend": _prepend_step,
+    "append": _append_step,
+    "dedupe": _dedupe_step,
+    "trim": _trim_step
+}
+
+
+def transform_text(content, steps):
+    hits = {}
+    for step in steps:
+        content, step_hits = step(content)
+        for operation_index, count in step_hits.items():
+            hits[operation_index] = hits.get(operation_index, 0) + count
+    return content, hits
+
+
+# 先在线程池中读取并试算，内容有变化的文件再交给标签写入线程，按写入时文件的内容重新执行一遍，
+# 与正在运行的批量任务对同一文件的写入按顺序进行；返回 (写入后的内容，未修改时为 None, 命中次数)
+def _transform_file(txt_path, steps):
+    with open(txt_path, "r") as file:
+        content = file.read()
+    new_content, hits = transform_text(content, steps)
+    if new_content == content:
+        return None, hits
+    result = {}
+
+    def apply(existing):
+        if existing is None:
+            raise FileNotFoundError(f"文件已不存在: {txt_path}")
+        new_content, result["hits"] = transform_text(existing, steps)
+        return new_content
+
+    written = caption_writer.update(txt_path, apply).result()
+    return written, result["hits"]
+
+
+class TransformReport:
+    def __init__(self, operations):
+        self.operations = operations
+        self.scanned = 0
+        self.changed = 0
+        self.hits = [0] * len(operations)
+        self.hit_files = [0] * len(operations)
+        self.errors = []
+        self.elapsed = 0
+
+    def add(self, changed, hits):
+        self.scanned += 1
+        if changed:
+            self.changed += 1
+        for operation_index, count in hits.items():
+            self.hits[operation_index] += count
+            self.hit_files[operation_index] += 1
+
+    def format(self):
+        lines = [f"共 {self.scanned} 个txt文件，修改 {self.changed} 个，内容未变化跳过 {self.scanned - self.changed - len(self.errors)} 个，失败 {len(self.errors)} 个，用时 {self.elapsed:.2f}秒"]
+        for operation_index, operation in enumerate(self.operations):
+            lines.append(f"{operation_index + 1}. {operation['label']}: 命中 {self.hits[operation_index]} 次，涉及 {self.hit_files[operation_index]} 个文件")
+        lines.extend(f"{path}: {error}" for path, error in self.errors)
+        return "\n".join(lines)
+
+
+# 对文件夹中的所有 txt 并行执行一遍操作列表，返回 TransformReport
+def transform_folder(folder_path, operations):
+    start_time = time.time()
+    steps = compile_operations(operations)
+    report = TransformReport(operations)
+    txt_paths = dataset_scanner.iter_txt_files(folder_path)
+    with concurrent.futures.ThreadPoolExecutor(max_workers=TRANSFORM_CONFIG["MAX_WORKERS"]) as executor:
+        while True:
+            chunk = list(itertools.islice(txt_paths, TRANSFORM_CONFIG["CHUNK_SIZE"]))
+            if not chunk:
+                break
+            futures = {executor.submit(_transform_file, path, steps): path for path in chunk}
+            written = []
+            for future in concurrent.futures.as_completed(futures):
+                try:
+                    content, hits = future.result()
+                # 单个文件出错（包括替换时才发现的正则错误）只记入报告，不中止整个处理
+                except (OSError, UnicodeDecodeError, re.error) as e:
+                    report.scanned += 1
+                    report.errors.append((futures[future], e))
+                    continue
+                report.add(content is not None, hits)
+                if content is not None:
+                    written.append((futures[future], content))
+            # 每批修改过的文件直接更新已打开的数据集索引，搜索结果不会停留在修改前的内容
+            if written:
+                dataset_index.update_captions(written)
+    report.elapsed = time.time() - start_time
+    logging.info(f"批量文字处理 {folder_path}: 共 {report.scanned} 个文件，修改 {report.changed} 个，失败 {len(report.errors)} 个，用时 {report.elapsed:.2f}秒")
+    return report